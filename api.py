@@ -0,0 +1,300 @@
+"""
+JSON HTTP API for running comparisons from other services:
+
+    python api.py                     # serves on API_HOST:API_PORT
+    uvicorn api:app --port 8000       # or under any ASGI server
+
+    POST   /compare {"product": "Milo 1.5kg", "sites": ["fairprice"]}  -> 202 {"job_id", ...}, 429 when saturated
+    GET    /jobs/{id}                 status, progress and result
+    GET    /jobs/{id}/events          progress as server-sent events, until the job finishes
+    DELETE /jobs/{id}                 cancel
+"""
+import asyncio
+import hmac
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+
+from dotenv import load_dotenv
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from sse_starlette.sse import EventSourceResponse
+
+load_dotenv()
+
+from distributed import is_loopback
+from sites import SITE_ADAPTERS
+
+# Interface to serve on, any other than this host requires API_TOKEN
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+# Comparisons running at once, and comparisons allowed to wait for a slot before new ones get 429
+API_MAX_RUNNING = int(os.getenv("API_MAX_RUNNING", "4"))
+API_MAX_QUEUED = int(os.getenv("API_MAX_QUEUED", "16"))
+# Comparisons allowed to search the same site at once
+API_SITE_CONCURRENCY = int(os.getenv("API_SITE_CONCURRENCY", "2"))
+# Finished jobs kept for GET /jobs/{id}, oldest dropped first
+API_MAX_JOBS_KEPT = int(os.getenv("API_MAX_JOBS_KEPT", "500"))
+# Shared secret callers send as "Authorization: Bearer ..." (required unless the API only listens on this host)
+API_TOKEN = os.getenv("API_TOKEN")
+
+FINISHED = ("done", "failed", "cancelled")
+
+
+class CompareRequest(BaseModel):
+    product: str = Field(min_length=1, max_length=200)
+    sites: list[str] | None = None  # Default: every registered site
+
+
+@dataclass
+class Job:
+    id: str
+    product: str
+    sites: list[str]
+    status: str = "queued"  # queued -> running -> done, failed or cancelled
+    created_at: float = field(default_factory=time.time)
+    started_at: float = None
+    finished_at: float = None
+    events: list[dict] = field(default_factory=list)
+    result: dict = None
+    error: str = None
+    token: object = None  # tools.CancelToken, created when the job starts
+    task: asyncio.Task = None
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def add_event(self, event: dict) -> None:
+        # Runs on the event loop; wakes every stream waiting for news of this job
+        self.events.append({"time": round(time.time(), 3), **event})
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def finish(self, status: str, result: dict = None, error: str = None) -> None:
+        self.status, self.result, self.error = status, result, error
+        self.finished_at = time.time()
+        self.add_event({"event": status})
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "product": self.product,
+            "sites": self.sites,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.events,
+            # Per-site, memory, WebDriver command, speculation, browser, model and navigation reports of this job's run
+            "report": next((event for event in reversed(self.events) if event["event"] == "report"), None),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class ComparisonService:
+    """
+    Runs the API's comparisons: at most max_running at once, at most site_concurrency per site,
+    and refuses new work once max_queued more are waiting.
+    """
+
+    def __init__(
+        self,
+        max_running: int = API_MAX_RUNNING,
+        max_queued: int = API_MAX_QUEUED,
+        site_concurrency: int = API_SITE_CONCURRENCY,
+        max_jobs_kept: int = API_MAX_JOBS_KEPT,
+    ):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.max_jobs_kept = max_jobs_kept
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self.running_slots = asyncio.Semaphore(max_running)
+        self.site_slots = {name: asyncio.Semaphore(site_concurrency) for name in SITE_ADAPTERS}
+        self.comparison = None  # Imported on the first job, like the Streamlit page does
+
+    @property
+    def pending(self) -> int:
+        return sum(job.status not in FINISHED for job in self.jobs.values())
+
+    def saturated(self) -> bool:
+        return self.pending >= self.max_running + self.max_queued
+
+    def submit(self, product: str, sites: list[str]) -> Job:
+        job = Job(id=uuid.uuid4().hex, product=product, sites=sites)
+        self.jobs[job.id] = job
+        job.add_event({"event": "queued"})
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    def cancel(self, job: Job) -> None:
+        if job.status == "queued":
+            job.task.cancel()  # Still waiting for a slot
+        elif job.token is not None:
+            job.token.cancel()  # The agent stops at its next step or tool call
+
+    async def _run(self, job: Job) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            async with AsyncExitStack() as slots:
+                await slots.enter_async_context(self.running_slots)
+                # Always in the same order, so two jobs can't each hold a site the other waits for
+                for name in sorted(job.sites):
+                    await slots.enter_async_context(self.site_slots[name])
+                if self.comparison is None:
+                    self.comparison = await asyncio.to_thread(self._load_comparison)
+                from tools import CancelToken, combine_results
+                job.token = CancelToken()
+                job.status, job.started_at = "running", time.time()
+                job.add_event({"event": "running"})
+                result = await asyncio.to_thread(
+                    self.comparison.run_multi_site_search,
+                    job.product,
+                    job.sites,
+                    job.token,
+                    lambda event: loop.call_soon_threadsafe(job.add_event, event),
+                )
+            if job.token.cancelled:
+                job.finish("cancelled")
+            else:
+                # Nothing found anywhere: still answer with every site's status
+                if result is None:
+                    result = combine_results({
+                        event["site"]: {"status": event["status"]} for event in job.events if event["event"] == "site finished"
+                    })
+                job.finish("done", json.loads(result))
+        except asyncio.CancelledError:
+            job.finish("cancelled")
+        except Exception as e:
+            print(f"Comparison job {job.id} for '{job.product}' failed: {str(e)}")
+            job.finish("failed", error=str(e))
+        finally:
+            self._prune()
+
+    @staticmethod
+    def _load_comparison():
+        import comparison
+        comparison.get_model()
+        return comparison
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(0, len(finished) - self.max_jobs_kept)]:
+            del self.jobs[job_id]
+
+    async def events(self, job: Job):
+        # Replays the job's progress so far, then streams new events until it finishes
+        sent = 0
+        while True:
+            changed = job.changed
+            while sent < len(job.events):
+                yield {"event": job.events[sent]["event"], "data": json.dumps(job.events[sent])}
+                sent += 1
+            if job.status in FINISHED:
+                yield {"event": "result", "data": json.dumps(job.to_dict())}
+                return
+            await changed.wait()
+
+    async def close(self) -> None:
+        for job in self.jobs.values():
+            if job.status not in FINISHED:
+                self.cancel(job)
+        await asyncio.gather(*(job.task for job in self.jobs.values()), return_exceptions=True)
+        if self.comparison is not None:
+            await asyncio.to_thread(self.comparison.driver_pool.close_all)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.service = ComparisonService()
+    try:
+        yield
+    finally:
+        await app.state.service.close()
+
+
+app = FastAPI(title="Price Comparison API", lifespan=lifespan)
+
+
+def authorize(authorization: str = Header(None)) -> None:
+    if API_TOKEN and not hmac.compare_digest((authorization or "").encode(), f"Bearer {API_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+def get_job(job_id: str) -> Job:
+    job = app.state.service.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return job
+
+
+@app.post("/compare", status_code=202, dependencies=[Depends(authorize)])
+async def compare(request: CompareRequest):
+    service = app.state.service
+    unknown = [name for name in request.sites or [] if name not in SITE_ADAPTERS]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown site(s): {', '.join(unknown)}")
+    if service.saturated():
+        return JSONResponse(
+            status_code=429,
+            content={"error": "Too many comparisons in progress, retry later", "pending": service.pending},
+            headers={"Retry-After": "30"},
+        )
+    job = service.submit(request.product.strip(), list(dict.fromkeys(request.sites or SITE_ADAPTERS)))
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+    }
+
+
+@app.get("/jobs/{job_id}", dependencies=[Depends(authorize)])
+async def job_status(job_id: str):
+    return get_job(job_id).to_dict()
+
+
+@app.get("/jobs/{job_id}/events", dependencies=[Depends(authorize)])
+async def job_events(job_id: str):
+    return EventSourceResponse(app.state.service.events(get_job(job_id)))
+
+
+@app.delete("/jobs/{job_id}", dependencies=[Depends(authorize)])
+async def cancel_job(job_id: str):
+    job = get_job(job_id)
+    app.state.service.cancel(job)
+    return {"job_id": job.id, "status": job.status}
+
+
+@app.get("/health")
+async def health():
+    service = app.state.service
+    running = sum(job.status == "running" for job in service.jobs.values())
+    return {
+        "running": running,
+        "queued": service.pending - running,
+        "max_running": service.max_running,
+        "max_queued": service.max_queued,
+        "saturated": service.saturated(),
+        # Browser runs started, and requests that shared a run already in flight instead
+        "comparisons": service.comparison.single_flight.stats if service.comparison else None,
+    }
+
+
+def serve(host: str = API_HOST, port: int = API_PORT) -> None:
+    """
+    Serves the API. Refuses to listen beyond this host without API_TOKEN, anyone reaching the port
+    could otherwise start browser and model runs.
+    """
+    if not API_TOKEN and not is_loopback(host):
+        raise ValueError(f"Set API_TOKEN before serving the API on {host}")
+    import uvicorn
+
+    uvicorn.run(app, host=host, port=port)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,367 @@
+import asyncio
+import threading
+
+from selenium.common.exceptions import (
+    ElementNotInteractableException,
+    NoSuchElementException,
+    NoSuchWindowException,
+    StaleElementReferenceException,
+    TimeoutException,
+    WebDriverException,
+)
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+
+from browser import PLAYWRIGHT_HEADLESS, PLAYWRIGHT_MAX_CONTEXTS
+from throttle import RATE_GOVERNOR, navigation_governor
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Runs a script the way Selenium's execute_script does (arguments[], return value) and hands
+# DOM nodes in the result back as element handles, in one round trip
+EXECUTE_SCRIPT = """
+([args]) => {
+    const result = (function() { %s }).apply(window, args);
+    const nodes = [];
+    const encode = (value, depth) => {
+        if (value instanceof Node) { nodes.push(value); return {__node__: nodes.length - 1}; }
+        if (value === null || value === undefined || typeof value !== 'object' || depth > 8) {
+            return typeof value === 'function' ? null : value;
+        }
+        if (Array.isArray(value) || value instanceof NodeList || value instanceof HTMLCollection) {
+            return Array.from(value, item => encode(item, depth + 1));
+        }
+        const encoded = {};
+        for (const [key, item] of Object.entries(value)) encoded[key] = encode(item, depth + 1);
+        return encoded;
+    };
+    return {value: encode(result, 0), nodes: nodes};
+}
+"""
+
+SELECTOR_PREFIXES = {
+    By.CSS_SELECTOR: "css=",
+    By.XPATH: "xpath=",
+    By.TAG_NAME: "css=",
+}
+
+
+class EventLoopThread:
+    """
+    One asyncio event loop in a background thread, driving every Playwright context of the process.
+    Synchronous code (the agent's tools) submits coroutines to it and waits for their result.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="playwright-loop", daemon=True)
+        self._thread.start()
+
+    def run(self, coro, timeout: float = None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+
+class AsyncBrowser:
+    """
+    A single Chromium driven through Playwright's async API, handing out isolated browser contexts
+    (own cookies, storage and tabs) instead of starting a browser per session.
+    """
+
+    def __init__(self, max_contexts: int = PLAYWRIGHT_MAX_CONTEXTS, headless: bool = PLAYWRIGHT_HEADLESS):
+        self.max_contexts = max_contexts
+        self.headless = headless
+        self._playwright = None
+        self._browser = None
+        self._slots = None
+        self._start_lock = None
+
+    async def _ensure_started(self) -> None:
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+            self._slots = asyncio.Semaphore(self.max_contexts)
+        async with self._start_lock:
+            if self._browser is None or not self._browser.is_connected():
+                # Imported here so the Selenium backend never needs Playwright installed
+                from playwright.async_api import async_playwright
+                self._playwright = self._playwright or await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(
+                    headless=self.headless,
+                    args=["--disable-blink-features=AutomationControlled", "--disable-popup-blocking"],
+                )
+
+    async def new_context(self):
+        """
+        Returns a fresh context and its first page, waiting while max_contexts are in use.
+        """
+        await self._ensure_started()
+        await self._slots.acquire()
+        try:
+            context = await self._browser.new_context(
+                user_agent=USER_AGENT,
+                viewport={"width": 1920, "height": 1080},
+                bypass_csp=True,  # Our in-page scripts must run on every site
+            )
+            await context.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+            page = await context.new_page()
+        except BaseException:
+            self._slots.release()
+            raise
+        return context, page
+
+    async def close_context(self, context) -> None:
+        try:
+            await context.close()
+        finally:
+            self._slots.release()
+
+    async def close(self) -> None:
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+
+class PlaywrightElement:
+    """
+    Selenium WebElement look-alike over a Playwright element handle.
+    """
+
+    def __init__(self, driver: "PlaywrightDriver", handle):
+        self._driver = driver
+        self.handle = handle
+
+    @property
+    def text(self) -> str:
+        return self._driver.execute("getElementText", self.handle.inner_text())
+
+    @property
+    def tag_name(self) -> str:
+        return self._driver.execute("getElementTagName", self.handle.evaluate("element => element.tagName.toLowerCase()"))
+
+    def is_displayed(self) -> bool:
+        return self._driver.execute("isElementDisplayed", self.handle.is_visible())
+
+    def is_enabled(self) -> bool:
+        return self._driver.execute("isElementEnabled", self.handle.is_enabled())
+
+    def get_attribute(self, name: str):
+        return self._driver.execute("getElementAttribute", self.handle.get_attribute(name))
+
+    def click(self) -> None:
+        self._driver.execute("clickElement", self.handle.click(timeout=5000))
+
+    def clear(self) -> None:
+        self._driver.execute("clearElement", self.handle.fill(""))
+
+    def send_keys(self, *values: str) -> None:
+        for value in values:
+            if value in (Keys.RETURN, Keys.ENTER):
+                self._driver.execute("sendKeysToElement", self.handle.press("Enter"))
+            else:
+                self._driver.execute("sendKeysToElement", self.handle.type(value))
+
+    def find_elements(self, by: str = By.CSS_SELECTOR, value: str = None) -> list["PlaywrightElement"]:
+        handles = self._driver.execute("findChildElements", self.handle.query_selector_all(to_selector(by, value)))
+        return [PlaywrightElement(self._driver, handle) for handle in handles]
+
+    def find_element(self, by: str = By.CSS_SELECTOR, value: str = None) -> "PlaywrightElement":
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"No element matches {value!r}")
+        return elements[0]
+
+
+class _SwitchTo:
+    def __init__(self, driver: "PlaywrightDriver"):
+        self._driver = driver
+
+    def window(self, handle: str) -> None:
+        if handle not in self._driver.pages:
+            raise NoSuchWindowException(f"No tab {handle}")
+        self._driver.current_window_handle = handle
+        self._driver.frame = None
+        self._driver.execute("switchToWindow", self._driver.page.bring_to_front())
+
+    def new_window(self, type_hint: str = "tab") -> None:
+        page = self._driver.execute("newWindow", self._driver.context.new_page())
+        self._driver.current_window_handle = self._driver.add_page(page)
+        self._driver.frame = None
+
+    def frame(self, element: PlaywrightElement) -> None:
+        self._driver.frame = self._driver.execute("switchToFrame", element.handle.content_frame())
+
+    def default_content(self) -> None:
+        self._driver.frame = None
+
+
+class PlaywrightDriver:
+    """
+    Selenium WebDriver look-alike over one Playwright browser context, so the tools run unchanged on
+    either backend. Each call is a coroutine run on the shared event loop; like a WebDriver command,
+    every call goes through execute(), which the command profiler wraps.
+    """
+
+    def __init__(self, loop_thread: EventLoopThread, browser: AsyncBrowser, context, page):
+        self._loop_thread = loop_thread
+        self._browser = browser
+        self.context = context
+        self.pages = {}
+        self._next_handle = 0
+        self.current_window_handle = self.add_page(page)
+        self.frame = None  # Set by switch_to.frame
+        self.page_load_timeout = 30.0
+        self.navigating_to = None
+        self.switch_to = _SwitchTo(self)
+
+    def add_page(self, page) -> str:
+        self._next_handle += 1
+        handle = f"tab-{self._next_handle}"
+        self.pages[handle] = page
+        return handle
+
+    @property
+    def page(self):
+        return self.pages[self.current_window_handle]
+
+    @property
+    def target(self):
+        # Frame the commands act on: the switched-to iframe or the page itself
+        return self.frame or self.page
+
+    def execute(self, driver_command: str, params=None):
+        """
+        Runs one command.
+        Args:
+            driver_command: Command name, for profiling
+            params: The coroutine doing the work
+        """
+        from playwright.async_api import Error, TimeoutError as PlaywrightTimeout
+        try:
+            return self._loop_thread.run(params)
+        except PlaywrightTimeout as e:
+            raise TimeoutException(str(e)) from e
+        except Error as e:
+            message = str(e)
+            if "not attached" in message or "detached" in message:
+                raise StaleElementReferenceException(message) from e
+            if "not visible" in message or "intercepts pointer events" in message:
+                raise ElementNotInteractableException(message) from e
+            raise WebDriverException(message) from e
+
+    def set_page_load_timeout(self, seconds: float) -> None:
+        self.page_load_timeout = seconds
+
+    def get(self, url: str) -> None:
+        self.frame = None
+        self.navigating_to = url  # For the navigation governor, which only sees the coroutine
+        self.execute("get", self.page.goto(url, timeout=self.page_load_timeout * 1000, wait_until="load"))
+
+    def back(self) -> None:
+        self.frame = None
+        self.execute("goBack", self.page.go_back(timeout=self.page_load_timeout * 1000))
+
+    @property
+    def current_url(self) -> str:
+        return self.page.url
+
+    @property
+    def title(self) -> str:
+        return self.execute("getTitle", self.page.title())
+
+    @property
+    def window_handles(self) -> list[str]:
+        return [handle for handle, page in self.pages.items() if not page.is_closed()]
+
+    def execute_script(self, script: str, *args):
+        async def run():
+            plain_args = [arg.handle if isinstance(arg, PlaywrightElement) else arg for arg in args]
+            result = await self.target.evaluate_handle(EXECUTE_SCRIPT % script, [plain_args])
+            try:
+                value = await result.evaluate("result => result.value")
+                nodes = []
+                if await result.evaluate("result => result.nodes.length"):
+                    properties = await (await result.get_property("nodes")).get_properties()
+                    nodes = [properties[str(index)].as_element() for index in range(len(properties))]
+            finally:
+                await result.dispose()
+            return value, nodes
+
+        value, nodes = self.execute("executeScript", run())
+        return self._decode(value, nodes) if nodes else value
+
+    def _decode(self, value, nodes):
+        if isinstance(value, dict):
+            if set(value) == {"__node__"}:
+                return PlaywrightElement(self, nodes[value["__node__"]])
+            return {key: self._decode(item, nodes) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._decode(item, nodes) for item in value]
+        return value
+
+    def find_elements(self, by: str = By.CSS_SELECTOR, value: str = None) -> list[PlaywrightElement]:
+        handles = self.execute("findElements", self.target.query_selector_all(to_selector(by, value)))
+        return [PlaywrightElement(self, handle) for handle in handles]
+
+    def find_element(self, by: str = By.CSS_SELECTOR, value: str = None) -> PlaywrightElement:
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"No element matches {value!r}")
+        return elements[0]
+
+    def get_screenshot_as_png(self) -> bytes:
+        return self.execute("screenshot", self.page.screenshot(type="png"))
+
+    def close(self) -> None:
+        # Closes the current tab, like Selenium the driver has no current tab until switched
+        self.execute("closeWindow", self.page.close())
+
+    def quit(self) -> None:
+        self.execute("quit", self._browser.close_context(self.context))
+
+
+def to_selector(by: str, value: str) -> str:
+    # Selenium locator to a Playwright selector
+    if by not in SELECTOR_PREFIXES:
+        raise WebDriverException(f"Locator strategy {by!r} is not supported by the Playwright backend")
+    return SELECTOR_PREFIXES[by] + value
+
+
+class PlaywrightPool:
+    """
+    Same interface as browser.DriverPool, but every session is a new context of one shared browser,
+    so many comparisons can run at once in a single process.
+    """
+
+    def __init__(self, max_contexts: int = PLAYWRIGHT_MAX_CONTEXTS):
+        self._loop_thread = None
+        self._browser = AsyncBrowser(max_contexts)
+        self._lock = threading.Lock()
+
+    def _loop(self) -> EventLoopThread:
+        with self._lock:
+            if self._loop_thread is None:
+                self._loop_thread = EventLoopThread()
+            return self._loop_thread
+
+    def acquire(self) -> PlaywrightDriver:
+        loop_thread = self._loop()
+        context, page = loop_thread.run(self._browser.new_context())
+        driver = PlaywrightDriver(loop_thread, self._browser, context, page)
+        if RATE_GOVERNOR:
+            navigation_governor.attach(driver)
+        return driver
+
+    def release(self, driver: PlaywrightDriver, discard: bool = False) -> None:
+        # Contexts are cheap to create, so they are never reused
+        if driver is None:
+            return
+        try:
+            driver.quit()
+        except Exception as e:
+            print(f"Could not close browser context: {str(e)}")
+
+    def close_all(self) -> None:
+        if self._loop_thread is not None:
+            self._loop_thread.run(self._browser.close())
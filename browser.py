@@ -0,0 +1,632 @@
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import helium
+import psutil
+from selenium import webdriver
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from network import NETWORK_CAPTURE, enable_capture
+from sites import SITE_ADAPTERS, SiteAdapter
+from throttle import RATE_GOVERNOR, navigation_governor
+
+# "selenium" (helium + chromedriver, one session per process) or "playwright" (many browser contexts per process)
+BROWSER_BACKEND = os.getenv("BROWSER_BACKEND", "selenium").lower()
+# Concurrent sessions and headless mode of the Playwright backend
+PLAYWRIGHT_MAX_CONTEXTS = int(os.getenv("PLAYWRIGHT_MAX_CONTEXTS", "32"))
+PLAYWRIGHT_HEADLESS = os.getenv("PLAYWRIGHT_HEADLESS", "true").lower() == "true"
+
+# Open every retailer in its own tab of a single browser instead of navigating one tab back and forth
+MULTI_TAB = os.getenv("MULTI_TAB", "false").lower() == "true"
+
+# Fixed DevTools port of the browser, "0" leaves it to chromedriver
+CHROME_DEBUG_PORT = os.getenv("CHROME_DEBUG_PORT", "9222")
+
+# Chrome flags that trade some speed for a smaller memory footprint
+LOW_MEMORY_CHROME = os.getenv("LOW_MEMORY_CHROME", "false").lower() == "true"
+LOW_MEMORY_FLAGS = [
+    "--renderer-process-limit=2",
+    "--process-per-site",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-dev-shm-usage",
+    "--disable-features=Translate,BackForwardCache,MediaRouter",
+    "--js-flags=--max-old-space-size=512",
+]
+
+# Restart the browser once its process tree uses more than this many MB (0 disables recycling)
+CHROME_MAX_RSS_MB = float(os.getenv("CHROME_MAX_RSS_MB", "0"))
+
+# Count and time every WebDriver command, per tool
+PROFILE_WEBDRIVER = os.getenv("PROFILE_WEBDRIVER", "true").lower() == "true"
+
+# Reusable Chrome profiles (HTTP cache, cookies, dismissed first-visit pop-ups), one per running browser.
+# An empty root starts every browser from a fresh profile.
+CHROME_PROFILE_ROOT = os.getenv("CHROME_PROFILE_ROOT", "browser_profiles")
+# Disk cache limit passed to Chrome; profiles grown past twice this are trimmed when leased
+CHROME_CACHE_MB = int(os.getenv("CHROME_CACHE_MB", "300"))
+# Profiles older than this are wiped and start over (0 keeps them forever)
+CHROME_PROFILE_MAX_AGE_HOURS = float(os.getenv("CHROME_PROFILE_MAX_AGE_HOURS", "72"))
+# Cache folders inside a profile that are safe to delete
+PROFILE_CACHE_DIRS = ["Default/Cache", "Default/Code Cache", "Default/Service Worker/CacheStorage", "GrShaderCache"]
+
+# How many idle browsers to keep warm between comparisons (0 closes the browser after every run)
+DRIVER_POOL_SIZE = int(os.getenv("DRIVER_POOL_SIZE", "1"))
+
+
+def lock_file(fd: int) -> None:
+    # Exclusive lock on an open file without waiting, raises OSError when someone else holds it
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+
+class ProfileManager:
+    """
+    Hands out reusable Chrome user-data directories. Chrome can't share a profile between running
+    browsers, so each one leases its own directory, holding an exclusive OS lock on a file next to it
+    so browsers in other processes (e.g. watchlist workers) skip it and crashed owners don't keep it.
+    """
+
+    def __init__(self, root: str = CHROME_PROFILE_ROOT, cache_mb: int = CHROME_CACHE_MB,
+                 max_age_hours: float = CHROME_PROFILE_MAX_AGE_HOURS):
+        self.root = root
+        self.cache_mb = cache_mb
+        self.max_age_hours = max_age_hours
+        self._held: dict[str, int] = {}  # Leased directory -> open descriptor of its lock file
+        self._guard = threading.Lock()
+
+    def lease(self) -> str | None:
+        """
+        Returns the first free profile directory (creating it if needed), or None when profiles are disabled.
+        """
+        if not self.root:
+            return None
+        os.makedirs(self.root, exist_ok=True)
+        for index in itertools.count():
+            path = os.path.abspath(os.path.join(self.root, f"profile-{index}"))
+            if self._lock(path):
+                self._maintain(path)
+                return path
+
+    def release(self, path: str | None) -> None:
+        with self._guard:
+            fd = self._held.pop(path, None) if path else None
+        if fd is not None:
+            os.close(fd)  # Closing the file releases its lock
+
+    def _lock(self, path: str) -> bool:
+        # The lock file stays in place, what is held is an OS lock on it, which the kernel drops
+        # when its owner exits or crashes, so there is no stale lock to detect and reclaim
+        fd = os.open(path + ".lock", os.O_CREAT | os.O_RDWR)
+        try:
+            lock_file(fd)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())  # For people looking at the directory
+        with self._guard:
+            self._held[path] = fd
+        return True
+
+    def _maintain(self, path: str) -> None:
+        # Periodic reset of old profiles, and a trim of the caches Chrome's own limit doesn't cover
+        marker = os.path.join(path, ".created")
+        if os.path.exists(marker) and self.max_age_hours and time.time() - os.path.getmtime(marker) > self.max_age_hours * 3600:
+            print(f"Resetting browser profile {path}")
+            shutil.rmtree(path, ignore_errors=True)
+        if not os.path.exists(marker):
+            os.makedirs(path, exist_ok=True)
+            open(marker, "w").close()
+            return
+        if self.cache_mb and directory_mb(path) > 2 * self.cache_mb:
+            print(f"Trimming the caches of browser profile {path}")
+            for name in PROFILE_CACHE_DIRS:
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def directory_mb(path: str) -> float:
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                continue
+    return total / (1024 * 1024)
+
+
+profile_manager = ProfileManager()
+
+
+# Initialize driver only when needed
+def initialize_driver(low_memory: bool = LOW_MEMORY_CHROME, profile_dir: str = None, capture: bool = NETWORK_CAPTURE):
+    chrome_options = webdriver.ChromeOptions()
+    
+    # Make automation less detectable
+    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+    
+    # Add realistic user agent
+    chrome_options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+    
+    # Additional settings to reduce bot detection
+    chrome_options.add_argument('--disable-infobars')
+    chrome_options.add_argument('--start-maximized')
+    chrome_options.add_argument('--disable-popup-blocking')
+    chrome_options.add_argument("--force-device-scale-factor=1")
+    chrome_options.add_argument("--window-size=1920,1080")
+    chrome_options.add_argument("--disable-pdf-viewer")
+    
+    # Create CDP capabilities to modify navigator.webdriver flag
+    # (set CHROME_DEBUG_PORT=0 to let chromedriver pick a free port when running several browsers)
+    if CHROME_DEBUG_PORT != "0":
+        chrome_options.add_argument(f'--remote-debugging-port={CHROME_DEBUG_PORT}')
+    
+    if low_memory:
+        for flag in LOW_MEMORY_FLAGS:
+            chrome_options.add_argument(flag)
+    
+    if capture:
+        enable_capture(chrome_options)
+    
+    if profile_dir:
+        # Warm HTTP cache and cookies from earlier runs
+        chrome_options.add_argument(f"--user-data-dir={profile_dir}")
+        chrome_options.add_argument(f"--disk-cache-size={CHROME_CACHE_MB * 1024 * 1024}")
+        chrome_options.add_argument("--hide-crash-restore-bubble")
+    
+    driver = helium.start_chrome(headless=False, options=chrome_options)
+    driver.profile_dir = profile_dir
+    return driver
+
+
+def start_leased_driver(profile_dir: str = None):
+    """
+    Starts a browser on a leased profile (or on the given one), giving the lease back if Chrome fails to start.
+    """
+    profile_dir = profile_dir or profile_manager.lease()
+    try:
+        driver = initialize_driver(profile_dir=profile_dir)
+    except BaseException:
+        profile_manager.release(profile_dir)
+        raise
+    if RATE_GOVERNOR:
+        navigation_governor.attach(driver)
+    return driver
+
+
+class SiteTabs:
+    """
+    Keeps one browser tab per retailer in a single Chrome session.
+    All tabs start loading their search page at once, the tools and the screenshot
+    callback then simply work on whichever tab is switched to.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.handles: dict[str, str] = {}
+        self.urls: dict[str, str] = {}
+
+    def open_all(self, product_name: str, adapters: list[SiteAdapter] = None) -> None:
+        """
+        Opens a tab per site and starts loading its search results without waiting for the page.
+        Args:
+            product_name: The product to search for
+            adapters: Sites to open (default: every registered site)
+        """
+        adapters = adapters or list(SITE_ADAPTERS.values())
+        self.open_urls({adapter.name: adapter.search_url(product_name) for adapter in adapters})
+
+    def open_urls(self, urls: dict[str, str]) -> None:
+        """
+        Opens a tab per site on the given urls without waiting for the pages, then focuses the first one.
+        Args:
+            urls: Mapping of site name to the url its tab should load
+        """
+        self.handles, self.urls = {}, {}
+        for index, (name, url) in enumerate(urls.items()):
+            if index == 0:
+                # Reuse the window Chrome started with
+                handle = self.driver.current_window_handle
+            else:
+                self.driver.switch_to.new_window('tab')
+                handle = self.driver.current_window_handle
+            if url:
+                if RATE_GOVERNOR:
+                    navigation_governor.acquire(url)
+                # Assigning location returns immediately, so every tab loads in parallel
+                self.driver.execute_script("window.location.href = arguments[0];", url)
+            self.handles[name] = handle
+            self.urls[name] = url
+        if urls:
+            self.switch_to(next(iter(urls)))
+
+    def switch_to(self, site_name: str, url: str = None) -> bool:
+        """
+        Brings the tab of a site to the front, optionally loading another url in it.
+        Args:
+            site_name: Registered site name
+            url: Url the tab should show (default: keep the current page)
+        Returns:
+            bool: False if the site has no tab
+        """
+        handle = self.handles.get(site_name)
+        if handle is None or handle not in self.driver.window_handles:
+            return False
+        if self.driver.current_window_handle != handle:
+            self.driver.switch_to.window(handle)
+        if url and url != self.urls.get(site_name):
+            self.driver.get(url)
+            self.urls[site_name] = url
+        return True
+
+    def site_of_current_tab(self) -> str | None:
+        # Name of the site owning the focused tab
+        current = self.driver.current_window_handle
+        for name, handle in self.handles.items():
+            if handle == current:
+                return name
+        return None
+
+    def replace_handle(self, old: str, new: str) -> None:
+        # A site's page moved to another tab (e.g. a preloaded one), which has to be reloaded on the next search
+        for name, handle in self.handles.items():
+            if handle == old:
+                self.handles[name] = new
+                self.urls[name] = None
+
+    def adopt_current_tab(self) -> None:
+        """
+        Keeps the tab bookkeeping right when the agent navigated the focused tab to another site
+        (e.g. with helium's go_to): the focused tab becomes that site's tab and the site's old tab
+        is handed over to the previous owner, to be reloaded on its next use.
+        """
+        owner = self.site_of_current_tab()
+        shown = None
+        for name, adapter in SITE_ADAPTERS.items():
+            if name in self.handles and adapter.matches(self.driver.current_url):
+                shown = name
+                break
+        if owner is None or shown is None or shown == owner:
+            return
+        current = self.handles[owner]
+        self.handles[owner], self.handles[shown] = self.handles[shown], current
+        self.urls[owner], self.urls[shown] = None, self.driver.current_url
+
+
+def browser_rss_mb(driver) -> float:
+    """
+    Returns the resident memory of chromedriver and every Chrome process it started, in MB.
+    Args:
+        driver: Selenium Chrome driver
+    """
+    try:
+        root = psutil.Process(driver.service.process.pid)
+        processes = [root] + root.children(recursive=True)
+    except (AttributeError, psutil.Error):
+        return 0.0
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
+            continue  # Renderer exited while we were walking the tree
+    return total / (1024 * 1024)
+
+
+class MemoryGovernor:
+    """
+    Samples the browser's memory after every agent step and decides when the session should be recycled.
+    """
+
+    def __init__(self, max_rss_mb: float = CHROME_MAX_RSS_MB):
+        self.max_rss_mb = max_rss_mb
+        self.samples: list[float] = []
+        self.restarts = 0
+
+    def sample(self, driver) -> float:
+        rss = browser_rss_mb(driver)
+        if rss > 0:
+            self.samples.append(rss)
+        return rss
+
+    def over_limit(self) -> bool:
+        return bool(self.max_rss_mb) and bool(self.samples) and self.samples[-1] > self.max_rss_mb
+
+    def report(self) -> dict:
+        return {
+            "peak_mb": round(max(self.samples), 1) if self.samples else None,
+            "average_mb": round(sum(self.samples) / len(self.samples), 1) if self.samples else None,
+            "samples": len(self.samples),
+            "restarts": self.restarts,
+        }
+
+
+class CommandProfiler:
+    """
+    Counts and times the WebDriver commands (one chromedriver HTTP round trip each) sent by a browser,
+    attributed to the tool or callback running at the time. Commands sent by the agent's own helium
+    code are attributed to "agent code".
+    """
+
+    def __init__(self):
+        self.stats: dict[str, dict] = {}
+        self._sections = []
+
+    def attach(self, driver) -> None:
+        # Wrap the driver's execute, which every driver and element command goes through
+        if driver is None or getattr(driver.execute, "profiled", False):
+            return
+        execute = driver.execute
+
+        def profiled_execute(driver_command, params=None):
+            started = time.perf_counter()
+            try:
+                return execute(driver_command, params)
+            finally:
+                self.record(driver_command, time.perf_counter() - started)
+
+        profiled_execute.profiled = True
+        profiled_execute.wrapped = execute
+        driver.execute = profiled_execute
+
+    @staticmethod
+    def detach(driver) -> None:
+        # Back to the execute it wrapped (the navigation governor's, or the driver's own)
+        if driver is not None and getattr(driver.execute, "profiled", False):
+            driver.execute = driver.execute.wrapped
+
+    @contextmanager
+    def section(self, name: str):
+        self._sections.append(name)
+        try:
+            yield
+        finally:
+            self._sections.pop()
+
+    def record(self, command: str, seconds: float) -> None:
+        name = self._sections[-1] if self._sections else "agent code"
+        stats = self.stats.setdefault(name, {"commands": 0, "seconds": 0.0, "by_command": {}})
+        stats["commands"] += 1
+        stats["seconds"] += seconds
+        stats["by_command"][command] = stats["by_command"].get(command, 0) + 1
+
+    def report(self) -> dict:
+        """
+        Returns per-section command counts and seconds, busiest first, with the most frequent commands.
+        """
+        report = {}
+        for name, stats in sorted(self.stats.items(), key=lambda item: item[1]["seconds"], reverse=True):
+            top = sorted(stats["by_command"].items(), key=lambda item: item[1], reverse=True)[:5]
+            report[name] = {"commands": stats["commands"], "seconds": round(stats["seconds"], 2), "top_commands": dict(top)}
+        return report
+
+
+def restart_driver(driver, site_tabs: SiteTabs = None):
+    """
+    Kills the browser and starts a fresh one on the same page(s), so the agent can carry on with its next step.
+    Args:
+        driver: The current driver
+        site_tabs: Tabs to reopen when running in multi-tab mode
+    Returns:
+        The new driver, also registered with helium
+    """
+    urls = {}
+    current_site = None
+    current_url = None
+    try:
+        current_url = driver.current_url
+        if site_tabs is not None:
+            current_site = site_tabs.site_of_current_tab()
+            for name, handle in site_tabs.handles.items():
+                driver.switch_to.window(handle)
+                urls[name] = driver.current_url
+    except Exception as e:
+        print(f"Could not read open pages before restarting the browser: {str(e)}")
+
+    try:
+        helium.kill_browser()
+    except Exception:
+        pass
+
+    # Same profile, so the new browser starts with the warm cache (the lease moves over with it)
+    new_driver = start_leased_driver(getattr(driver, "profile_dir", None))
+    if site_tabs is not None and urls:
+        site_tabs.driver = new_driver
+        site_tabs.open_urls(urls)
+        if current_site:
+            site_tabs.switch_to(current_site)
+    elif current_url and current_url.startswith("http"):
+        new_driver.get(current_url)
+    return new_driver
+
+
+class DriverPool:
+    """
+    Keeps started browsers between comparisons so a run does not pay Chrome's start-up again.
+    Browsers grown past the memory limit are recycled when they are handed back.
+    """
+
+    def __init__(self, max_idle: int = DRIVER_POOL_SIZE, max_rss_mb: float = CHROME_MAX_RSS_MB):
+        self.max_idle = max_idle
+        self.max_rss_mb = max_rss_mb
+        self._idle = []
+        self._lock = threading.Lock()
+        # Browsers handed out warm from the pool and started cold, with the seconds acquire took for each
+        self.stats = {"warm": 0, "cold": 0, "warm_seconds": 0.0, "cold_seconds": 0.0}
+
+    def acquire(self):
+        """
+        Returns a warm browser from the pool, or starts a new one.
+        """
+        started = time.perf_counter()
+        while True:
+            with self._lock:
+                driver = self._idle.pop() if self._idle else None
+            if driver is None:
+                driver = start_leased_driver()
+                self._count("cold", started)
+                return driver
+            if is_alive(driver):
+                self._count("warm", started)
+                return driver
+            quit_driver(driver)
+
+    def _count(self, kind: str, started: float) -> None:
+        with self._lock:
+            self.stats[kind] += 1
+            self.stats[f"{kind}_seconds"] += time.perf_counter() - started
+
+    def report(self) -> dict:
+        # Average seconds to get a browser from the pool versus starting one
+        with self._lock:
+            return {
+                "warm": self.stats["warm"],
+                "cold": self.stats["cold"],
+                "warm_average_seconds": round(self.stats["warm_seconds"] / self.stats["warm"], 3) if self.stats["warm"] else None,
+                "cold_average_seconds": round(self.stats["cold_seconds"] / self.stats["cold"], 2) if self.stats["cold"] else None,
+            }
+
+    def release(self, driver, discard: bool = False) -> None:
+        """
+        Hands a browser back: it is reset to a single blank tab and kept, unless the pool is full,
+        it is over the memory limit or the caller asks for it to be discarded.
+        Args:
+            driver: The browser to give back
+            discard: Close the browser instead of keeping it
+        """
+        if driver is None:
+            return
+        if not discard and self.max_rss_mb and browser_rss_mb(driver) > self.max_rss_mb:
+            print("Recycling browser over the memory limit")
+            discard = True
+        if not discard:
+            try:
+                handles = driver.window_handles
+                for handle in handles[1:]:
+                    driver.switch_to.window(handle)
+                    driver.close()
+                driver.switch_to.window(handles[0])
+                driver.get("about:blank")
+            except Exception as e:
+                print(f"Could not reset browser, closing it: {str(e)}")
+                discard = True
+        with self._lock:
+            if not discard and len(self._idle) < self.max_idle:
+                self._idle.append(driver)
+                return
+        quit_driver(driver)
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for driver in idle:
+            quit_driver(driver)
+
+
+def is_alive(driver) -> bool:
+    try:
+        driver.window_handles
+        return True
+    except Exception:
+        return False
+
+
+def quit_driver(driver) -> None:
+    try:
+        driver.quit()
+    except Exception:
+        pass
+    profile_manager.release(getattr(driver, "profile_dir", None))
+
+
+def benchmark_pool(runs: int = 3) -> dict:
+    """
+    Times getting a browser ready for a comparison: a fresh launch every time versus the pool
+    handing the same warm browser back.
+    Args:
+        runs: Comparisons simulated each way
+    Returns:
+        dict: DriverPool.report() of each way
+    """
+    cold = DriverPool(max_idle=0)  # Keeps nothing, every acquire starts Chrome
+    warm = DriverPool(max_idle=1)
+    try:
+        for pool in (cold, warm):
+            for _ in range(runs):
+                driver = pool.acquire()
+                driver.get("about:blank")
+                pool.release(driver)
+        return {"fresh launch": cold.report(), "pool": warm.report()}
+    finally:
+        warm.close_all()
+
+
+# What the Streamlit page imports on a cold start, and what load_comparison defers to the first comparison
+PAGE_IMPORTS = "import pandas, streamlit, dotenv, history, sites"
+COMPARISON_IMPORTS = "import comparison"
+
+
+def time_imports(statement: str) -> float | None:
+    # Seconds a fresh interpreter takes to run the import statement, None if it fails
+    code = f"import time\nstarted = time.perf_counter()\n{statement}\nprint(time.perf_counter() - started)"
+    done = subprocess.run(
+        [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+    )
+    if done.returncode != 0:
+        error = done.stderr.strip().splitlines()
+        print(f"Could not time {statement!r}: {error[-1] if error else done.returncode}")
+        return None
+    return float(done.stdout.strip().splitlines()[-1])
+
+
+def benchmark_startup(runs: int = 3) -> dict:
+    """
+    Times the app's own cold start in fresh interpreters: the imports the page pays on start now
+    that selenium, helium, smolagents and the tools wait for the first comparison, the deferred
+    imports that comparison pays once, and both together, which every start paid before.
+    Args:
+        runs: Interpreters started each way
+    Returns:
+        dict: Average seconds each way, None where the imports failed
+    """
+    ways = {
+        "page (deferred imports)": PAGE_IMPORTS,
+        "first comparison": COMPARISON_IMPORTS,
+        "page (everything imported at start)": f"{PAGE_IMPORTS}\n{COMPARISON_IMPORTS}",
+    }
+    averages = {}
+    for name, statement in ways.items():
+        seconds = [time_imports(statement) for _ in range(runs)]
+        averages[name] = round(sum(seconds) / runs, 3) if None not in seconds else None
+    return averages
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Start-up benchmarks")
+    parser.add_argument("--benchmark-pool", type=int, default=0, metavar="RUNS", help="Browser acquisitions timed each way")
+    parser.add_argument("--benchmark-startup", type=int, default=0, metavar="RUNS", help="App cold starts timed each way")
+    args = parser.parse_args()
+    if args.benchmark_startup:
+        print(json.dumps(benchmark_startup(args.benchmark_startup), indent=2))
+    if args.benchmark_pool or not args.benchmark_startup:
+        print(json.dumps(benchmark_pool(args.benchmark_pool or 3), indent=2))
@@ -0,0 +1,534 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+from smolagents import CodeAgent
+from smolagents.agents import ActionStep
+
+import tools
+from async_browser import PlaywrightPool
+from browser import BROWSER_BACKEND, MULTI_TAB, PROFILE_WEBDRIVER, CommandProfiler, DriverPool, MemoryGovernor, SiteTabs
+from history import PriceHistory
+from models import get_model, model_report
+from network import NETWORK_CAPTURE, ResponseCapture, best_match
+from run_log import RUN_LOG, RunLog
+from sites import SITE_ADAPTERS, SiteAdapter
+from speculation import SPECULATE, Speculator
+from throttle import RATE_GOVERNOR, navigation_governor
+from trajectories import TRAJECTORY_CACHE, TrajectoryCache, instantiate, is_failure, url_shape
+from tools import TOOLS, CancelToken, combine_results, govern_memory, helium_instructions, save_screenshot, speculate, stream_step
+
+# Agent steps and wall-clock seconds each site gets before it is marked "timed out"
+SITE_MAX_STEPS = int(os.getenv("SITE_MAX_STEPS", "8"))
+SITE_DEADLINE_SECONDS = float(os.getenv("SITE_DEADLINE_SECONDS", "150"))
+
+# Agent runs at once in run_comparisons (they take turns on the Selenium backend)
+MAX_CONCURRENT_COMPARISONS = int(os.getenv("MAX_CONCURRENT_COMPARISONS", "8"))
+
+# Identical comparisons requested while one is running wait for it and share its result
+COALESCE_COMPARISONS = os.getenv("COALESCE_COMPARISONS", "true").lower() == "true"
+
+# Warm browsers (or browser contexts on the Playwright backend) shared by every comparison in this process
+driver_pool = PlaywrightPool() if BROWSER_BACKEND == "playwright" else DriverPool()
+
+class _Flight:
+    # One running comparison and the callers waiting for it
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.events = []
+        self.listeners = []
+
+
+class SingleFlight:
+    """
+    Runs one comparison per key at a time: callers asking for a key that is already running attach
+    to that run, receive its progress events and share its result instead of starting their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict[tuple, _Flight] = {}
+        self.stats = {"runs": 0, "coalesced": 0}
+
+    @staticmethod
+    def key(product_name: str, sites: list[str] = None) -> tuple:
+        # Same product whatever the case and spacing, same set of sites whatever the order
+        return " ".join(product_name.lower().split()), tuple(sorted(sites or SITE_ADAPTERS))
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def run(self, key: tuple, fn, cancel_token: CancelToken = None, on_progress=None):
+        """
+        Calls fn(on_progress) unless a run of the same key is in flight, in which case waits for that run.
+        Args:
+            key: From SingleFlight.key
+            fn: Runs the comparison, reporting progress through the callback it is given
+            cancel_token: The caller's token; a waiting caller that is cancelled stops waiting and gets None
+            on_progress: Receives the run's progress events, past ones first when attaching
+        Returns:
+            The run's result
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self.stats["runs"] += 1
+                else:
+                    self.stats["coalesced"] += 1
+                    print(f"Joining the comparison already running for {key[0]!r}")
+                if on_progress is not None:
+                    if not leader:
+                        for event in flight.events + [{"event": "attached"}]:
+                            on_progress(event)
+                    flight.listeners.append(on_progress)
+
+            if leader:
+                try:
+                    flight.result = fn(lambda event: self._publish(flight, event))
+                    flight.cancelled = cancel_token is not None and cancel_token.cancelled
+                    return flight.result
+                except BaseException as e:
+                    flight.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+
+            try:
+                while not flight.done.wait(0.5):
+                    if cancel_token is not None and cancel_token.cancelled:
+                        return None
+            finally:
+                with self._lock:
+                    if on_progress in flight.listeners:
+                        flight.listeners.remove(on_progress)
+            if flight.error is not None:
+                raise flight.error
+            if flight.cancelled and not (cancel_token is not None and cancel_token.cancelled):
+                continue  # The caller that started the run cancelled it, start a new one
+            return flight.result
+
+    def _publish(self, flight: _Flight, event: dict) -> None:
+        with self._lock:
+            flight.events.append(event)
+            for listener in flight.listeners:
+                listener(event)
+
+
+# Comparisons in flight, shared by every caller in this process (Streamlit, API, workers)
+single_flight = SingleFlight()
+
+# Helium drives one Selenium session per process, so comparisons take turns on that backend
+session_lock = threading.Lock()
+
+# Every extracted price is kept for later queries
+price_history = PriceHistory()
+
+# Code of successful runs per site, replayed before asking the model
+trajectory_cache = TrajectoryCache() if TRAJECTORY_CACHE else None
+
+# Search request for a single site
+def build_site_request(product_name: str, adapter: SiteAdapter) -> str:
+    """
+    Builds the step by step agent task for finding a product on one site.
+    Args:
+        product_name: The product to search for
+        adapter: The site to search
+    Returns:
+        str: The task prompt
+    """
+    if BROWSER_BACKEND == "playwright":
+        first_step = "1. The browser is already open, don't import helium"
+    else:
+        first_step = "1. First import helium:\n```py\nfrom helium import *\n```"
+    return f"""
+I need you to find {product_name!r} on {adapter.label} by doing the following steps sequentially:
+{first_step}
+2. Open the {adapter.label} search results directly:
+```py
+go_to_search({adapter.name!r}, {product_name!r})
+```
+   If no results are shown, go_to('{adapter.home_url}') and use input_search instead
+3. Click on the product image
+4. Return the product details as your final answer:
+```py
+final_answer(get_product_details())
+```
+"""
+
+
+def parse_product_details(output) -> dict | None:
+    # get_product_details output with an actual price, or None
+    if isinstance(output, dict):
+        details = output
+    else:
+        try:
+            details = json.loads(str(output))
+        except (TypeError, ValueError):
+            return None
+    if not isinstance(details, dict) or "currentPrice" not in details:
+        return None
+    if not str(details.get("currentPrice", "")).startswith("$"):
+        return None
+    return details
+
+
+def replay_trajectory(agent: CodeAgent, recipe: dict, product_name: str, cancel_token: CancelToken = None):
+    """
+    Runs a stored recipe's code step by step in the agent's interpreter, checking after each step
+    that the tool output is not a failure and that the browser is on the same kind of page as when it was recorded.
+    Details whose product name misses the searched keywords count as a divergence.
+    Args:
+        agent: The agent that takes over on divergence, whose interpreter runs the steps
+        recipe: From TrajectoryCache.lookup
+        product_name: The product to search for
+        cancel_token: Stops the replay between steps
+    Returns:
+        tuple: (product details or None, [(code, url)] of the steps that went as recorded)
+    """
+    done = []
+    previous_shape = ""  # Recorded runs start on a blank page
+    for step in recipe["steps"]:
+        if cancel_token is not None and cancel_token.cancelled:
+            break
+        code = instantiate(step["code"], product_name)
+        try:
+            output, _, _ = agent.python_executor(code, agent.state)
+        except Exception as e:
+            print(f"Replay diverged at step {len(done) + 1}: {str(e)}")
+            break
+        details = parse_product_details(output)
+        if details and best_match([{"product": str(details.get("product", ""))}], product_name) is None:
+            # Another product's page, the agent starts over rather than from there
+            print(f"Replay found {details.get('product')!r} instead of {product_name!r}")
+            return None, []
+        if details:
+            return details, done + [(code, tools.session().driver.current_url)]
+        url = tools.session().driver.current_url
+        # Only steps that moved to another kind of page when recorded must land on that kind of page now
+        moved = step["shape"] != previous_shape
+        previous_shape = step["shape"]
+        if is_failure(output) or (moved and url_shape(url) != step["shape"]):
+            print(f"Replay diverged at step {len(done) + 1}: {str(output)[:100]} on {url}")
+            break
+        done.append((code, url))
+        time.sleep(1.0)  # Let the page settle like between agent steps
+    return None, done
+
+
+def replayed_note(done: list[tuple[str, str]], url: str) -> str:
+    # Tells the agent taking over what already happened in the browser
+    code = "\n".join(code for code, _ in done)
+    return f"""
+These steps were already run for you, don't repeat them:
+```py
+{code}
+```
+The browser is now on {url}. Continue from there.
+"""
+
+
+def run_site_search(
+    product_name: str,
+    adapter: SiteAdapter,
+    max_steps: int = SITE_MAX_STEPS,
+    deadline_seconds: float = SITE_DEADLINE_SECONDS,
+    cancel_token: CancelToken = None,
+    capture: ResponseCapture = None,
+    on_progress=None,
+) -> dict:
+    """
+    Runs an agent on one site within a step budget and a wall-clock deadline.
+    Args:
+        product_name: The product to search for
+        adapter: The site to search
+        max_steps: Agent steps allowed on this site
+        deadline_seconds: Wall-clock seconds allowed on this site
+        cancel_token: Stops the agent before its next step once cancelled
+        capture: Network capture to read prices from the site's API responses, tried before the agent
+        on_progress: Called with {"event": "step", "site", "step"} after every agent step
+    Returns:
+        dict: Product details with a "status" of "ok", "timed out", "not found", "cancelled" or "error", plus "steps" and "seconds",
+            and "screenshots" with the deduplication counts when the agent ran
+    """
+    started = time.monotonic()
+    deadline = started + deadline_seconds
+    if capture is not None:
+        details = capture_site_search(product_name, adapter, capture)
+        if details:
+            details.update(status="ok", steps=0, seconds=round(time.monotonic() - started, 1))
+            print(f"{adapter.label}: ok from the network in {details['seconds']}s")
+            return details
+    tools.set_site_deadline(deadline)
+    # One spare step so we stop on our own budget before the agent forces a final answer
+    task = build_site_request(product_name, adapter)
+    agent = CodeAgent(
+        tools=TOOLS,
+        model=get_model(),
+        additional_authorized_imports=["helium"],
+        step_callbacks=[save_screenshot, govern_memory, speculate, stream_step],
+        max_steps=max_steps + 1,
+        verbosity_level=2,
+    )
+    details = None
+    status = "not found"
+    steps = 0
+    recipe = trajectory_cache.lookup(adapter.name) if trajectory_cache is not None else None
+    trajectory = []  # (code, url) of the steps that worked, recorded if the run succeeds
+    if recipe is not None:
+        with tools.profile_section("replay"):
+            details, trajectory = replay_trajectory(agent, recipe, product_name, cancel_token)
+        trajectory_cache.outcome(adapter.name, recipe, details is not None)
+        if on_progress is not None:
+            on_progress({"event": "replayed", "site": adapter.name, "steps": len(trajectory), "ok": details is not None})
+        if details:
+            tools.set_site_deadline(None)
+            result = {**details, "status": "ok", "steps": 0, "seconds": round(time.monotonic() - started, 1)}
+            print(f"{adapter.label}: ok from a replayed trajectory in {result['seconds']}s")
+            return result
+        if trajectory:
+            task += replayed_note(trajectory, tools.session().driver.current_url)
+    agent_found = False
+    agent.run_log = None
+    if RUN_LOG:
+        try:
+            agent.run_log = RunLog(adapter.name, product_name)
+        except OSError as e:
+            print(f"Could not create the run log: {str(e)}")
+    run = agent.run(task + helium_instructions, stream=True)
+    try:
+        for step in run:
+            if not isinstance(step, ActionStep):
+                # The agent's final answer
+                details = parse_product_details(step) or details
+                agent_found = details is not None
+                break
+            steps += 1
+            if on_progress is not None:
+                on_progress({"event": "step", "site": adapter.name, "step": steps})
+            if trajectory_cache is not None and step.error is None and step.tool_calls:
+                trajectory.append((step.tool_calls[0].arguments, tools.session().driver.current_url))
+            # Stop as soon as a step produced the product details, the final answer would only repeat them
+            details = parse_product_details(step.action_output) or details
+            agent_found = details is not None
+            if capture is not None and not details:
+                # Or as soon as a page the agent opened fetched them
+                capture.poll(tools.session().driver)
+                details = capture.match(adapter, product_name)
+            if details:
+                break
+            if cancel_token is not None and cancel_token.cancelled:
+                # Don't pay for another model call nobody will read
+                status = "cancelled"
+                break
+            if steps >= max_steps or time.monotonic() > deadline:
+                status = "timed out"
+                break
+    except Exception as e:
+        print(f"Agent failed on {adapter.label}: {str(e)}")
+        status = "error"
+    finally:
+        run.close()
+        tools.set_site_deadline(None)
+        if agent.run_log is not None:
+            agent.run_log.close({"status": "ok" if details else status, "steps": steps})
+    if agent_found and trajectory_cache is not None:
+        trajectory_cache.record(adapter.name, product_name, trajectory)
+
+    result = dict(details) if details else {}
+    result["status"] = "ok" if details else status
+    result["steps"] = steps
+    result["seconds"] = round(time.monotonic() - started, 1)
+    deduper = getattr(agent, "frame_deduper", None)
+    if deduper is not None:
+        # Screenshots replaced with text or cropped on this site
+        result["screenshots"] = deduper.report()
+    print(f"{adapter.label}: {result['status']} after {steps} step(s) in {result['seconds']}s")
+    if deduper is not None:
+        print(f"{adapter.label} screenshots: {result['screenshots']}")
+    return result
+
+
+def capture_site_search(product_name: str, adapter: SiteAdapter, capture: ResponseCapture) -> dict | None:
+    """
+    Opens the site's search page and waits for its API responses, without rendering waits or DOM scraping.
+    Returns:
+        dict | None: Product details from the JSON payloads, or None to let the agent search
+    """
+    if adapter.name not in capture.adapters:
+        return None
+    url = adapter.search_url(product_name)
+    with tools.profile_section("network capture"):
+        try:
+            current = tools.session()
+            if current.site_tabs is None or not current.site_tabs.switch_to(adapter.name, url):
+                current.driver.get(url)
+        except Exception as e:
+            # Page load timeouts are fine, the API responses usually arrived long before
+            print(f"Search page of {adapter.label} did not finish loading: {str(e)}")
+        return capture.wait_for(current.driver, adapter, product_name)
+
+
+def run_multi_site_search(product_name: str, sites: list[str] = None, cancel_token: CancelToken = None, on_progress=None):
+    """
+    Searches the product on every site and combines the results.
+    Args:
+        product_name: The product to search for
+        sites: Only search these sites (default: every registered site)
+        cancel_token: Cancelling it stops the comparison promptly and returns None
+        on_progress: Called from the comparison's thread with progress events ("browser ready",
+            "site started", "step", "site finished", and last "report" with the run's site, memory,
+            WebDriver command, speculation, browser start-up, model call and navigation pacing reports)
+    Returns:
+        str | None: Combined JSON, or None when nothing was found or the comparison was cancelled
+    """
+    if COALESCE_COMPARISONS:
+        return single_flight.run(
+            SingleFlight.key(product_name, sites),
+            lambda progress: _run_exclusive(product_name, sites, cancel_token, progress),
+            cancel_token,
+            on_progress,
+        )
+    return _run_exclusive(product_name, sites, cancel_token, on_progress)
+
+
+def _run_exclusive(product_name: str, sites: list[str], cancel_token: CancelToken, on_progress):
+    if BROWSER_BACKEND == "playwright":
+        # Every comparison has its own browser context and tool session
+        return _run_multi_site_search(product_name, sites, cancel_token, on_progress)
+    with session_lock:
+        return _run_multi_site_search(product_name, sites, cancel_token, on_progress)
+
+
+async def run_comparisons(product_names: list[str], concurrency: int = MAX_CONCURRENT_COMPARISONS) -> dict:
+    """
+    Runs several comparisons at once from an asyncio event loop.
+    The agents themselves are synchronous, so each runs in a worker thread, while on the Playwright
+    backend all their browser contexts share one browser and one event loop.
+    Args:
+        product_names: Products to compare
+        concurrency: Comparisons running at the same time
+    Returns:
+        dict: Product name to its combined JSON (or None)
+    """
+    slots = asyncio.Semaphore(concurrency)
+
+    async def compare(product_name: str):
+        async with slots:
+            return product_name, await asyncio.to_thread(run_multi_site_search, product_name)
+
+    return dict(await asyncio.gather(*(compare(product_name) for product_name in product_names)))
+
+
+def _run_multi_site_search(product_name: str, sites: list[str], cancel_token: CancelToken, on_progress=None):
+    if cancel_token is not None and cancel_token.cancelled:
+        return None  # Cancelled while waiting for its turn
+    driver = None
+    discard = False
+    memory_governor = MemoryGovernor()
+    command_profiler = CommandProfiler() if PROFILE_WEBDRIVER else None
+    speculator = Speculator(product_name) if SPECULATE else None
+    adapters = [SITE_ADAPTERS[name] for name in sites] if sites else list(SITE_ADAPTERS.values())
+    # Network capture reads Chrome's performance log, which only the Selenium backend has
+    capture = ResponseCapture(adapters) if NETWORK_CAPTURE and BROWSER_BACKEND == "selenium" else None
+    progress = on_progress or (lambda event: None)
+    results = {}
+    browser_seconds = None
+    try:
+        # Take a warm browser from the pool before running the search
+        acquire_started = time.monotonic()
+        driver = driver_pool.acquire()
+        browser_seconds = round(time.monotonic() - acquire_started, 2)
+        progress({"event": "browser ready", "seconds": browser_seconds})
+        site_tabs = SiteTabs(driver) if MULTI_TAB else None
+        tools.use_session(driver, site_tabs, memory_governor, cancel_token, command_profiler, speculator)
+        if capture is not None:
+            capture.discard(driver)  # Responses of the browser's previous run
+        if site_tabs is not None:
+            # One browser, one tab per site, all search pages loading at once
+            with tools.profile_section("open tabs"):
+                site_tabs.open_all(product_name, adapters)
+
+        # Each site gets its own agent and budget, a site that runs out is marked and skipped
+        for index, adapter in enumerate(adapters):
+            if cancel_token is not None and cancel_token.cancelled:
+                break
+            if speculator is not None:
+                speculator.begin_site(adapter, adapters[index + 1] if index + 1 < len(adapters) else None)
+            progress({"event": "site started", "site": adapter.name})
+            results[adapter.name] = run_site_search(
+                product_name, adapter, cancel_token=cancel_token, capture=capture, on_progress=on_progress
+            )
+            progress({
+                "event": "site finished",
+                "site": adapter.name,
+                **{key: results[adapter.name][key] for key in ("status", "steps", "seconds")},
+            })
+
+        if cancel_token is not None and cancel_token.cancelled:
+            print(f"Comparison for '{product_name}' was cancelled")
+            return None
+        if not any(result["status"] == "ok" for result in results.values()):
+            return None
+        final_combined_result = combine_results(results)
+        try:
+            price_history.record(product_name, final_combined_result)
+        except Exception as e:
+            print(f"Could not store prices: {str(e)}")
+        return final_combined_result
+            
+    except BaseException:
+        discard = True  # Don't hand a browser in an unknown state to the next run
+        raise
+    finally:
+        # Clean up: give the browser back to the pool (it may have been restarted during the run)
+        # The run's reports go to its own caller, never to module state shared by concurrent comparisons
+        report = {
+            "event": "report",
+            # Steps, seconds, status and screenshot deduplication per site
+            "sites": {
+                name: {key: result[key] for key in ("status", "steps", "seconds", "screenshots") if key in result}
+                for name, result in results.items()
+            },
+            "memory": memory_governor.report(),
+            # WebDriver commands per tool
+            "commands": command_profiler.report() if command_profiler is not None else None,
+            # Pages preloaded, used and cancelled by the speculator
+            "speculation": None,
+            # Retries, hedges and fallbacks of the model so far, shared with the process's other comparisons
+            "model": model_report(),
+            # Page load rate, response time and back-offs per domain, paced across the process's browsers
+            "navigation": navigation_governor.report() if RATE_GOVERNOR else None,
+            # Seconds this run waited for its browser, and the pool's warm versus cold start-up times
+            "browser": {
+                "acquire_seconds": browser_seconds,
+                "pool": driver_pool.report() if isinstance(driver_pool, DriverPool) else None,
+            },
+        }
+        print(f"Browser memory: {report['memory']}")
+        print(f"Browser start-up: {report['browser']}")
+        if report["commands"] is not None:
+            print(f"WebDriver commands: {report['commands']}")
+        if report["model"] is not None:
+            print(f"Model calls: {report['model']}")
+        if report["navigation"]:
+            print(f"Navigation pacing: {report['navigation']}")
+        session_driver = tools.session().driver or driver
+        if speculator is not None:
+            if session_driver is not None and not discard:
+                speculator.finish(session_driver)
+            report["speculation"] = speculator.report()
+            print(f"Speculative preloading: {report['speculation']}")
+        tools.use_session(None)
+        driver_pool.release(session_driver, discard=discard)
+        progress(report)
@@ -0,0 +1,402 @@
+"""
+Coordinator / worker mode, for spreading comparisons over several hosts:
+
+    python distributed.py serve                                 # coordinator: job queue over HTTP
+    python distributed.py worker --queue http://coordinator:8780  # on every host with Chrome
+    python distributed.py submit "Milo 1.5kg" "iPhone 16 Pro Max"   # enqueue and wait for the results
+
+With a file path instead of a url (the default, jobs.db), the queue is a local SQLite file shared by
+the processes of one host.
+"""
+import argparse
+import hmac
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Path of a local SQLite queue, or the url of a coordinator started with "serve"
+JOB_QUEUE = os.getenv("JOB_QUEUE", "jobs.db")
+QUEUE_SERVER_PORT = int(os.getenv("QUEUE_SERVER_PORT", "8780"))
+# Interface the coordinator listens on, only this host by default. Any other needs QUEUE_TOKEN
+QUEUE_SERVER_HOST = os.getenv("QUEUE_SERVER_HOST", "127.0.0.1")
+# Shared secret workers send to the coordinator (required unless it only listens on this host)
+QUEUE_TOKEN = os.getenv("QUEUE_TOKEN")
+# Workers renew their job's lease this often, a job whose lease ran out goes back to the queue
+WORKER_HEARTBEAT_SECONDS = float(os.getenv("WORKER_HEARTBEAT_SECONDS", "10"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "45"))
+# Attempts before a job that keeps failing (or keeps losing its worker) is marked failed
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    product TEXT NOT NULL,
+    sites TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    host TEXT,
+    last_seen REAL NOT NULL,
+    job_id TEXT
+);
+"""
+
+
+class SQLiteJobQueue:
+    """
+    Comparison jobs in a SQLite file: queued -> running (leased by a worker) -> done or failed.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE, lease_seconds: float = JOB_LEASE_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, product: str, sites: list[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, product, sites, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, product, json.dumps(sites) if sites else None, now, now),
+            )
+        return job_id
+
+    def claim(self, worker_id: str, host: str = None) -> dict | None:
+        """
+        Leases the oldest queued job to a worker.
+        Returns:
+            dict | None: {"id", "product", "sites", "attempts"}, or None when the queue is empty
+        """
+        self.requeue_expired()
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")  # One claimer at a time, across processes
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1,"
+                        " updated_at = ? WHERE id = ?",
+                        (worker_id, now + self.lease_seconds, now, row["id"]),
+                    )
+                self._seen(conn, worker_id, host, row["id"] if row else None)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "product": row["product"],
+            "sites": json.loads(row["sites"]) if row["sites"] else None,
+            "attempts": row["attempts"] + 1,
+        }
+
+    def heartbeat(self, worker_id: str, job_id: str = None) -> bool:
+        """
+        Renews the worker's lease on its job.
+        Returns:
+            bool: False when the job is no longer this worker's (it was re-queued), so the worker should drop it
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            self._seen(conn, worker_id, None, job_id)
+            if job_id is None:
+                return True
+            updated = conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (now + self.lease_seconds, now, job_id, worker_id),
+            ).rowcount
+        return bool(updated)
+
+    def complete(self, worker_id: str, job_id: str, result: str | None) -> None:
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_until = NULL, updated_at = ?"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (result, time.time(), job_id, worker_id),
+            )
+            self._seen(conn, worker_id, None, None)
+
+    def fail(self, worker_id: str, job_id: str, error: str) -> None:
+        # Back to the queue for another attempt, or failed for good
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,"
+                " error = ?, worker = NULL, lease_until = NULL, updated_at = ?"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (self.max_attempts, error, time.time(), job_id, worker_id),
+            )
+            self._seen(conn, worker_id, None, None)
+
+    def requeue_expired(self) -> int:
+        """
+        Puts running jobs whose worker stopped sending heartbeats back in the queue.
+        Returns:
+            int: Number of jobs re-queued or failed
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,"
+                " error = 'Worker ' || worker || ' stopped sending heartbeats', worker = NULL, lease_until = NULL,"
+                " updated_at = ? WHERE status = 'running' AND lease_until < ?",
+                (self.max_attempts, now, now),
+            ).rowcount
+
+    def get(self, job_id: str) -> dict | None:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def workers(self) -> list[dict]:
+        with closing(self._connect()) as conn:
+            return [dict(row) for row in conn.execute("SELECT * FROM workers ORDER BY last_seen DESC")]
+
+    def _seen(self, conn: sqlite3.Connection, worker_id: str, host: str | None, job_id: str | None) -> None:
+        conn.execute(
+            "INSERT INTO workers (id, host, last_seen, job_id) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(id) DO UPDATE SET host = COALESCE(excluded.host, host), last_seen = excluded.last_seen,"
+            " job_id = excluded.job_id",
+            (worker_id, host, time.time(), job_id),
+        )
+
+
+class HttpJobQueue:
+    """
+    Same interface as SQLiteJobQueue, for workers on other hosts talking to a coordinator started with "serve".
+    """
+
+    def __init__(self, url: str, token: str = QUEUE_TOKEN):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def _post(self, action: str, **payload):
+        response = self.session.post(f"{self.url}/{action}", json=payload, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    def enqueue(self, product: str, sites: list[str] = None) -> str:
+        return self._post("enqueue", product=product, sites=sites)
+
+    def claim(self, worker_id: str, host: str = None) -> dict | None:
+        return self._post("claim", worker_id=worker_id, host=host)
+
+    def heartbeat(self, worker_id: str, job_id: str = None) -> bool:
+        return self._post("heartbeat", worker_id=worker_id, job_id=job_id)
+
+    def complete(self, worker_id: str, job_id: str, result: str | None) -> None:
+        self._post("complete", worker_id=worker_id, job_id=job_id, result=result)
+
+    def fail(self, worker_id: str, job_id: str, error: str) -> None:
+        self._post("fail", worker_id=worker_id, job_id=job_id, error=error)
+
+    def get(self, job_id: str) -> dict | None:
+        return self._post("get", job_id=job_id)
+
+    def workers(self) -> list[dict]:
+        return self._post("workers")
+
+
+def open_queue(spec: str = JOB_QUEUE):
+    # A coordinator url or a local SQLite file
+    return HttpJobQueue(spec) if spec.startswith(("http://", "https://")) else SQLiteJobQueue(spec)
+
+
+class QueueRequestHandler(BaseHTTPRequestHandler):
+    # POST /<method> with the method's arguments as JSON, answered with its return value
+    queue: SQLiteJobQueue = None
+    actions = {"enqueue", "claim", "heartbeat", "complete", "fail", "get", "workers"}
+
+    def do_POST(self):
+        action = self.path.strip("/")
+        authorization = self.headers.get("Authorization") or ""
+        if QUEUE_TOKEN and not hmac.compare_digest(authorization.encode(), f"Bearer {QUEUE_TOKEN}".encode()):
+            return self._send(401, {"error": "Unauthorized"})
+        if action not in self.actions:
+            return self._send(404, {"error": f"Unknown action '{action}'"})
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            self._send(200, getattr(self.queue, action)(**payload))
+        except Exception as e:
+            self._send(400, {"error": str(e)})
+
+    def _send(self, status: int, body) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def serve(
+    queue: SQLiteJobQueue,
+    port: int = QUEUE_SERVER_PORT,
+    stop_event: threading.Event = None,
+    host: str = QUEUE_SERVER_HOST,
+) -> None:
+    """
+    Runs the coordinator: serves the queue to remote workers and re-queues the jobs of dead workers.
+    Refuses to listen beyond this host without QUEUE_TOKEN, anyone reaching the port could
+    otherwise submit, claim and complete jobs.
+    """
+    if not QUEUE_TOKEN and not is_loopback(host):
+        raise ValueError(f"Set QUEUE_TOKEN before serving the job queue on {host}")
+    stop_event = stop_event or threading.Event()
+    handler = type("BoundQueueRequestHandler", (QueueRequestHandler,), {"queue": queue})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Job queue served on {host}:{port}")
+    try:
+        while not stop_event.wait(WORKER_HEARTBEAT_SECONDS):
+            requeued = queue.requeue_expired()
+            if requeued:
+                print(f"Re-queued {requeued} job(s) of workers that stopped sending heartbeats")
+    finally:
+        server.shutdown()
+
+
+def run_worker(queue, worker_id: str = None, poll_seconds: float = 2.0, stop_event: threading.Event = None) -> None:
+    """
+    Pulls jobs and runs them through the regular comparison, sending heartbeats while a job runs.
+    Args:
+        queue: SQLiteJobQueue or HttpJobQueue
+        worker_id: Name of this worker (default: host name and pid)
+        poll_seconds: Wait between claims when the queue is empty
+        stop_event: Stops the worker after its current job
+    """
+    # Imported here so the coordinator never loads selenium or the model
+    import comparison
+    from tools import CancelToken
+
+    host = socket.gethostname()
+    worker_id = worker_id or f"{host}-{os.getpid()}"
+    stop_event = stop_event or threading.Event()
+    print(f"Worker {worker_id} started")
+    try:
+        while not stop_event.is_set():
+            try:
+                job = queue.claim(worker_id, host)
+            except Exception as e:
+                print(f"Could not reach the job queue: {str(e)}")
+                job = None
+            if job is None:
+                stop_event.wait(poll_seconds)
+                continue
+            run_job(queue, worker_id, job, comparison, CancelToken())
+    finally:
+        comparison.driver_pool.close_all()
+
+
+def run_job(queue, worker_id: str, job: dict, comparison, token) -> None:
+    print(f"Running job {job['id']}: '{job['product']}' (attempt {job['attempts']})")
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(WORKER_HEARTBEAT_SECONDS):
+            try:
+                if not queue.heartbeat(worker_id, job["id"]):
+                    print(f"Job {job['id']} was handed to another worker, dropping it")
+                    token.cancel()
+                    return
+            except Exception as e:
+                print(f"Heartbeat failed: {str(e)}")
+
+    heartbeat = threading.Thread(target=beat, name="heartbeat", daemon=True)
+    heartbeat.start()
+    try:
+        result = comparison.run_multi_site_search(job["product"], sites=job["sites"], cancel_token=token)
+    except Exception as e:
+        queue.fail(worker_id, job["id"], str(e))
+        return
+    finally:
+        done.set()
+        heartbeat.join()
+    if not token.cancelled:
+        queue.complete(worker_id, job["id"], result)
+
+
+def submit(queue, product_names: list[str], poll_seconds: float = 5.0) -> dict:
+    """
+    Enqueues comparisons and waits until every one is done or failed.
+    Returns:
+        dict: Product name to its finished job
+    """
+    job_ids = {queue.enqueue(product_name): product_name for product_name in product_names}
+    # By job, the same product may have been submitted more than once
+    finished = {}
+    while len(finished) < len(job_ids):
+        for job_id, product_name in job_ids.items():
+            if job_id not in finished:
+                job = queue.get(job_id)
+                if job and job["status"] in ("done", "failed"):
+                    finished[job_id] = job
+                    print(f"{product_name}: {job['status']}")
+        if len(finished) < len(job_ids):
+            time.sleep(poll_seconds)
+    return {job_ids[job_id]: job for job_id, job in finished.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed comparison jobs")
+    parser.add_argument("command", choices=["serve", "worker", "submit"])
+    parser.add_argument("products", nargs="*", help="Products to compare (submit)")
+    parser.add_argument("--queue", default=JOB_QUEUE, help="SQLite file or coordinator url (default: JOB_QUEUE)")
+    parser.add_argument("--port", type=int, default=QUEUE_SERVER_PORT, help="Port to serve the queue on (serve)")
+    parser.add_argument("--host", default=QUEUE_SERVER_HOST, help="Interface to serve the queue on, 0.0.0.0 for every host (serve, needs QUEUE_TOKEN)")
+    args = parser.parse_args()
+    try:
+        if args.command == "serve":
+            serve(SQLiteJobQueue(args.queue), args.port, host=args.host)
+        elif args.command == "worker":
+            run_worker(open_queue(args.queue))
+        else:
+            for name, job in submit(open_queue(args.queue), args.products).items():
+                print(json.dumps({"product": name, "status": job["status"], "result": job["result"], "error": job["error"]}))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,119 @@
+"""
+Local stand-in for a retailer whose search page is filled from a JSON API, to try network capture
+without hitting the real sites:
+
+    python fixture_server.py                        # serve on FIXTURE_PORT
+    python fixture_server.py --check "iphone 16"    # open it in Chrome and print what was captured
+"""
+import argparse
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from sites import SiteAdapter
+
+FIXTURE_PORT = int(os.getenv("FIXTURE_PORT", "8765"))
+
+# Shaped like a catalog API response: results nested a few levels down, prices as strings
+PRODUCTS = [
+    {"itemId": "1001", "name": "Apple iPhone 16 Pro Max 256GB Desert Titanium", "price": "1899.00", "originalPrice": "2099.00"},
+    {"itemId": "1002", "name": "Apple iPhone 16 128GB Black", "price": "1249.00", "originalPrice": "1249.00"},
+    {"itemId": "1003", "name": "Clear Case for iPhone 16 Pro Max", "price": "12.90", "originalPrice": "25.00"},
+    {"itemId": "2001", "name": "Milo Chocolate Malt Powder 1.5kg", "price": "15.20", "originalPrice": "18.50"},
+]
+
+SEARCH_PAGE = """<!doctype html>
+<html><head><title>Fixture Store</title></head>
+<body>
+<input type="search" name="q" placeholder="Search products">
+<div id="results">Loading…</div>
+<script>
+const query = new URLSearchParams(location.search).get('q') || '';
+fetch('/api/search?q=' + encodeURIComponent(query))
+    .then(response => response.json())
+    .then(data => {
+        document.getElementById('results').innerHTML = data.mods.listItems.map(item =>
+            `<div class="product-card"><a href="/product/${item.itemId}"><span>${item.name}</span></a>
+             <span class="price">$${item.price}</span></div>`).join('');
+    });
+</script>
+</body></html>
+"""
+
+FIXTURE_SITE = SiteAdapter(
+    name="fixture",
+    label="Fixture Store",
+    domains=[f"127.0.0.1:{FIXTURE_PORT}"],
+    home_url=f"http://127.0.0.1:{FIXTURE_PORT}/",
+    search_url_template=f"http://127.0.0.1:{FIXTURE_PORT}/search?q={{query}}",
+    api_url_patterns=[r"/api/search\?"],
+    api_price_keys=["price"],
+    api_original_price_keys=["originalPrice"],
+)
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/api/search":
+            keywords = parse_qs(url.query).get("q", [""])[0].lower().split()
+            items = [item for item in PRODUCTS if any(keyword in item["name"].lower() for keyword in keywords)]
+            self._send(200, "application/json", json.dumps({"mods": {"listItems": items}}))
+        elif url.path in ("/", "/search"):
+            self._send(200, "text/html", SEARCH_PAGE)
+        else:
+            self._send(404, "text/plain", "Not found")
+
+    def _send(self, status: int, content_type: str, body: str) -> None:
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type + "; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int = FIXTURE_PORT) -> ThreadingHTTPServer:
+    # Starts the fixture store in a background thread
+    server = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check(product_name: str) -> tuple[dict | None, int]:
+    """
+    Opens the fixture store's search page in Chrome with network capture on.
+    Returns:
+        tuple: (product details captured for the product or None, number of API responses read)
+    """
+    from browser import initialize_driver, quit_driver
+    from network import ResponseCapture
+
+    server = serve()
+    driver = initialize_driver(capture=True)
+    try:
+        capture = ResponseCapture([FIXTURE_SITE])
+        driver.get(FIXTURE_SITE.search_url(product_name))
+        return capture.wait_for(driver, FIXTURE_SITE, product_name), capture.responses
+    finally:
+        quit_driver(driver)
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fixture store emulating a retailer search API")
+    parser.add_argument("--check", metavar="PRODUCT", help="Capture PRODUCT from the fixture store with a real browser")
+    args = parser.parse_args()
+    if args.check:
+        details, responses = check(args.check)
+        print(json.dumps(details, indent=2))
+        print(f"{responses} API response(s) read")
+    else:
+        print(f"Serving the fixture store on http://127.0.0.1:{FIXTURE_PORT}/search?q=iphone")
+        ThreadingHTTPServer(("127.0.0.1", FIXTURE_PORT), FixtureHandler).serve_forever()
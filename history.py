@@ -0,0 +1,203 @@
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+# Local SQLite file every extracted price is written to
+PRICE_DB_PATH = os.getenv("PRICE_DB_PATH", "price_history.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_key TEXT NOT NULL,
+    product_name TEXT,
+    site TEXT NOT NULL,
+    observed_at REAL NOT NULL,
+    current_price REAL,
+    original_price REAL,
+    promotion REAL
+);
+CREATE INDEX IF NOT EXISTS idx_prices_product_site_time ON prices (product_key, site, observed_at);
+CREATE INDEX IF NOT EXISTS idx_prices_site_time ON prices (site, observed_at);
+"""
+
+
+def normalize_product(product_name: str) -> str:
+    # Searches that only differ in case or spacing share one history
+    return " ".join(product_name.lower().split())
+
+
+def parse_price(price) -> float | None:
+    """
+    Converts a displayed price such as "$1,299.00" to a float.
+    Args:
+        price: Price string (or number)
+    Returns:
+        float | None: The price, or None if it isn't a usable price
+    """
+    if isinstance(price, (int, float)):
+        return float(price) if price > 0 else None
+    if not price or '$' not in str(price):
+        return None
+    try:
+        value = float(str(price).replace('$', '').replace(',', '').strip())
+        return value if value > 0 else None
+    except ValueError:
+        return None
+
+
+class PriceHistory:
+    """
+    Time series of every price the agent extracted, indexed by product, site and time.
+    """
+
+    def __init__(self, path: str = PRICE_DB_PATH):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # A short lived connection per call keeps the store safe to use from any thread
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(self, product_name: str, combined_result: str | dict, observed_at: float = None) -> int:
+        """
+        Stores the prices of one comparison.
+        Args:
+            product_name: The product that was searched for
+            combined_result: Output of combine_results (JSON string or dict keyed by site)
+            observed_at: Unix time of the observation (default: now)
+        Returns:
+            int: Number of rows written
+        """
+        data = json.loads(combined_result) if isinstance(combined_result, str) else combined_result
+        observed_at = observed_at or time.time()
+        rows = []
+        for site, details in data.items():
+            if not isinstance(details, dict):
+                continue
+            current_price = parse_price(details.get("currentPrice"))
+            if current_price is None:
+                continue  # Nothing worth keeping for this site
+            rows.append((
+                normalize_product(product_name),
+                details.get("product"),
+                site,
+                observed_at,
+                current_price,
+                parse_price(details.get("originalPrice")),
+                parse_price(details.get("promotion")),
+            ))
+        if rows:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany(
+                    "INSERT INTO prices (product_key, product_name, site, observed_at, current_price, original_price, promotion) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+        return len(rows)
+
+    def latest(self, product_name: str, site: str = None, as_of: float = None) -> dict[str, dict]:
+        """
+        Returns the most recent observation per site, optionally as it was at a past time.
+        Args:
+            product_name: The searched product
+            site: Only this site (default: every site)
+            as_of: Unix time, e.g. a week ago to answer "what was it last week" (default: now)
+        Returns:
+            dict: Site name to its latest row
+        """
+        query = (
+            "SELECT p.* FROM prices p WHERE p.product_key = ? AND p.observed_at = ("
+            " SELECT MAX(observed_at) FROM prices"
+            " WHERE product_key = p.product_key AND site = p.site AND observed_at <= ?)"
+        )
+        params = [normalize_product(product_name), as_of or time.time()]
+        if site:
+            query += " AND p.site = ?"
+            params.append(site)
+        with closing(self._connect()) as conn:
+            return {row["site"]: dict(row) for row in conn.execute(query, params)}
+
+    def price_range(self, product_name: str, since: float, until: float = None) -> dict[str, dict]:
+        """
+        Returns the lowest and highest current price per site over a time window.
+        Args:
+            product_name: The searched product
+            since: Start of the window (unix time)
+            until: End of the window (default: now)
+        Returns:
+            dict: Site name to {"min", "max", "observations"}
+        """
+        query = (
+            "SELECT site, MIN(current_price) AS min, MAX(current_price) AS max, COUNT(*) AS observations"
+            " FROM prices WHERE product_key = ? AND observed_at BETWEEN ? AND ? GROUP BY site"
+        )
+        params = (normalize_product(product_name), since, until or time.time())
+        with closing(self._connect()) as conn:
+            return {row["site"]: dict(row) for row in conn.execute(query, params)}
+
+    def change_points(self, product_name: str, since: float = 0, site: str = None) -> list[dict]:
+        """
+        Returns the observations where the current price or the promotion differs from the previous one on the same site.
+        Args:
+            product_name: The searched product
+            since: Only changes after this unix time
+            site: Only this site (default: every site)
+        Returns:
+            list[dict]: Changes ordered by time, with previous_price and previous_promotion
+        """
+        query = (
+            "SELECT * FROM ("
+            " SELECT site, observed_at, product_name, current_price, promotion,"
+            " LAG(current_price) OVER w AS previous_price,"
+            " LAG(promotion) OVER w AS previous_promotion,"
+            " LAG(id) OVER w AS previous_id"
+            " FROM prices WHERE product_key = ?" + (" AND site = ?" if site else "") +
+            " WINDOW w AS (PARTITION BY site ORDER BY observed_at))"
+            " WHERE previous_id IS NOT NULL AND observed_at >= ?"
+            " AND (current_price IS NOT previous_price OR promotion IS NOT previous_promotion)"
+            " ORDER BY observed_at"
+        )
+        params = [normalize_product(product_name)] + ([site] if site else []) + [since]
+        with closing(self._connect()) as conn:
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def series(self, product_name: str, since: float = 0) -> list[dict]:
+        """
+        Returns every observation of a product since a given time, oldest first (for charts).
+        Args:
+            product_name: The searched product
+            since: Start unix time (default: everything)
+        """
+        query = (
+            "SELECT site, observed_at, current_price FROM prices"
+            " WHERE product_key = ? AND observed_at >= ? ORDER BY observed_at"
+        )
+        with closing(self._connect()) as conn:
+            return [dict(row) for row in conn.execute(query, (normalize_product(product_name), since))]
+
+
+def format_price(price: float | None) -> str | None:
+    return f"${price:.2f}" if price else None
+
+
+def to_combined(rows: dict[str, dict]) -> dict:
+    """
+    Turns stored rows (as returned by PriceHistory.latest) back into the combine_results shape.
+    Args:
+        rows: Site name to stored row
+    """
+    return {
+        site: {
+            "product": row["product_name"] or "Not found",
+            "currentPrice": format_price(row["current_price"]) or "Not available",
+            "originalPrice": format_price(row["original_price"]),
+            "promotion": format_price(row["promotion"]),
+            "observedAt": row["observed_at"],
+        }
+        for site, row in rows.items()
+    }
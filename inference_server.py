@@ -0,0 +1,330 @@
+"""
+Local vision model served once for every agent of the host, with an OpenAI-compatible API:
+
+    python inference_server.py serve              # loads LOCAL_MODEL_ID and serves on LOCAL_MODEL_PORT
+    python inference_server.py benchmark          # throughput with and without batching, per CPU core
+
+Point the agents at it with LOCAL_MODEL_URL=http://127.0.0.1:8001/v1 (see models.py).
+Requests arriving within LOCAL_BATCH_WINDOW_MS of each other are generated as one batch, so
+concurrent agents share the forward passes instead of queueing behind each other.
+"""
+import argparse
+import asyncio
+import base64
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from io import BytesIO
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException
+from PIL import Image
+from pydantic import BaseModel
+
+load_dotenv()
+
+LOCAL_MODEL_ID = os.getenv("LOCAL_MODEL_ID", "Qwen/Qwen2-VL-2B-Instruct")
+LOCAL_MODEL_PORT = int(os.getenv("LOCAL_MODEL_PORT", "8001"))
+# Requests generated together, and how long the first one waits for others to join its batch
+LOCAL_BATCH_SIZE = int(os.getenv("LOCAL_BATCH_SIZE", "8"))
+LOCAL_BATCH_WINDOW_MS = float(os.getenv("LOCAL_BATCH_WINDOW_MS", "50"))
+# Int8 dynamic quantization of the linear layers (weights a quarter of float32, faster matmuls on CPU)
+LOCAL_QUANTIZE = os.getenv("LOCAL_QUANTIZE", "true").lower() == "true"
+# Screenshots are downscaled to at most this many pixels before encoding (28x28 pixels per visual token)
+LOCAL_MAX_PIXELS = int(os.getenv("LOCAL_MAX_PIXELS", str(512 * 28 * 28)))
+LOCAL_MAX_NEW_TOKENS = int(os.getenv("LOCAL_MAX_NEW_TOKENS", "512"))
+# Torch threads (default: every core)
+LOCAL_THREADS = int(os.getenv("LOCAL_THREADS") or 0) or os.cpu_count()
+
+
+class ChatRequest(BaseModel):
+    model: str | None = None
+    messages: list[dict]
+    max_tokens: int | None = None
+    stop: list[str] | str | None = None
+    temperature: float | None = None
+
+
+@dataclass
+class Generation:
+    # One chat completion waiting in the batcher
+    chat: list[dict]  # From to_chat
+    images: list[Image.Image]
+    max_new_tokens: int
+    stop: list[str]
+    future: asyncio.Future = None
+    text: str = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    finish_reason: str = "stop"
+
+
+def decode_image(url: str) -> Image.Image:
+    # smolagents sends screenshots as data urls
+    if not url.startswith("data:"):
+        raise ValueError("Only data: image urls are supported")
+    return Image.open(BytesIO(base64.b64decode(url.split(",", 1)[1]))).convert("RGB")
+
+
+def to_chat(messages: list[dict]) -> tuple[list[dict], list[Image.Image]]:
+    """
+    OpenAI messages to the model's chat template format, with the images pulled out in order.
+    """
+    chat, images = [], []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts = [{"type": "text", "text": content}]
+        else:
+            parts = []
+            for part in content or []:
+                if part.get("type") == "image_url":
+                    images.append(decode_image(part["image_url"]["url"]))
+                    parts.append({"type": "image"})
+                elif part.get("type") == "text":
+                    parts.append({"type": "text", "text": part["text"]})
+        # Tool responses come back as user turns, the template only knows these three roles
+        role = message["role"] if message["role"] in ("system", "user", "assistant") else "user"
+        chat.append({"role": role, "content": parts})
+    return chat, images
+
+
+def cut_at_stop(text: str, stop: list[str]) -> tuple[str, bool]:
+    positions = [text.find(sequence) for sequence in stop if sequence and sequence in text]
+    return (text[:min(positions)], True) if positions else (text, False)
+
+
+class VisionModel:
+    """
+    Qwen2-VL loaded once on CPU, generating a whole batch of conversations per call.
+    """
+
+    def __init__(self, model_id: str = LOCAL_MODEL_ID, quantize: bool = LOCAL_QUANTIZE, max_pixels: int = LOCAL_MAX_PIXELS):
+        # Imported here so the agents never need torch or transformers installed
+        import torch
+        from transformers import AutoProcessor, Qwen2VLForConditionalGeneration
+
+        torch.set_num_threads(LOCAL_THREADS)
+        self.torch = torch
+        self.model_id = model_id
+        self.processor = AutoProcessor.from_pretrained(model_id, min_pixels=64 * 28 * 28, max_pixels=max_pixels)
+        self.processor.tokenizer.padding_side = "left"  # Generated tokens must line up at the end of every row
+        model = Qwen2VLForConditionalGeneration.from_pretrained(model_id, torch_dtype=torch.float32).eval()
+        if quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+
+    def generate(self, batch: list[Generation]) -> None:
+        chats, images = [], []
+        for generation in batch:
+            chats.append(self.processor.apply_chat_template(generation.chat, add_generation_prompt=True))
+            images.extend(generation.images)
+        inputs = self.processor(text=chats, images=images or None, padding=True, return_tensors="pt")
+        with self.torch.inference_mode():
+            output = self.model.generate(
+                **inputs,
+                max_new_tokens=max(generation.max_new_tokens for generation in batch),
+                do_sample=False,
+            )
+        prompt_length = inputs["input_ids"].shape[1]
+        pad_id = self.processor.tokenizer.pad_token_id
+        for row, generation in enumerate(batch):
+            tokens = output[row, prompt_length:prompt_length + generation.max_new_tokens]
+            text = self.processor.tokenizer.decode(tokens, skip_special_tokens=True)
+            generation.text, stopped = cut_at_stop(text, generation.stop)
+            generation.prompt_tokens = int(inputs["attention_mask"][row].sum())
+            generation.completion_tokens = int((tokens != pad_id).sum())
+            if not stopped and generation.completion_tokens >= generation.max_new_tokens:
+                generation.finish_reason = "length"
+
+
+class Batcher:
+    """
+    Collects concurrent requests for up to window_ms (or until batch_size are waiting) and runs
+    them through the model as one batch in a single worker thread.
+    """
+
+    def __init__(self, model, batch_size: int = LOCAL_BATCH_SIZE, window_ms: float = LOCAL_BATCH_WINDOW_MS):
+        self.model = model
+        self.batch_size = batch_size
+        self.window = window_ms / 1000
+        self.stats = {"requests": 0, "batches": 0, "completion_tokens": 0, "busy_seconds": 0.0}
+        self._queue: asyncio.Queue[Generation] = None
+        self._task = None
+        self._lock = threading.Lock()  # One batch on the CPU at a time
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def submit(self, generation: Generation) -> Generation:
+        generation.future = asyncio.get_running_loop().create_future()
+        await self._queue.put(generation)
+        return await generation.future
+
+    async def _loop(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._run(batch)
+
+    async def _run(self, batch: list[Generation]) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._generate, batch)
+        except Exception as e:
+            print(f"Batch of {len(batch)} failed: {str(e)}")
+            for generation in batch:
+                if not generation.future.done():
+                    generation.future.set_exception(e)
+            return
+        self.stats["requests"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["completion_tokens"] += sum(generation.completion_tokens for generation in batch)
+        self.stats["busy_seconds"] += time.perf_counter() - started
+        for generation in batch:
+            if not generation.future.done():
+                generation.future.set_result(generation)
+
+    def _generate(self, batch: list[Generation]) -> None:
+        with self._lock:
+            self.model.generate(batch)
+
+    def report(self) -> dict:
+        busy = self.stats["busy_seconds"]
+        return {
+            **self.stats,
+            "busy_seconds": round(busy, 2),
+            "average_batch": round(self.stats["requests"] / self.stats["batches"], 2) if self.stats["batches"] else None,
+            "tokens_per_second": round(self.stats["completion_tokens"] / busy, 2) if busy else None,
+            "tokens_per_second_per_core": round(self.stats["completion_tokens"] / busy / LOCAL_THREADS, 3) if busy else None,
+        }
+
+
+def create_app(model_factory=VisionModel) -> FastAPI:
+    state = {}
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # Loading takes a while, do it before accepting requests
+        state["model"] = await asyncio.to_thread(model_factory)
+        state["batcher"] = Batcher(state["model"])
+        state["batcher"].start()
+        print(f"Serving {state['model'].model_id} with batches of up to {LOCAL_BATCH_SIZE}")
+        yield
+        await state["batcher"].stop()
+
+    app = FastAPI(title="Local vision model", lifespan=lifespan)
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": state["model"].model_id, "object": "model", "owned_by": "local"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: ChatRequest):
+        stop = [request.stop] if isinstance(request.stop, str) else list(request.stop or [])
+        try:
+            # Decoded here, so one bad request fails alone instead of taking its batch down
+            chat, images = to_chat(request.messages)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid messages: {str(e)}")
+        generation = await state["batcher"].submit(Generation(
+            chat=chat,
+            images=images,
+            max_new_tokens=min(request.max_tokens or LOCAL_MAX_NEW_TOKENS, LOCAL_MAX_NEW_TOKENS),
+            stop=stop,
+        ))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": state["model"].model_id,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": generation.text},
+                "finish_reason": generation.finish_reason,
+            }],
+            "usage": {
+                "prompt_tokens": generation.prompt_tokens,
+                "completion_tokens": generation.completion_tokens,
+                "total_tokens": generation.prompt_tokens + generation.completion_tokens,
+            },
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return state["batcher"].report()
+
+    return app
+
+
+def sample_request(index: int) -> list[dict]:
+    # A small screenshot-like image and a short instruction, like an agent step
+    image = Image.new("RGB", (640, 400), (255, 255, 255 - index % 50))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    url = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+    return [{"role": "user", "content": [
+        {"type": "image_url", "image_url": {"url": url}},
+        {"type": "text", "text": f"Request {index}: describe what is on this page in one sentence."},
+    ]}]
+
+
+async def benchmark(model, clients: int, requests: int, max_new_tokens: int) -> None:
+    """
+    Sends requests from concurrent clients through batchers of size 1 and LOCAL_BATCH_SIZE and prints
+    requests/s and generated tokens/s, per CPU core.
+    """
+    for batch_size in sorted({1, LOCAL_BATCH_SIZE}):
+        batcher = Batcher(model, batch_size=batch_size)
+        batcher.start()
+        pending = iter(range(requests))
+
+        async def client():
+            for index in pending:
+                chat, images = to_chat(sample_request(index))
+                await batcher.submit(Generation(chat, images, max_new_tokens, []))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+        await batcher.stop()
+        report = batcher.report()
+        print(
+            f"batch size {batch_size}: {requests} requests from {clients} clients in {elapsed:.1f}s, "
+            f"{requests / elapsed:.2f} req/s, {report['completion_tokens'] / elapsed:.1f} tokens/s, "
+            f"{report['completion_tokens'] / elapsed / LOCAL_THREADS:.2f} tokens/s per core "
+            f"({LOCAL_THREADS} cores, average batch {report['average_batch']})"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched local vision model with an OpenAI-compatible API")
+    parser.add_argument("command", choices=["serve", "benchmark"])
+    parser.add_argument("--port", type=int, default=LOCAL_MODEL_PORT)
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients (benchmark)")
+    parser.add_argument("--requests", type=int, default=32, help="Requests in total (benchmark)")
+    parser.add_argument("--max-new-tokens", type=int, default=32, help="Tokens generated per request (benchmark)")
+    args = parser.parse_args()
+    if args.command == "serve":
+        import uvicorn
+
+        uvicorn.run(create_app(), host="127.0.0.1", port=args.port)
+    else:
+        asyncio.run(benchmark(VisionModel(), args.clients, args.requests, args.max_new_tokens))
@@ -0,0 +1,287 @@
+import copy
+import os
+import random
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+
+import httpx
+import openai
+from smolagents import OpenAIServerModel
+from smolagents.models import Model
+
+from observations import PAGE_DIGEST
+
+FIREWORKS_API_BASE = "https://api.fireworks.ai/inference/v1"
+
+# Cheaper text-only model driving the steps that have no new screenshot (PAGE_DIGEST=replace)
+DIGEST_MODEL_ID = os.getenv("DIGEST_MODEL_ID")
+
+# Seconds a model call may take, and retries (with jittered exponential backoff) of calls that time out or fail
+MODEL_TIMEOUT_SECONDS = float(os.getenv("MODEL_TIMEOUT_SECONDS", "60"))
+MODEL_RETRIES = int(os.getenv("MODEL_RETRIES", "2"))
+MODEL_BACKOFF_SECONDS = float(os.getenv("MODEL_BACKOFF_SECONDS", "1"))
+# Kept-alive connections to the inference provider, shared by every comparison of the process
+MODEL_POOL_CONNECTIONS = int(os.getenv("MODEL_POOL_CONNECTIONS", "20"))
+# Send a second identical request when the first is slower than the p90 of recent calls
+MODEL_HEDGE = os.getenv("MODEL_HEDGE", "false").lower() == "true"
+MODEL_HEDGE_MIN_SAMPLES = int(os.getenv("MODEL_HEDGE_MIN_SAMPLES", "10"))
+# OpenAI-compatible url of a local model (python inference_server.py serve) used instead of Fireworks
+LOCAL_MODEL_URL = os.getenv("LOCAL_MODEL_URL")
+LOCAL_MODEL_ID = os.getenv("LOCAL_MODEL_ID", "Qwen/Qwen2-VL-2B-Instruct")
+# Model answering once the main one still fails after its retries (same provider unless FALLBACK_API_BASE is set)
+FALLBACK_MODEL_ID = os.getenv("FALLBACK_MODEL_ID")
+FALLBACK_API_BASE = os.getenv("FALLBACK_API_BASE") or FIREWORKS_API_BASE
+FALLBACK_API_KEY = os.getenv("FALLBACK_API_KEY") or os.getenv("FIREWORKS_API_KEY")
+
+# Worth another try: timeouts, dropped connections, rate limits and server errors
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+def has_image(message: dict) -> bool:
+    content = message.get("content")
+    return isinstance(content, list) and any(part.get("type") == "image" for part in content)
+
+
+def without_images(messages: list[dict]) -> list[dict]:
+    # Text-only copy of the conversation, for models that can't take images
+    stripped = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = [part for part in content if part.get("type") != "image"]
+            if not content:
+                continue
+        stripped.append({**message, "content": content})
+    return stripped
+
+
+class DigestRoutingModel(Model):
+    """
+    Sends steps that come with a fresh screenshot to the vision model and the others,
+    which only carry the page digest, to a cheaper text model.
+    """
+
+    def __init__(self, vision_model: Model, text_model: Model):
+        super().__init__()
+        self.vision_model = vision_model
+        self.text_model = text_model
+        self.calls = {"vision": 0, "text": 0}
+
+    def __call__(self, messages: list[dict], *args, **kwargs):
+        if messages and has_image(messages[-1]):
+            model, name = self.vision_model, "vision"
+        else:
+            model, name = self.text_model, "text"
+            messages = without_images(messages)
+        self.calls[name] += 1
+        message = model(messages, *args, **kwargs)
+        # Token counts of whichever model answered, for the agent's monitor
+        self.last_input_token_count = model.last_input_token_count
+        self.last_output_token_count = model.last_output_token_count
+        return message
+
+
+@lru_cache(maxsize=None)
+def http_client(api_base: str) -> httpx.Client:
+    # One pool of kept-alive connections per provider, so calls skip the TCP and TLS handshakes
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=MODEL_POOL_CONNECTIONS,
+            max_keepalive_connections=MODEL_POOL_CONNECTIONS,
+            keepalive_expiry=120,
+        ),
+        timeout=httpx.Timeout(MODEL_TIMEOUT_SECONDS, connect=10),
+    )
+
+
+def server_model(model_id: str, api_base: str = FIREWORKS_API_BASE, api_key: str = None) -> OpenAIServerModel:
+    """
+    OpenAIServerModel on the shared connection pool, with the client's own retries turned off
+    (ResilientModel retries instead) and the per-call timeout applied.
+    """
+    model = OpenAIServerModel(model_id=model_id, api_base=api_base, api_key=api_key)
+    model.client = openai.OpenAI(
+        base_url=api_base,
+        api_key=api_key,
+        http_client=http_client(api_base),
+        timeout=MODEL_TIMEOUT_SECONDS,
+        max_retries=0,
+    )
+    return model
+
+
+class ResilientModel(Model):
+    """
+    Wraps a model with retries on transient errors (jittered exponential backoff), optional hedged
+    requests and an optional fallback model. Calls go to a shallow copy of the model, so concurrent
+    comparisons (and the two legs of a hedge) don't overwrite each other's token counts.
+    """
+
+    def __init__(
+        self,
+        model: Model,
+        fallback: Model = None,
+        retries: int = MODEL_RETRIES,
+        backoff: float = MODEL_BACKOFF_SECONDS,
+        hedge: bool = MODEL_HEDGE,
+        hedge_min_samples: int = MODEL_HEDGE_MIN_SAMPLES,
+    ):
+        super().__init__()
+        self.model = model
+        self.fallback = fallback
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = deque(maxlen=200)  # Seconds of recent successful calls, as seen by the caller
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "fallbacks": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="model") if hedge else None
+
+    def __call__(self, messages: list[dict], *args, **kwargs):
+        with self._lock:
+            self.stats["calls"] += 1
+        for attempt in range(self.retries + 1):
+            try:
+                return self._answer(self._call_hedged(messages, *args, **kwargs))
+            except RETRYABLE_ERRORS as e:
+                error = e
+                if attempt < self.retries:
+                    # Full jitter, so retries of parallel comparisons don't hit the provider together
+                    delay = random.uniform(0, self.backoff * 2 ** attempt)
+                    print(f"Model call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                    with self._lock:
+                        self.stats["retries"] += 1
+                    time.sleep(delay)
+        with self._lock:
+            self.stats["errors"] += 1
+        if self.fallback is None:
+            raise error
+        print(f"Model failed after {self.retries + 1} attempt(s), asking the fallback model")
+        with self._lock:
+            self.stats["fallbacks"] += 1
+        fallback = copy.copy(self.fallback)
+        return self._answer((fallback(messages, *args, **kwargs), fallback))
+
+    def _answer(self, answered):
+        message, model = answered
+        self.last_input_token_count = model.last_input_token_count
+        self.last_output_token_count = model.last_output_token_count
+        return message
+
+    def _call(self, messages, *args, **kwargs):
+        model = copy.copy(self.model)
+        return model(messages, *args, **kwargs), model
+
+    def hedge_after(self) -> float | None:
+        # p90 of recent calls, None until there are enough of them
+        with self._lock:
+            if len(self.latencies) < self.hedge_min_samples:
+                return None
+            return statistics.quantiles(self.latencies, n=10)[-1]
+
+    def _call_hedged(self, messages, *args, **kwargs):
+        started = time.perf_counter()
+        answered = self._race(messages, *args, **kwargs)
+        # Latency as seen by the agent, so hedged calls pull the p90 down
+        with self._lock:
+            self.latencies.append(time.perf_counter() - started)
+        return answered
+
+    def _race(self, messages, *args, **kwargs):
+        delay = self.hedge_after() if self.hedge else None
+        if delay is None:
+            return self._call(messages, *args, **kwargs)
+        first = self._executor.submit(self._call, messages, *args, **kwargs)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        # The first request is in the slow tail: race a second one, first good answer wins
+        with self._lock:
+            self.stats["hedges"] += 1
+        second = self._executor.submit(self._call, messages, *args, **kwargs)
+        pending = {first, second}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            answered = [future for future in done if future.exception() is None]
+            if answered:
+                if answered[0] is second:
+                    with self._lock:
+                        self.stats["hedge_wins"] += 1
+                return answered[0].result()  # The loser finishes in the background and is dropped
+            if not pending:
+                return second.result()  # Both failed, raise the latest error
+
+    def report(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+        percentiles = {}
+        if latencies:
+            for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+                percentiles[name] = round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))], 2)
+        return {**self.stats, **percentiles}
+
+
+@lru_cache(maxsize=1)
+def get_model():
+    """
+    Returns the model client, created once per process.
+    """
+    # Let's use Qwen-2VL-72B via an inference provider like Fireworks AI
+    fallback = server_model(FALLBACK_MODEL_ID, FALLBACK_API_BASE, FALLBACK_API_KEY) if FALLBACK_MODEL_ID else None
+    if LOCAL_MODEL_URL:
+        # One batched copy of the model serves every agent of the host
+        primary = server_model(LOCAL_MODEL_ID, api_base=LOCAL_MODEL_URL, api_key="local")
+    else:
+        primary = server_model("accounts/fireworks/models/qwen2-vl-72b-instruct", api_key=os.getenv("FIREWORKS_API_KEY"))
+    model = ResilientModel(primary, fallback=fallback)
+    if PAGE_DIGEST == "replace" and DIGEST_MODEL_ID:
+        model = DigestRoutingModel(model, ResilientModel(
+            server_model(DIGEST_MODEL_ID, api_key=os.getenv("FIREWORKS_API_KEY")),
+            fallback=fallback,
+        ))
+    return model
+
+    # You can also use a close model
+
+    # from smolagents import LiteLLMModel
+    # return LiteLLMModel(
+    #     model_id="gpt-4o",
+    #     api_key=os.getenv("OPENAI_API_KEY"),
+    # )
+
+    # locally a good candidate is Qwen2-VL-7B-Instruct, for several agents prefer
+    # LOCAL_MODEL_URL with inference_server.py, which loads the model once for all of them
+    # (imported here so transformers is only loaded when actually used)
+    # from smolagents import TransformersModel
+    # return TransformersModel(
+    #     model_id="Qwen/Qwen2-VL-7B-Instruct",
+    #     device_map = "auto",
+    #     flatten_messages_as_text=False
+    # )
+
+
+def model_report() -> dict | None:
+    """
+    Calls, retries, hedges, fallbacks and latency of the process's model, shared by every comparison
+    it runs, with the vision and text split when steps are routed. None before the model is created.
+    """
+    if not get_model.cache_info().currsize:
+        return None
+    model = get_model()
+    if isinstance(model, DigestRoutingModel):
+        return {
+            "routed": dict(model.calls),
+            "vision": model.vision_model.report() if isinstance(model.vision_model, ResilientModel) else None,
+            "text": model.text_model.report() if isinstance(model.text_model, ResilientModel) else None,
+        }
+    return model.report() if isinstance(model, ResilientModel) else None
@@ -0,0 +1,190 @@
+import base64
+import json
+import os
+import re
+import time
+
+from history import format_price, parse_price
+from sites import GENERIC_SITE, SITE_ADAPTERS, SiteAdapter
+
+# Read prices from the sites' JSON API responses (Chrome performance log) before falling back to the agent
+NETWORK_CAPTURE = os.getenv("NETWORK_CAPTURE", "false").lower() == "true"
+# Seconds to wait for a matching API response after opening the search page
+NETWORK_CAPTURE_SECONDS = float(os.getenv("NETWORK_CAPTURE_SECONDS", "10"))
+
+
+def enable_capture(chrome_options) -> None:
+    # Chromedriver records the DevTools Network events in the "performance" log
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+
+def to_price(value) -> float | None:
+    # API prices come as numbers, "12.50" or "$12.50"
+    if isinstance(value, str) and "$" not in value:
+        value = "$" + value
+    return parse_price(value)
+
+
+def find_products(payload, adapter: SiteAdapter, limit: int = 200) -> list[dict]:
+    """
+    Walks a JSON payload and returns every object that has a product name and a price.
+    Args:
+        payload: Decoded JSON response
+        adapter: Site whose api_*_keys say which fields hold the name and prices
+        limit: Stop after this many products
+    Returns:
+        list[dict]: {"product", "currentPrice", "originalPrice"} in payload order, prices as floats
+    """
+    name_keys = adapter.api_name_keys or GENERIC_SITE.api_name_keys
+    price_keys = adapter.api_price_keys or GENERIC_SITE.api_price_keys
+    original_keys = adapter.api_original_price_keys or GENERIC_SITE.api_original_price_keys
+
+    def lookup(obj, keys, depth=2):
+        # First usable price under one of the keys, in the object itself or a few levels down
+        for key in keys:
+            if key in obj and to_price(obj[key]) is not None:
+                return to_price(obj[key])
+        if depth:
+            for value in obj.values():
+                nested = value[0] if isinstance(value, list) and value else value
+                if isinstance(nested, dict):
+                    found = lookup(nested, keys, depth - 1)
+                    if found is not None:
+                        return found
+        return None
+
+    products = []
+    stack = [payload]
+    while stack and len(products) < limit:
+        obj = stack.pop(0)
+        if isinstance(obj, list):
+            stack[:0] = obj
+            continue
+        if not isinstance(obj, dict):
+            continue
+        name = next((obj[key] for key in name_keys if isinstance(obj.get(key), str) and obj[key].strip()), None)
+        current = lookup(obj, price_keys) if name else None
+        if name and current is not None:
+            products.append({"product": name.strip(), "currentPrice": current, "originalPrice": lookup(obj, original_keys)})
+            continue
+        stack[:0] = [value for value in obj.values() if isinstance(value, (dict, list))]
+    return products
+
+
+def best_match(products: list[dict], product_name: str, min_score: float = 0.75) -> dict | None:
+    # Product whose name contains most of the searched keywords, the API's own ranking breaks ties
+    keywords = product_name.lower().split()
+    best, best_score = None, 0.0
+    for product in products:
+        name = product["product"].lower()
+        score = sum(keyword in name for keyword in keywords) / len(keywords) if keywords else 0.0
+        if score > best_score:
+            best, best_score = product, score
+    return best if best_score >= min_score else None
+
+
+def to_details(product: dict) -> dict:
+    # Same shape as get_product_details
+    current, original = product["currentPrice"], product["originalPrice"]
+    if original is not None and original <= current:
+        original = None
+    return {
+        "product": product["product"],
+        "currentPrice": format_price(current),
+        "originalPrice": format_price(original),
+        "promotion": format_price(original - current) if original else None,
+        "source": "network",
+    }
+
+
+class ResponseCapture:
+    """
+    Collects products from the JSON responses of the sites' search and product APIs,
+    read from Chrome's performance log. Responses are matched against each adapter's api_url_patterns.
+    """
+
+    def __init__(self, adapters: list[SiteAdapter] = None):
+        self.adapters = {
+            adapter.name: adapter for adapter in (adapters or SITE_ADAPTERS.values()) if adapter.api_url_patterns
+        }
+        self.patterns = {
+            name: [re.compile(pattern) for pattern in adapter.api_url_patterns] for name, adapter in self.adapters.items()
+        }
+        self.pending = {}  # requestId -> (site name, url)
+        self.products: dict[str, list[dict]] = {name: [] for name in self.adapters}
+        self.responses = 0
+
+    def site_of(self, url: str) -> str | None:
+        for name, patterns in self.patterns.items():
+            if any(pattern.search(url) for pattern in patterns):
+                return name
+        return None
+
+    def discard(self, driver) -> None:
+        try:
+            driver.get_log("performance")
+        except Exception:
+            pass
+
+    def poll(self, driver) -> int:
+        """
+        Drains the performance log and parses the matching responses that finished loading.
+        Returns:
+            int: Number of products found
+        """
+        found = 0
+        try:
+            entries = driver.get_log("performance")
+        except Exception as e:
+            print(f"Could not read the performance log: {str(e)}")
+            return 0
+        for entry in entries:
+            event = json.loads(entry["message"])["message"]
+            params = event.get("params", {})
+            if event.get("method") == "Network.responseReceived":
+                response = params.get("response", {})
+                name = self.site_of(response.get("url", ""))
+                if name and "json" in response.get("mimeType", "") + response.get("headers", {}).get("content-type", ""):
+                    self.pending[params["requestId"]] = (name, response["url"])
+            elif event.get("method") == "Network.loadingFinished" and params.get("requestId") in self.pending:
+                name, url = self.pending.pop(params["requestId"])
+                found += self._read(driver, params["requestId"], name, url)
+        return found
+
+    def _read(self, driver, request_id: str, name: str, url: str) -> int:
+        try:
+            body = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+            text = base64.b64decode(body["body"]) if body.get("base64Encoded") else body["body"]
+            payload = json.loads(text)
+        except Exception:
+            return 0  # Evicted from the buffer, served by another tab, or not JSON after all
+        self.responses += 1
+        products = find_products(payload, self.adapters[name])
+        # Latest responses first, they belong to the page the agent is on
+        self.products[name][:0] = products
+        print(f"Captured {len(products)} product(s) from {url[:100]}")
+        return len(products)
+
+    def match(self, adapter: SiteAdapter, product_name: str) -> dict | None:
+        # Details of the best captured product for the site, or None
+        product = best_match(self.products.get(adapter.name, []), product_name)
+        return to_details(product) if product else None
+
+    def wait_for(self, driver, adapter: SiteAdapter, product_name: str, timeout: float = NETWORK_CAPTURE_SECONDS) -> dict | None:
+        """
+        Polls the performance log until a response of the site has a product matching the search, or the timeout.
+        Args:
+            driver: Driver showing the site's search page
+            adapter: Site being searched
+            product_name: The product to match
+            timeout: Seconds to wait
+        Returns:
+            dict | None: Product details, or None when no matching response arrived in time
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            self.poll(driver)
+            details = self.match(adapter, product_name)
+            if details or time.monotonic() > deadline:
+                return details
+            time.sleep(0.25)
@@ -0,0 +1,254 @@
+import os
+
+from PIL import Image, ImageChops, ImageDraw
+
+# Replace screenshots identical to the previous one with a short text observation
+SCREENSHOT_DEDUP = os.getenv("SCREENSHOT_DEDUP", "true").lower() == "true"
+# Send near-duplicate screenshots as a crop of the region that changed
+SCREENSHOT_DIFF_CROP = os.getenv("SCREENSHOT_DIFF_CROP", "false").lower() == "true"
+# Hash bits (out of 256) two frames may differ by and still count as near-duplicates
+NEAR_DUPLICATE_BITS = int(os.getenv("NEAR_DUPLICATE_BITS", "12"))
+# Set-of-marks: number the visible interactive elements on the screenshot so the model can click them by number
+SET_OF_MARKS = os.getenv("SET_OF_MARKS", "false").lower() == "true"
+MAX_MARKS = int(os.getenv("MAX_MARKS", "60"))
+# Text digest of the page: "off", "append" (next to the screenshot) or "replace" (screenshot only on new pages)
+PAGE_DIGEST = os.getenv("PAGE_DIGEST", "off").lower()
+DIGEST_MAX_CHARS = int(os.getenv("DIGEST_MAX_CHARS", "3000"))
+
+
+def dhash(image: Image.Image, size: int = 16) -> int:
+    """
+    Difference hash: one bit per pixel of a tiny grayscale copy, set when it is brighter than its right neighbour.
+    Args:
+        image: Screenshot
+        size: Hash is size * size bits
+    """
+    small = image.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR)
+    pixels = small.load()
+    bits = 0
+    for y in range(size):
+        for x in range(size):
+            bits = (bits << 1) | (pixels[x, y] > pixels[x + 1, y])
+    return bits
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def changed_region(previous: Image.Image, current: Image.Image, padding: int = 40) -> tuple | None:
+    """
+    Returns the padded bounding box of the pixels that differ between two frames, or None if they are identical.
+    """
+    if previous.size != current.size:
+        return (0, 0) + current.size
+    bbox = ImageChops.difference(previous.convert("RGB"), current.convert("RGB")).getbbox()
+    if bbox is None:
+        return None
+    left, top, right, bottom = bbox
+    return (
+        max(0, left - padding),
+        max(0, top - padding),
+        min(current.width, right + padding),
+        min(current.height, bottom + padding),
+    )
+
+
+class FrameDeduper:
+    """
+    Remembers the last screenshot sent to the model, so unchanged frames can be replaced with text
+    and near-duplicates with the region that changed.
+    """
+
+    def __init__(self, diff_crop: bool = SCREENSHOT_DIFF_CROP, near_duplicate_bits: int = NEAR_DUPLICATE_BITS):
+        self.diff_crop = diff_crop
+        self.near_duplicate_bits = near_duplicate_bits
+        self.previous = None
+        self.previous_hash = None
+        self.previous_step = None
+        # Frames observed, replaced with text and cropped, and the pixels taken versus sent to the model
+        self.stats = {"frames": 0, "unchanged": 0, "cropped": 0, "pixels": 0, "pixels_sent": 0}
+
+    @property
+    def saved(self) -> int:
+        # Frames not sent in full
+        return self.stats["unchanged"] + self.stats["cropped"]
+
+    def observe(self, image: Image.Image, step_number: int) -> tuple[list[Image.Image] | None, str | None]:
+        """
+        Decides what to send for a new frame.
+        Args:
+            image: The new screenshot
+            step_number: Step it was taken after
+        Returns:
+            tuple: (images to attach or None, text observation to add or None)
+        """
+        frame_hash = dhash(image)
+        images, note = [image], None
+        self.stats["frames"] += 1
+        self.stats["pixels"] += image.width * image.height
+        if self.previous is not None and hamming(frame_hash, self.previous_hash) <= self.near_duplicate_bits:
+            # Only pay for the pixel diff when the hashes say the frames are close
+            region = changed_region(self.previous, image)
+            if region is None:
+                self.stats["unchanged"] += 1
+                return None, f"Screen unchanged since the screenshot after step {self.previous_step}."
+            width, height = region[2] - region[0], region[3] - region[1]
+            if self.diff_crop and width * height < image.width * image.height / 4:
+                # The model never sees this frame whole, so later frames are still compared to the last full one
+                self.stats["cropped"] += 1
+                self.stats["pixels_sent"] += width * height
+                note = (
+                    f"Screen mostly unchanged since step {self.previous_step}, "
+                    f"the attached screenshot only shows the region {region} (left, top, right, bottom) that changed."
+                )
+                return [image.crop(region)], note
+        self.previous, self.previous_hash, self.previous_step = image, frame_hash, step_number
+        self.stats["pixels_sent"] += image.width * image.height
+        return images, note
+
+    def report(self) -> dict:
+        pixels = self.stats["pixels"]
+        return {
+            **{key: self.stats[key] for key in ("frames", "unchanged", "cropped")},
+            "saved": self.saved,
+            # Share of the screenshot pixels that still reached the model
+            "pixels_sent_fraction": round(self.stats["pixels_sent"] / pixels, 3) if pixels else None,
+        }
+
+
+# One in-page pass returning the visible interactive elements in the viewport, outermost first
+MARKS_SCRIPT = """
+const limit = arguments[0];
+const selector = "a[href], button, input:not([type='hidden']), select, textarea, [role='button'], [role='link'], [role='searchbox'], [onclick], [data-testid='product']";
+const seen = new Set();
+const marks = [];
+for (const element of document.querySelectorAll(selector)) {
+    if (marks.length >= limit) break;
+    const rect = element.getBoundingClientRect();
+    if (rect.width < 4 || rect.height < 4) continue;
+    if (rect.bottom < 0 || rect.right < 0 || rect.top > window.innerHeight || rect.left > window.innerWidth) continue;
+    const style = window.getComputedStyle(element);
+    if (style.visibility === 'hidden' || style.display === 'none' || style.opacity === '0') continue;
+    // A product card link already covers the buttons and images inside it
+    let parent = element.parentElement, covered = false;
+    while (parent) { if (seen.has(parent)) { covered = true; break; } parent = parent.parentElement; }
+    if (covered) continue;
+    seen.add(element);
+    const label = (element.getAttribute('aria-label') || element.getAttribute('placeholder') || element.innerText || element.value || element.getAttribute('title') || element.getAttribute('alt') || '').trim().replace(/\\s+/g, ' ');
+    marks.push({
+        element: element,
+        tag: element.tagName.toLowerCase(),
+        label: label.slice(0, 60),
+        box: [Math.max(0, rect.left), Math.max(0, rect.top), Math.min(window.innerWidth, rect.right), Math.min(window.innerHeight, rect.bottom)].map(Math.round),
+    });
+}
+return marks;
+"""
+
+MARK_COLORS = ["#e6194b", "#3cb44b", "#4363d8", "#f58231", "#911eb4", "#008080"]
+
+
+def collect_marks(driver, limit: int = MAX_MARKS) -> list[dict]:
+    """
+    Returns the visible interactive elements, numbered from 1, each with its element handle, tag, label and box.
+    """
+    marks = driver.execute_script(MARKS_SCRIPT, limit) or []
+    for number, mark in enumerate(marks, start=1):
+        mark["number"] = number
+    return marks
+
+
+def draw_marks(image: Image.Image, marks: list[dict]) -> Image.Image:
+    """
+    Draws a numbered box over every mark on a copy of the screenshot.
+    """
+    annotated = image.convert("RGB")
+    draw = ImageDraw.Draw(annotated)
+    for mark in marks:
+        color = MARK_COLORS[mark["number"] % len(MARK_COLORS)]
+        left, top, right, bottom = mark["box"]
+        draw.rectangle((left, top, right, bottom), outline=color, width=2)
+        label = str(mark["number"])
+        text_box = draw.textbbox((left, top), label)
+        draw.rectangle((left, top, text_box[2] + 4, text_box[3] + 2), fill=color)
+        draw.text((left + 2, top), label, fill="white")
+    return annotated
+
+
+def format_marks(marks: list[dict]) -> str:
+    # Compact index sent next to the screenshot
+    lines = [f"[{mark['number']}] {mark['tag']} {mark['label']!r}" for mark in marks]
+    return "Marked elements (use click_mark(n)):\n" + "\n".join(lines)
+
+
+# One in-page pass over the first two viewports collecting headings, inputs, buttons, links and prices.
+# Ids are stored on the elements, so they stay the same across steps on the same page.
+DIGEST_SCRIPT = """
+const maxItems = arguments[0];
+window.__agentIdSeq = window.__agentIdSeq || 0;
+const idOf = (element) => {
+    if (!element.dataset.agentId) element.dataset.agentId = String(++window.__agentIdSeq);
+    return Number(element.dataset.agentId);
+};
+const clean = (text) => (text || '').trim().replace(/\\s+/g, ' ').slice(0, 80);
+const priceRe = /(S\\$|SGD|\\$)\\s?\\d[\\d,]*(\\.\\d{1,2})?/;
+// localName is lowercase for HTML and SVG elements alike, unlike tagName
+const skipped = new Set(['script', 'style', 'noscript', 'svg', 'template', 'iframe']);
+const limit = window.innerHeight * 2;
+const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_ELEMENT, {
+    acceptNode(element) {
+        if (skipped.has(element.localName)) return NodeFilter.FILTER_REJECT;
+        const style = window.getComputedStyle(element);
+        if (style.display === 'none' || style.visibility === 'hidden') return NodeFilter.FILTER_REJECT;
+        return NodeFilter.FILTER_ACCEPT;
+    }
+});
+const items = [];
+let element;
+while ((element = walker.nextNode()) && items.length < maxItems) {
+    const rect = element.getBoundingClientRect();
+    if (rect.width < 1 || rect.height < 1 || rect.bottom < 0 || rect.top > limit) continue;
+    const tag = element.tagName.toLowerCase();
+    let kind = null, text = '', extra = '';
+    if (/^h[1-3]$/.test(tag)) {
+        kind = 'heading'; text = element.innerText;
+    } else if (tag === 'input' || tag === 'textarea' || tag === 'select') {
+        if (element.type === 'hidden') continue;
+        kind = 'input'; text = element.getAttribute('placeholder') || element.getAttribute('aria-label') || element.name;
+        extra = (element.type ? `[${element.type}]` : '') + (element.value ? ` value=${JSON.stringify(clean(element.value))}` : '');
+    } else if (tag === 'button' || element.getAttribute('role') === 'button') {
+        kind = 'button'; text = element.innerText || element.getAttribute('aria-label');
+    } else if (tag === 'a' && element.getAttribute('href')) {
+        kind = 'link'; text = element.innerText || element.getAttribute('aria-label') || element.getAttribute('title');
+        try { extra = new URL(element.href).pathname.slice(0, 60); } catch (e) {}
+    } else {
+        // Price-like text directly inside this element (not inherited from children)
+        const own = Array.from(element.childNodes).filter(node => node.nodeType === 3).map(node => node.textContent).join(' ');
+        if (priceRe.test(own)) { kind = 'price'; text = element.innerText; }
+    }
+    text = clean(text);
+    if (!kind || (!text && kind !== 'input')) continue;
+    items.push({id: idOf(element), kind: kind, text: text, extra: extra});
+}
+return {title: document.title, items: items};
+"""
+
+
+def page_digest(driver, max_chars: int = DIGEST_MAX_CHARS) -> str:
+    """
+    Returns a size-bounded text digest of the visible page, one line per element with its stable id.
+    """
+    digest = driver.execute_script(DIGEST_SCRIPT, 400) or {}
+    lines = [f"Page: {digest.get('title', '')!r}"]
+    size = len(lines[0])
+    for item in digest.get("items", []):
+        line = f"#{item['id']} {item['kind']}{item['extra'] if item['kind'] == 'input' else ''} {item['text']!r}"
+        if item["kind"] == "link" and item["extra"]:
+            line += f" -> {item['extra']}"
+        if size + len(line) + 1 > max_chars:
+            lines.append("(digest truncated)")
+            break
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
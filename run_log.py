@@ -0,0 +1,107 @@
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+# Stream every agent step to an append-only log on disk, with the screenshots the model saw next to it
+RUN_LOG = os.getenv("RUN_LOG", "true").lower() == "true"
+RUN_LOG_DIR = os.getenv("RUN_LOG_DIR", "runs")
+# Run directories kept, the oldest are deleted first
+RUN_LOG_MAX_RUNS = int(os.getenv("RUN_LOG_MAX_RUNS", "200"))
+# Screenshot files: "webp" or "jpeg" (lossy, a fraction of the size of a PNG) or "png"
+SCREENSHOT_FORMAT = os.getenv("SCREENSHOT_FORMAT", "webp").lower()
+SCREENSHOT_QUALITY = int(os.getenv("SCREENSHOT_QUALITY", "80"))
+
+# Steps whose screenshots stay in memory for the model: the current one and the one before
+SCREENSHOT_STEPS_KEPT = 2
+
+
+class RunLog:
+    """
+    Append-only record of one agent run: a steps.jsonl with one line per step, written as soon as the
+    step ends, and its screenshots as compressed files the lines refer to by path. Nothing is kept
+    in memory, so a run that crashes or never ends still leaves everything up to its last step.
+    """
+
+    def __init__(self, site: str, product_name: str, root: str = RUN_LOG_DIR, max_runs: int = RUN_LOG_MAX_RUNS):
+        slug = re.sub(r"[^a-z0-9]+", "-", product_name.lower()).strip("-")[:40]
+        self.path = os.path.join(root, f"{time.strftime('%Y%m%d-%H%M%S')}-{site}-{slug}-{uuid.uuid4().hex[:6]}")
+        os.makedirs(self.path)
+        prune(root, max_runs)
+        # Line buffered, every record reaches the file as soon as it is written
+        self._file = open(os.path.join(self.path, "steps.jsonl"), "a", buffering=1)
+        self.write({"event": "started", "site": site, "product": product_name})
+
+    def write(self, record: dict) -> None:
+        if self._file.closed:
+            return
+        self._file.write(json.dumps({"time": round(time.time(), 3), **record}, default=str) + "\n")
+
+    def save_image(self, image, step_number: int, index: int = 0) -> str:
+        # Compressed copy of a screenshot, returns its path
+        extension = "jpg" if SCREENSHOT_FORMAT == "jpeg" else SCREENSHOT_FORMAT
+        path = os.path.join(self.path, f"step_{step_number:03d}_{index}.{extension}")
+        if SCREENSHOT_FORMAT == "png":
+            image.save(path, optimize=True)
+        else:
+            image.convert("RGB").save(path, quality=SCREENSHOT_QUALITY)
+        return path
+
+    def write_step(self, step_log) -> None:
+        """
+        Appends an agent step, its screenshots saved as files.
+        Args:
+            step_log: The ActionStep that just ended
+        """
+        images = [
+            self.save_image(image, step_log.step_number, index)
+            for index, image in enumerate(step_log.observations_images or [])
+            if hasattr(image, "save")  # Task images are passed as paths already
+        ]
+        self.write({
+            "event": "step",
+            "step": step_log.step_number,
+            "duration": round(step_log.duration, 2) if step_log.duration is not None else None,
+            "llm_output": step_log.llm_output,
+            "code": step_log.tool_calls[0].arguments if step_log.tool_calls else None,
+            "observations": step_log.observations,
+            "error": str(step_log.error) if step_log.error is not None else None,
+            "output": step_log.action_output,
+            "screenshots": images,
+        })
+
+    def close(self, result: dict = None) -> None:
+        if self._file.closed:
+            return
+        self.write({"event": "finished", **(result or {})})
+        self._file.close()
+
+
+def prune(root: str, max_runs: int) -> None:
+    # Directory names start with their creation time, so sorting them puts the oldest first
+    try:
+        runs = sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+    except OSError:
+        return
+    for name in runs[:max(0, len(runs) - max_runs)]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def release_step(step_log, agent) -> None:
+    """
+    Drops what the next model call doesn't read from the agent's logs, so memory stays flat however
+    many steps a run takes: the message list each step keeps of its model input (which holds every
+    earlier step again), and the screenshots of steps the model no longer sees. The last full frame
+    the screenshot deduper refers the model to is kept however old it is.
+    """
+    step_log.agent_memory = None
+    deduper = getattr(agent, "frame_deduper", None)
+    referenced = deduper.previous_step if deduper is not None else None
+    for earlier in agent.logs:
+        step_number = getattr(earlier, "step_number", None)
+        if step_number is None or step_number == referenced:
+            continue
+        if step_number <= step_log.step_number - SCREENSHOT_STEPS_KEPT:
+            earlier.observations_images = None
@@ -0,0 +1,212 @@
+from dataclasses import dataclass, field
+from urllib.parse import quote_plus, urlparse
+
+
+# Per-site knowledge used by the browser tools. Adding a new retailer should
+# only require registering one more SiteAdapter below.
+@dataclass
+class SiteAdapter:
+    name: str  # Short key used in results, e.g. "fairprice"
+    label: str  # Human readable name shown in the UI
+    domains: list[str]
+    home_url: str
+    search_url_template: str  # Must contain "{query}"
+    search_selectors: list[str] = field(default_factory=list)  # CSS
+    product_selectors: list[str] = field(default_factory=list)  # XPath, may use {product_name} / {keyword_xpath}
+    follow_card_link: bool = False  # Click the first link inside the matched product card
+    name_selectors: list[str] = field(default_factory=list)  # CSS
+    current_price_selectors: list[str] = field(default_factory=list)  # CSS
+    original_price_selectors: list[str] = field(default_factory=list)  # CSS
+    api_url_patterns: list[str] = field(default_factory=list)  # Regex of JSON API urls carrying product data
+    api_name_keys: list[str] = field(default_factory=list)  # JSON fields holding the product name
+    api_price_keys: list[str] = field(default_factory=list)  # JSON fields holding the current price
+    api_original_price_keys: list[str] = field(default_factory=list)  # JSON fields holding the price before discount
+    icon: str = "🏬"
+
+    def matches(self, url: str) -> bool:
+        host = urlparse(url).netloc.lower() if "://" in url else url.lower()
+        return any(domain in host for domain in self.domains)
+
+    def search_url(self, product_name: str) -> str:
+        return self.search_url_template.format(query=quote_plus(product_name.strip()))
+
+
+# Fallback selectors used for unknown sites and appended after site specific ones
+GENERIC_SITE = SiteAdapter(
+    name="generic",
+    label="Generic",
+    domains=[],
+    home_url="",
+    search_url_template="",
+    search_selectors=[
+        "[type='search']",
+        "[name='search']",
+        "[name='q']",
+        "[name='query']",
+        "[placeholder*='search' i]",
+        "[placeholder*='Search' i]",
+        "[aria-label*='search' i]",
+        ".search-input",
+        "#search",
+        ".searchbox",
+        "[role='search'] input"
+    ],
+    product_selectors=[
+        "//a[{keyword_xpath}]",
+        "//div[{keyword_xpath}]//a",
+        "//img[{keyword_xpath}]/.."
+    ],
+    name_selectors=[
+        "h1",
+        "[class*='product-name']",
+        "[class*='title']:not([class*='promo'])"
+    ],
+    current_price_selectors=[
+        "[class*='price']:not([class*='original']):not([class*='was'])"
+    ],
+    original_price_selectors=[
+        "[class*='original']",
+        "[class*='was-price']"
+    ],
+    api_name_keys=["name", "productName", "title", "displayName"],
+    api_price_keys=["salePrice", "finalPrice", "final_price", "offerPrice", "price"],
+    api_original_price_keys=["originalPrice", "original_price", "listPrice", "mrp"],
+)
+
+SITE_ADAPTERS: dict[str, SiteAdapter] = {}
+
+
+def register_site(adapter: SiteAdapter) -> SiteAdapter:
+    SITE_ADAPTERS[adapter.name] = adapter
+    return adapter
+
+
+register_site(SiteAdapter(
+    name="fairprice",
+    label="FairPrice",
+    icon="🏪",
+    domains=["fairprice.com.sg"],
+    home_url="https://www.fairprice.com.sg/",
+    search_url_template="https://www.fairprice.com.sg/search?query={query}",
+    search_selectors=[
+        "#search-input-bar",
+        "[data-testid='search-input-desktop']",
+    ],
+    product_selectors=[
+        # Product card with exact match
+        "(//div[@data-testid='product'][.//span[contains(text(), '{product_name}')]])[1]",
+        # Product card with name match
+        "(//div[@data-testid='product-card'][.//span[{keyword_xpath}]])[1]",
+        # Product name link
+        "(//a[.//span[{keyword_xpath}]][@href])[1]",
+        # Generic product card
+        "(//div[@data-testid='product'])[1]",
+        # Any product card with matching text
+        "(//div[contains(@class, 'product')]//span[{keyword_xpath}]/ancestor::div[contains(@class, 'product-card')])[1]"
+    ],
+    follow_card_link=True,
+    name_selectors=[
+        "span.sc-aa673588-1[weight='regular'][color='#333333']",
+        ".sc-aa673588-1.drdope",
+        "[data-testid='product-name-and-metadata'] span[weight='regular']",
+    ],
+    current_price_selectors=[
+        "span.kQDEta.gbCpHo",
+        "span.sc-aa673588-1.sc-6ac8ef58-5",
+    ],
+    original_price_selectors=[
+        "span.kZssPC",
+        "span.sc-aa673588-1.kZssPC",
+    ],
+    # Product listing API behind the search and product pages
+    api_url_patterns=[r"website-api\.omni\.fairprice\.com\.sg/api/product"],
+    api_price_keys=["final_price", "offerPrice"],
+    api_original_price_keys=["mrp"],
+))
+
+register_site(SiteAdapter(
+    name="lazada",
+    label="Lazada",
+    icon="🛒",
+    domains=["lazada.sg"],
+    home_url="https://www.lazada.sg/",
+    search_url_template="https://www.lazada.sg/catalog/?q={query}",
+    search_selectors=[
+        ".search-box__input--O34g",
+        ".search-box__input",
+    ],
+    product_selectors=[
+        # LazMall section (first product)
+        "(//div[contains(@class, 'Bm3ON') or contains(@class, 'grid-card')])[1]",
+        "(//a[contains(@href, '//www.lazada.sg/products/')])[1]",
+        "(//div[contains(@data-tracking-exposed-item-id, '')])[1]",
+        "(//img[@type='product'])[1]/.."
+    ],
+    name_selectors=[
+        ".pdp-mod-product-badge-title",
+        "h1.pdp-mod-product-title",
+    ],
+    current_price_selectors=[
+        ".pdp-price_type_normal",
+        ".pdp-price",
+    ],
+    original_price_selectors=[
+        ".pdp-price_type_deleted",
+        ".pdp-price__old",
+    ],
+    # Catalog results fetched with ajax=true, and the product page data
+    api_url_patterns=[r"lazada\.sg/catalog/\?.*ajax=true", r"acs-m\.lazada\.sg/h5/mtop\.lazada\.pdp"],
+    api_price_keys=["price", "priceShow"],
+    api_original_price_keys=["originalPrice", "originalPriceShow"],
+))
+
+
+def get_site_adapter(url: str) -> SiteAdapter:
+    """
+    Returns the adapter for the site serving the given url, or GENERIC_SITE if none matches.
+    Args:
+        url: Page url (or bare host name)
+    """
+    for adapter in SITE_ADAPTERS.values():
+        if adapter.matches(url):
+            return adapter
+    return GENERIC_SITE
+
+
+def get_site(name: str) -> SiteAdapter:
+    """
+    Looks up a registered adapter by its short name or label (case-insensitive).
+    Args:
+        name: Site name such as "fairprice" or "Lazada"
+    """
+    key = name.strip().lower()
+    for adapter in SITE_ADAPTERS.values():
+        if key in (adapter.name, adapter.label.lower()):
+            return adapter
+    raise KeyError(f"Unknown site '{name}'. Known sites: {', '.join(SITE_ADAPTERS)}")
+
+
+def keyword_xpath(product_name: str) -> str:
+    # XPath condition matching elements that contain every keyword (case-insensitive)
+    conditions = []
+    for keyword in product_name.lower().split():
+        conditions.append(f"contains(translate(., 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), '{keyword}')")
+    return " and ".join(conditions)
+
+
+def product_xpaths(adapter: SiteAdapter, product_name: str) -> list[str]:
+    # Product link selectors for the adapter, with the product name filled in
+    selectors = adapter.product_selectors or GENERIC_SITE.product_selectors
+    keywords = keyword_xpath(product_name)
+    return [
+        selector.replace("{product_name}", product_name).replace("{keyword_xpath}", keywords)
+        for selector in selectors
+    ]
+
+
+def with_generic(adapter: SiteAdapter, attribute: str) -> list[str]:
+    # Site specific selectors first, then the generic fallbacks
+    specific = getattr(adapter, attribute)
+    if adapter is GENERIC_SITE:
+        return list(specific)
+    return list(specific) + getattr(GENERIC_SITE, attribute)
@@ -0,0 +1,177 @@
+import os
+from urllib.parse import urldefrag
+
+from sites import SiteAdapter, get_site_adapter, product_xpaths
+from throttle import RATE_GOVERNOR, navigation_governor
+
+# Preload the likely next pages in background tabs while the model works out its next step
+SPECULATE = os.getenv("SPECULATE", "false").lower() == "true"
+# Background tabs at once, and search results preloaded per results page
+SPECULATE_MAX_TABS = int(os.getenv("SPECULATE_MAX_TABS", "2"))
+SPECULATE_TOP_RESULTS = int(os.getenv("SPECULATE_TOP_RESULTS", "1"))
+
+# Links of the first visible product cards matched by the site's product XPaths, in page order
+TOP_RESULTS_SCRIPT = """
+const [xpaths, followCardLink, limit] = arguments;
+const hrefs = [];
+for (const xpath of xpaths) {
+    let result;
+    try {
+        result = document.evaluate(xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    } catch (e) {
+        continue;
+    }
+    for (let i = 0; i < result.snapshotLength && hrefs.length < limit; i++) {
+        const element = result.snapshotItem(i);
+        if (!element.getClientRects || !element.getClientRects().length) continue;
+        const link = (followCardLink && element.querySelector('a[href]')) || element.closest('a[href]') || element.querySelector('a[href]');
+        if (link && link.href.startsWith('http') && !hrefs.includes(link.href)) hrefs.push(link.href);
+    }
+    if (hrefs.length) break;
+}
+return hrefs;
+"""
+
+
+def normalize(url: str) -> str:
+    return urldefrag(url)[0].rstrip("/")
+
+
+def is_search_page(adapter: SiteAdapter, url: str) -> bool:
+    prefix = adapter.search_url_template.split("{query}")[0]
+    return normalize(url).startswith(normalize(prefix))
+
+
+class Speculator:
+    """
+    Guesses where the agent goes next and starts loading it in a background tab after each step,
+    while the model is busy: the top search results on a results page, and the next site's search
+    page once the agent is on a product page. When the agent then opens one of those urls, the tools
+    switch to the preloaded tab instead of loading the page, and close the one they leave. Guesses
+    that didn't come true are closed at the next step.
+    """
+
+    def __init__(self, product_name: str, max_tabs: int = SPECULATE_MAX_TABS, top_results: int = SPECULATE_TOP_RESULTS):
+        self.product_name = product_name
+        self.max_tabs = max_tabs
+        self.top_results = top_results
+        self.adapter = None
+        self.next_adapter = None
+        self.tabs: dict[str, str] = {}  # Normalized url -> handle of the tab preloading it
+        self.returns: dict[str, str] = {}  # Preloaded tab in use -> url the agent came from, for go_back
+        self.stats = {"prefetched": 0, "hits": 0, "cancelled": 0, "throttled": 0}
+
+    def begin_site(self, adapter: SiteAdapter, next_adapter: SiteAdapter = None) -> None:
+        self.adapter, self.next_adapter = adapter, next_adapter
+
+    def predict(self, driver, url: str, multi_tab: bool = False) -> list[str]:
+        # Urls the agent is likely to open next
+        if self.adapter is None:
+            return []
+        if get_site_adapter(url) is not self.adapter:
+            # Still on the previous site's last page: the search page preloaded for this site
+            # is where the agent goes first, so it stays
+            search = self.adapter.search_url(self.product_name)
+            return [search] if normalize(search) in self.tabs else []
+        if is_search_page(self.adapter, url):
+            return driver.execute_script(
+                TOP_RESULTS_SCRIPT,
+                product_xpaths(self.adapter, self.product_name),
+                self.adapter.follow_card_link,
+                self.top_results,
+            ) or []
+        # On a product page the site is nearly done: the next one starts with its search page,
+        # which multi-tab mode loads on its own
+        if self.next_adapter is not None and not multi_tab:
+            return [self.next_adapter.search_url(self.product_name)]
+        return []
+
+    def step(self, driver, site_tabs=None) -> None:
+        """
+        Cancels the guesses of the previous step and preloads the new ones.
+        Args:
+            driver: Driver of the session, focused on the agent's tab
+            site_tabs: Per-site tabs in multi-tab mode
+        """
+        url = driver.current_url
+        predictions = [prediction for prediction in self.predict(driver, url, site_tabs is not None) if normalize(prediction) != normalize(url)]
+        wanted = {normalize(prediction) for prediction in predictions}
+        for key in [key for key in self.tabs if key not in wanted]:
+            self._close(driver, self.tabs.pop(key))
+            self.stats["cancelled"] += 1
+        for prediction in predictions:
+            key = normalize(prediction)
+            if key in self.tabs:
+                continue
+            if len(self.tabs) >= self.max_tabs:
+                break
+            if RATE_GOVERNOR and not navigation_governor.try_acquire(prediction):
+                self.stats["throttled"] += 1  # Never spend a site's navigation budget on a guess
+                continue
+            current = driver.current_window_handle
+            driver.switch_to.new_window("tab")
+            # Assigning location returns immediately, the page loads while the model thinks
+            driver.execute_script("window.location.href = arguments[0];", prediction)
+            self.tabs[key] = driver.current_window_handle
+            driver.switch_to.window(current)
+            self.stats["prefetched"] += 1
+
+    def take(self, driver, url: str, site_tabs=None) -> bool:
+        """
+        Switches to the tab preloading the url, if there is one.
+        Returns:
+            bool: True if the agent is now on the preloaded tab, False if the url still has to be loaded
+        """
+        handle = self.tabs.pop(normalize(url), None) if url else None
+        if handle is None or handle not in driver.window_handles:
+            return False
+        # The tab the agent leaves is closed rather than kept for go_back, so hits don't pile up hidden tabs
+        current = driver.current_window_handle
+        left_url = driver.current_url
+        driver.close()
+        driver.switch_to.window(handle)
+        self.returns[handle] = left_url
+        if site_tabs is not None:
+            site_tabs.replace_handle(current, handle)
+        self.stats["hits"] += 1
+        return True
+
+    def back(self, driver) -> bool:
+        """
+        Goes back from a preloaded tab (which has no history) by loading the page the agent came from.
+        Returns:
+            bool: False if the current tab wasn't preloaded, and the browser should go back normally
+        """
+        previous = self.returns.pop(driver.current_window_handle, None)
+        if previous is None:
+            return False
+        driver.get(previous)
+        return True
+
+    def _close(self, driver, handle: str) -> None:
+        try:
+            current = driver.current_window_handle
+            if handle in driver.window_handles:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(current)
+        except Exception as e:
+            print(f"Could not close a speculative tab: {str(e)}")
+
+    def finish(self, driver) -> None:
+        # Closes the guesses still loading, at the end of a comparison
+        for handle in self.tabs.values():
+            self._close(driver, handle)
+        self.stats["cancelled"] += len(self.tabs)
+        self.tabs.clear()
+        self.returns.clear()
+
+    def reset(self) -> None:
+        # The browser was restarted, its tabs are gone
+        self.stats["cancelled"] += len(self.tabs)
+        self.tabs.clear()
+        self.returns.clear()
+
+    def report(self) -> dict:
+        prefetched = self.stats["prefetched"]
+        return {**self.stats, "hit_rate": round(self.stats["hits"] / prefetched, 2) if prefetched else None}
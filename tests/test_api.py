@@ -0,0 +1,22 @@
+import pytest
+from fastapi import HTTPException
+
+import api
+
+
+def test_refuses_to_serve_beyond_loopback_without_a_token(monkeypatch):
+    monkeypatch.setattr(api, "API_TOKEN", None)
+    with pytest.raises(ValueError):
+        api.serve("0.0.0.0", 0)
+
+
+def test_authorize_checks_the_bearer_token(monkeypatch):
+    monkeypatch.setattr(api, "API_TOKEN", "secret")
+    api.authorize("Bearer secret")
+    for header in (None, "", "Bearer wrong", "secret"):
+        with pytest.raises(HTTPException) as error:
+            api.authorize(header)
+        assert error.value.status_code == 401
+
+    monkeypatch.setattr(api, "API_TOKEN", None)
+    api.authorize(None)  # Open on this host
@@ -0,0 +1,96 @@
+import multiprocessing
+import os
+
+import pytest
+
+import browser
+from browser import DriverPool, ProfileManager
+
+
+class FakeDriver:
+    def __init__(self):
+        self.window_handles = ["tab-1"]
+        self.switch_to = self
+        self.closed = False
+
+    def window(self, handle):
+        pass
+
+    def get(self, url):
+        pass
+
+    def quit(self):
+        self.closed = True
+
+
+@pytest.fixture
+def launches(monkeypatch):
+    started = []
+
+    def start_leased_driver():
+        started.append(FakeDriver())
+        return started[-1]
+
+    monkeypatch.setattr(browser, "start_leased_driver", start_leased_driver)
+    monkeypatch.setattr(browser, "browser_rss_mb", lambda driver: 100.0)
+    return started
+
+
+def test_pool_reuses_warm_browsers_and_times_both(launches):
+    pool = DriverPool(max_idle=1, max_rss_mb=1000)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert len(launches) == 1
+    report = pool.report()
+    assert (report["cold"], report["warm"]) == (1, 1)
+    assert report["warm_average_seconds"] is not None and report["cold_average_seconds"] is not None
+
+
+def test_pool_discards_dead_and_oversized_browsers(launches, monkeypatch):
+    pool = DriverPool(max_idle=1, max_rss_mb=1000)
+    driver = pool.acquire()
+    pool.release(driver, discard=True)
+    assert driver.closed
+
+    monkeypatch.setattr(browser, "browser_rss_mb", lambda driver: 5000.0)
+    driver = pool.acquire()
+    pool.release(driver)
+    assert driver.closed and pool.acquire() is not driver
+    assert pool.report()["warm"] == 0
+
+
+def hold_lease(root, leased, release):
+    # Runs in another process: leases a profile, reports it, and holds it until told to exit
+    leased.put(ProfileManager(root=root).lease())
+    release.wait(10)
+
+
+def test_profiles_are_leased_once_across_processes(tmp_path):
+    manager = ProfileManager(root=str(tmp_path), max_age_hours=0)
+    first = manager.lease()
+    assert os.path.basename(first) == "profile-0"
+
+    context = multiprocessing.get_context("spawn")
+    leased, release = context.Queue(), context.Event()
+    other = context.Process(target=hold_lease, args=(str(tmp_path), leased, release))
+    other.start()
+    try:
+        assert os.path.basename(leased.get(timeout=30)) == "profile-1"
+    finally:
+        release.set()
+        other.join(10)
+
+    # The other process exited, so its lock went with it without anyone cleaning up
+    assert os.path.basename(ProfileManager(root=str(tmp_path)).lease()) == "profile-1"
+    manager.release(first)
+    assert os.path.basename(ProfileManager(root=str(tmp_path)).lease()) == "profile-0"
+
+
+def test_startup_benchmark_times_fresh_interpreters(monkeypatch):
+    monkeypatch.setattr(browser, "PAGE_IMPORTS", "import sites")
+    monkeypatch.setattr(browser, "COMPARISON_IMPORTS", "import json")
+    averages = browser.benchmark_startup(runs=1)
+    assert set(averages) == {"page (deferred imports)", "first comparison", "page (everything imported at start)"}
+    assert all(seconds is not None and seconds >= 0 for seconds in averages.values())
+    assert browser.time_imports("import no_such_module") is None
@@ -0,0 +1,41 @@
+import browser
+import comparison
+from browser import DriverPool
+
+
+class FakeDriver:
+    current_url = "about:blank"
+
+    def execute(self, driver_command, params=None):
+        return {"value": None}
+
+    def set_page_load_timeout(self, seconds):
+        pass
+
+    def quit(self):
+        pass
+
+
+def test_the_last_progress_event_reports_the_run(monkeypatch, tmp_path):
+    monkeypatch.setattr(browser, "start_leased_driver", FakeDriver)
+    monkeypatch.setattr(browser, "browser_rss_mb", lambda driver: 100.0)
+    monkeypatch.setattr(comparison, "driver_pool", DriverPool(max_idle=1, max_rss_mb=1000))
+    monkeypatch.setattr(comparison, "MULTI_TAB", False)
+    monkeypatch.setattr(comparison, "SPECULATE", False)
+    monkeypatch.setattr(comparison, "price_history", comparison.PriceHistory(str(tmp_path / "prices.db")))
+
+    def search(product_name, adapter, **kwargs):
+        comparison.navigation_governor.observe(adapter.home_url, 0.2, False)
+        return {"product": product_name, "currentPrice": "$1.00", "status": "ok", "steps": 2, "seconds": 1.0}
+
+    monkeypatch.setattr(comparison, "run_site_search", search)
+    events = []
+    result = comparison._run_multi_site_search("Milo", ["fairprice"], None, events.append)
+    assert result is not None
+
+    report = events[-1]
+    assert report["event"] == "report"
+    assert report["sites"] == {"fairprice": {"status": "ok", "steps": 2, "seconds": 1.0}}
+    assert report["browser"]["acquire_seconds"] is not None and report["browser"]["pool"]["cold"] == 1
+    assert set(report) >= {"memory", "commands", "speculation", "model"}
+    assert "fairprice.com.sg" in report["navigation"]
@@ -0,0 +1,134 @@
+import socket
+import threading
+
+import pytest
+
+import distributed
+from distributed import HttpJobQueue, SQLiteJobQueue, serve
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteJobQueue(str(tmp_path / "jobs.db"), lease_seconds=60, max_attempts=2)
+
+
+def expired_queue(queue):
+    # Same file, but every lease it hands out has already run out
+    return SQLiteJobQueue(queue.path, lease_seconds=-1, max_attempts=queue.max_attempts)
+
+
+def test_claims_oldest_first_then_empty(queue):
+    first = queue.enqueue("Milo 1.5kg", ["fairprice"])
+    second = queue.enqueue("Tissue")
+
+    job = queue.claim("worker-a", host="host-a")
+    assert job == {"id": first, "product": "Milo 1.5kg", "sites": ["fairprice"], "attempts": 1}
+    assert queue.claim("worker-b")["id"] == second
+    assert queue.claim("worker-c") is None
+    assert queue.get(first)["status"] == "running" and queue.get(first)["worker"] == "worker-a"
+    assert {worker["id"]: worker["job_id"] for worker in queue.workers()} == {"worker-a": first, "worker-b": second, "worker-c": None}
+
+
+def test_complete_and_fail(queue):
+    done = queue.enqueue("Milo")
+    job = queue.claim("worker-a")
+    queue.complete("worker-a", job["id"], '{"fairprice": {}}')
+    assert queue.get(done)["status"] == "done" and queue.get(done)["result"] == '{"fairprice": {}}'
+
+    retried = queue.enqueue("Tissue")
+    queue.fail("worker-a", queue.claim("worker-a")["id"], "boom")
+    assert queue.get(retried)["status"] == "queued"  # One attempt left
+    queue.fail("worker-a", queue.claim("worker-a")["id"], "boom again")
+    assert queue.get(retried)["status"] == "failed" and queue.get(retried)["error"] == "boom again"
+
+
+def test_expired_lease_goes_back_to_the_queue(queue):
+    job_id = queue.enqueue("Milo")
+    expired_queue(queue).claim("worker-a")
+
+    assert queue.requeue_expired() == 1
+    assert queue.get(job_id)["status"] == "queued"
+    # The worker that lost its lease finds out at its next heartbeat, and can't complete the job anymore
+    assert queue.heartbeat("worker-a", job_id) is False
+    queue.complete("worker-a", job_id, "stale result")
+    assert queue.get(job_id)["status"] == "queued" and queue.get(job_id)["result"] is None
+
+    job = queue.claim("worker-b")
+    assert job["id"] == job_id and job["attempts"] == 2
+    assert queue.heartbeat("worker-b", job_id) is True
+
+
+def test_job_that_keeps_losing_its_worker_fails(queue):
+    job_id = queue.enqueue("Milo")
+    expired = expired_queue(queue)
+    for _ in range(queue.max_attempts):
+        expired.claim("worker-a")
+        queue.requeue_expired()
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and "stopped sending heartbeats" in job["error"]
+    assert queue.claim("worker-b") is None
+
+
+def test_heartbeat_keeps_the_lease(queue):
+    job_id = queue.enqueue("Milo")
+    queue.claim("worker-a")
+    assert queue.heartbeat("worker-a", job_id) is True
+    assert queue.requeue_expired() == 0
+    assert queue.get(job_id)["status"] == "running"
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def test_http_queue_against_the_coordinator(queue, monkeypatch):
+    monkeypatch.setattr(distributed, "QUEUE_TOKEN", "secret")
+    port = free_port()
+    stop = threading.Event()
+    coordinator = threading.Thread(target=serve, args=(queue, port, stop), kwargs={"host": "127.0.0.1"}, daemon=True)
+    coordinator.start()
+    try:
+        remote = HttpJobQueue(f"http://127.0.0.1:{port}", token="secret")
+        for _ in range(50):
+            try:
+                job_id = remote.enqueue("Milo", ["lazada"])
+                break
+            except distributed.requests.ConnectionError:
+                stop.wait(0.05)
+        job = remote.claim("remote-worker")
+        assert job["id"] == job_id and job["sites"] == ["lazada"]
+        assert remote.heartbeat("remote-worker", job_id) is True
+        remote.complete("remote-worker", job_id, "{}")
+        assert remote.get(job_id)["status"] == "done"
+
+        with pytest.raises(distributed.requests.HTTPError):
+            HttpJobQueue(f"http://127.0.0.1:{port}", token="wrong").claim("intruder")
+    finally:
+        stop.set()
+        coordinator.join(timeout=15)
+
+
+def test_refuses_to_serve_beyond_loopback_without_a_token(queue, monkeypatch):
+    monkeypatch.setattr(distributed, "QUEUE_TOKEN", None)
+    with pytest.raises(ValueError):
+        serve(queue, free_port(), host="0.0.0.0")
+
+
+def test_submit_waits_for_every_job_of_a_repeated_product(queue):
+    def work():
+        completed = 0
+        while completed < 3:
+            job = queue.claim("worker-a")
+            if job is None:
+                continue
+            queue.complete("worker-a", job["id"], "{}")
+            completed += 1
+
+    worker = threading.Thread(target=work, daemon=True)
+    worker.start()
+    finished = distributed.submit(queue, ["Milo", "Milo", "Tissue"], poll_seconds=0.01)
+    worker.join(5)
+    assert set(finished) == {"Milo", "Tissue"}
+    assert all(job["status"] == "done" for job in finished.values())
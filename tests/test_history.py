@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from history import PriceHistory, parse_price, to_combined
+
+
+def combined(price, promotion=None, original=None, product="Milo 1.5kg"):
+    return {"product": product, "currentPrice": price, "originalPrice": original, "promotion": promotion}
+
+
+@pytest.fixture
+def history(tmp_path):
+    return PriceHistory(str(tmp_path / "prices.db"))
+
+
+def test_parse_price():
+    assert parse_price("$1,299.00") == 1299.0
+    assert parse_price(" $ 3.50 ") == 3.5
+    assert parse_price(12) == 12.0
+    assert parse_price("Not available") is None
+    assert parse_price("$0.00") is None
+    assert parse_price(None) is None
+
+
+def test_record_skips_sites_without_a_price(history):
+    written = history.record("Milo 1.5kg", json.dumps({
+        "fairprice": combined("$20.50"),
+        "lazada": combined("Not available", product="Not found"),
+        "shopee": "garbage",
+    }), observed_at=100)
+    assert written == 1
+    assert set(history.latest("milo 1.5kg", as_of=100)) == {"fairprice"}
+
+
+def test_latest_per_site_and_as_of(history):
+    history.record("Milo 1.5kg", {"fairprice": combined("$20.50"), "lazada": combined("$19.00")}, observed_at=100)
+    history.record("  MILO  1.5KG", {"fairprice": combined("$18.00")}, observed_at=200)
+
+    latest = history.latest("milo 1.5kg", as_of=300)
+    assert latest["fairprice"]["current_price"] == 18.0
+    assert latest["lazada"]["current_price"] == 19.0
+    # As it was before the second observation
+    assert history.latest("Milo 1.5kg", as_of=150)["fairprice"]["current_price"] == 20.5
+    assert set(history.latest("Milo 1.5kg", site="lazada", as_of=300)) == {"lazada"}
+    assert history.latest("Milo 1.5kg", as_of=50) == {}
+
+
+def test_price_range(history):
+    for observed_at, price in [(100, "$20.00"), (200, "$17.50"), (300, "$22.00"), (400, "$10.00")]:
+        history.record("Milo 1.5kg", {"fairprice": combined(price)}, observed_at=observed_at)
+    ranges = history.price_range("Milo 1.5kg", since=150, until=350)
+    assert ranges == {"fairprice": {"site": "fairprice", "min": 17.5, "max": 22.0, "observations": 2}}
+
+
+def test_change_points_only_report_changes(history):
+    observations = [
+        (100, "$20.00", None),
+        (200, "$20.00", None),  # Unchanged
+        (300, "$18.00", None),  # Price drop
+        (400, "$18.00", "$2.00"),  # New promotion
+        (500, "$18.00", "$2.00"),
+    ]
+    for observed_at, price, promotion in observations:
+        history.record("Milo 1.5kg", {"fairprice": combined(price, promotion)}, observed_at=observed_at)
+    history.record("Milo 1.5kg", {"lazada": combined("$30.00")}, observed_at=250)
+
+    changes = history.change_points("Milo 1.5kg")
+    assert [(change["observed_at"], change["previous_price"], change["current_price"]) for change in changes] == [
+        (300, 20.0, 18.0),
+        (400, 18.0, 18.0),
+    ]
+    assert changes[1]["previous_promotion"] is None and changes[1]["promotion"] == 2.0
+    assert [change["observed_at"] for change in history.change_points("Milo 1.5kg", since=350)] == [400]
+    assert history.change_points("Milo 1.5kg", site="lazada") == []
+
+
+def test_to_combined_round_trip(history):
+    history.record("Milo 1.5kg", {"fairprice": combined("$18.00", "$2.00", "$20.00")}, observed_at=100)
+    restored = to_combined(history.latest("Milo 1.5kg", as_of=100))
+    assert restored["fairprice"]["currentPrice"] == "$18.00"
+    assert restored["fairprice"]["originalPrice"] == "$20.00"
+    assert restored["fairprice"]["promotion"] == "$2.00"
+    assert restored["fairprice"]["observedAt"] == 100
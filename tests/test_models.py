@@ -0,0 +1,145 @@
+import threading
+
+import httpx
+import openai
+import pytest
+from smolagents.models import ChatMessage, Model
+
+import models
+from models import DigestRoutingModel, ResilientModel, without_images
+
+
+def timeout_error():
+    return openai.APITimeoutError(request=httpx.Request("POST", "https://provider.test/chat/completions"))
+
+
+class StubModel(Model):
+    """
+    Answers with its name and call number. Calls listed in `failing` raise `error`, calls listed in
+    `gates` first wait for their event, to play a slow request. The counters are shared by the
+    shallow copies ResilientModel calls.
+    """
+
+    def __init__(self, name: str, failing=(), error=timeout_error, gates: dict = None, on_call=None):
+        super().__init__()
+        self.name = name
+        self.failing = set(failing)
+        self.error = error
+        self.gates = gates or {}
+        self.on_call = on_call or (lambda call: None)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, messages, *args, **kwargs):
+        with self.lock:
+            call = len(self.calls)
+            self.calls.append(messages)
+        self.on_call(call)
+        if call in self.gates:
+            self.gates[call].wait(5)
+        if call in self.failing:
+            raise self.error()
+        self.last_input_token_count = 10 + call
+        self.last_output_token_count = 1
+        return ChatMessage(role="assistant", content=f"{self.name} #{call}")
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(models.time, "sleep", lambda seconds: None)
+
+
+def test_retries_transient_errors():
+    stub = StubModel("primary", failing={0, 1})
+    model = ResilientModel(stub, retries=2)
+    assert model([]).content == "primary #2"
+    assert model.last_input_token_count == 12
+    assert model.stats["retries"] == 2 and model.stats["errors"] == 0
+
+
+def test_falls_back_once_retries_run_out():
+    model = ResilientModel(StubModel("primary", failing=range(10)), fallback=StubModel("fallback"), retries=1)
+    assert model([]).content == "fallback #0"
+    assert model.stats["fallbacks"] == 1 and model.stats["errors"] == 1
+
+
+def test_raises_without_fallback():
+    model = ResilientModel(StubModel("primary", failing=range(10)), retries=1)
+    with pytest.raises(openai.APITimeoutError):
+        model([])
+
+
+def test_does_not_retry_other_errors():
+    stub = StubModel("primary", failing={0}, error=lambda: ValueError("bad request"))
+    model = ResilientModel(stub, fallback=StubModel("fallback"), retries=3)
+    with pytest.raises(ValueError):
+        model([])
+    assert len(stub.calls) == 1
+
+
+def test_no_hedge_until_enough_samples():
+    model = ResilientModel(StubModel("primary"), hedge=True, hedge_min_samples=3)
+    assert model.hedge_after() is None
+    for _ in range(3):
+        model([])
+    assert model.hedge_after() is not None
+    assert model.stats["hedges"] == 0
+
+
+def test_hedge_wins_when_the_first_request_is_slow():
+    slow = threading.Event()  # Never set, the first request only returns once the test ends
+    stub = StubModel("primary", gates={0: slow})
+    model = ResilientModel(stub, hedge=True, hedge_min_samples=10)
+    model.latencies.extend([0.01] * 10)
+    try:
+        assert model([]).content == "primary #1"
+        assert model.stats["hedges"] == 1 and model.stats["hedge_wins"] == 1
+        assert model.last_input_token_count == 11  # Counts of the request that answered
+    finally:
+        slow.set()
+
+
+def test_hedge_falls_back_to_the_first_answer_when_the_second_fails():
+    slow = threading.Event()
+    # The hedge (call 1) fails and lets the slow first request finish
+    stub = StubModel("primary", failing={1}, gates={0: slow}, on_call=lambda call: call == 1 and slow.set())
+    model = ResilientModel(stub, hedge=True, hedge_min_samples=10)
+    model.latencies.extend([0.01] * 10)
+    assert model([]).content == "primary #0"
+    assert model.stats["hedges"] == 1 and model.stats["hedge_wins"] == 0 and model.stats["retries"] == 0
+
+
+def test_report_percentiles():
+    model = ResilientModel(StubModel("primary"))
+    model.latencies.extend(float(value) for value in range(1, 101))
+    report = model.report()
+    assert (report["p50"], report["p90"], report["p99"]) == (51.0, 91.0, 100.0)
+
+
+def test_digest_routing():
+    vision, text = StubModel("vision"), StubModel("text")
+    router = DigestRoutingModel(vision, text)
+    screenshot = {"role": "user", "content": [{"type": "text", "text": "Here"}, {"type": "image", "image": object()}]}
+    digest = {"role": "user", "content": [{"type": "text", "text": "Digest"}]}
+
+    assert router([digest, screenshot]).content == "vision #0"
+    assert router([screenshot, digest]).content == "text #0"
+    assert text.calls[0] == [{"role": "user", "content": [{"type": "text", "text": "Here"}]}, digest]
+    assert router.calls == {"vision": 1, "text": 1}
+    assert without_images([{"role": "user", "content": [{"type": "image", "image": None}]}]) == []
+
+
+def test_model_report(monkeypatch):
+    from functools import lru_cache
+
+    vision = ResilientModel(StubModel("vision", failing={0}), retries=1)
+    text = ResilientModel(StubModel("text"))
+    router = DigestRoutingModel(vision, text)
+    monkeypatch.setattr(models, "get_model", lru_cache(maxsize=1)(lambda: router))
+    assert models.model_report() is None  # Not created yet
+
+    models.get_model()([{"role": "user", "content": [{"type": "image", "image": object()}]}])
+    report = models.model_report()
+    assert report["routed"] == {"vision": 1, "text": 0}
+    assert report["vision"]["calls"] == 1 and report["vision"]["retries"] == 1
+    assert report["text"]["calls"] == 0
@@ -0,0 +1,87 @@
+import json
+import shutil
+
+import pytest
+import requests
+
+import fixture_server
+from fixture_server import FIXTURE_SITE
+from network import ResponseCapture, best_match, find_products, to_details
+
+IPHONE = {
+    "product": "Apple iPhone 16 Pro Max 256GB Desert Titanium",
+    "currentPrice": "$1899.00",
+    "originalPrice": "$2099.00",
+    "promotion": "$200.00",
+    "source": "network",
+}
+
+
+@pytest.fixture
+def store():
+    server = fixture_server.serve()
+    yield f"http://127.0.0.1:{fixture_server.FIXTURE_PORT}"
+    server.shutdown()
+    server.server_close()
+
+
+class LoggingDriver:
+    """
+    Plays Chrome for ResponseCapture: fetches the fixture store's search API like its page script does,
+    and hands the response over as performance log entries and a DevTools response body.
+    """
+
+    def __init__(self):
+        self.bodies = {}
+        self.log = []
+
+    def get(self, url):
+        api_url = url.replace("/search?", "/api/search?")
+        response = requests.get(api_url, timeout=10)
+        request_id = str(len(self.bodies) + 1)
+        self.bodies[request_id] = response.text
+        self.log += [
+            {"message": json.dumps({"message": {"method": "Network.responseReceived", "params": {
+                "requestId": request_id,
+                "response": {"url": api_url, "mimeType": response.headers["Content-Type"], "headers": {}},
+            }}})},
+            {"message": json.dumps({"message": {"method": "Network.loadingFinished", "params": {"requestId": request_id}}})},
+        ]
+
+    def get_log(self, name):
+        entries, self.log = self.log, []
+        return entries
+
+    def execute_cdp_cmd(self, command, params):
+        return {"body": self.bodies[params["requestId"]], "base64Encoded": False}
+
+
+def test_find_products_and_match(store):
+    payload = requests.get(f"{store}/api/search?q=iphone 16", timeout=10).json()
+    products = find_products(payload, FIXTURE_SITE)
+    assert [product["currentPrice"] for product in products] == [1899.0, 1249.0, 12.9]
+    assert to_details(best_match(products, "iPhone 16")) == IPHONE
+    assert best_match(products, "samsung galaxy") is None
+
+
+def test_capture_from_the_fixture_store(store):
+    driver = LoggingDriver()
+    capture = ResponseCapture([FIXTURE_SITE])
+    driver.get(FIXTURE_SITE.search_url("iphone 16"))
+    assert capture.wait_for(driver, FIXTURE_SITE, "iphone 16", timeout=2) == IPHONE
+    assert capture.responses == 1
+
+    driver.get(FIXTURE_SITE.search_url("milo 1.5kg"))
+    details = capture.wait_for(driver, FIXTURE_SITE, "milo 1.5kg", timeout=2)
+    assert details["currentPrice"] == "$15.20" and details["promotion"] == "$3.30"
+
+
+@pytest.mark.skipif(
+    not any(shutil.which(name) for name in ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser")),
+    reason="needs Chrome",
+)
+def test_fixture_check_in_chrome():
+    # python fixture_server.py --check "iphone 16", with a real browser and its performance log
+    details, responses = fixture_server.check("iphone 16")
+    assert details == IPHONE
+    assert responses >= 1
@@ -0,0 +1,86 @@
+import shutil
+from urllib.parse import quote
+
+import pytest
+from PIL import Image, ImageDraw
+
+from observations import FrameDeduper, changed_region, dhash, hamming, page_digest
+
+
+def page(box=None, size=(800, 600)):
+    # A fake page: header bar and a few product cards, plus an optional black box
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, size[0], 60), fill=(200, 30, 30))
+    for left in range(40, size[0] - 150, 190):
+        draw.rectangle((left, 120, left + 150, 400), fill=(120, 120, 200))
+    if box:
+        draw.rectangle(box, fill="black")
+    return image
+
+
+def test_hash_and_region():
+    assert hamming(dhash(page()), dhash(page())) == 0
+    assert hamming(dhash(page()), dhash(page().transpose(Image.Transpose.FLIP_TOP_BOTTOM))) > 12
+    assert changed_region(page(), page()) is None
+    assert changed_region(page(), page(box=(300, 450, 320, 470)), padding=10) == (290, 440, 331, 481)
+    assert changed_region(page(), page(size=(400, 300))) == (0, 0, 400, 300)
+
+
+def test_unchanged_frames_become_text():
+    deduper = FrameDeduper(diff_crop=False)
+    first = page()
+    assert deduper.observe(first, 0) == ([first], None)
+    images, note = deduper.observe(page(), 1)
+    assert images is None and "after step 0" in note
+    images, note = deduper.observe(page(), 2)
+    assert "after step 0" in note  # Still the last frame the model saw
+    assert deduper.saved == 2
+
+
+def test_changed_frames_are_sent_in_full():
+    deduper = FrameDeduper(diff_crop=False)
+    deduper.observe(page(), 0)
+    changed = page(box=(300, 450, 320, 470))
+    assert deduper.observe(changed, 1) == ([changed], None)
+    assert deduper.previous_step == 1
+
+
+def test_near_duplicates_are_cropped_against_the_last_full_frame():
+    deduper = FrameDeduper(diff_crop=True)
+    deduper.observe(page(), 0)
+    images, note = deduper.observe(page(box=(300, 450, 320, 470)), 1)
+    assert images[0].size == (101, 101) and "since step 0" in note
+    # The model never saw step 1 whole, so step 2 is still compared to step 0
+    assert deduper.previous_step == 0
+    images, note = deduper.observe(page(box=(300, 450, 320, 470)), 2)
+    assert images[0].size == (101, 101) and "since step 0" in note
+
+    report = deduper.report()
+    assert (report["frames"], report["unchanged"], report["cropped"], report["saved"]) == (3, 0, 2, 2)
+    assert report["pixels_sent_fraction"] == round((800 * 600 + 2 * 101 * 101) / (3 * 800 * 600), 3)
+
+
+# A product card whose price label is drawn in an inline SVG icon
+SVG_PAGE = """<html><head><title>Milo</title></head><body>
+<h1>Milo 1.5kg</h1>
+<span>$15.20</span>
+<svg width="120" height="40"><text x="0" y="20">$99.99 icon</text></svg>
+</body></html>"""
+
+
+@pytest.mark.skipif(
+    not any(shutil.which(name) for name in ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser")),
+    reason="needs Chrome",
+)
+def test_digest_skips_inline_svg():
+    from browser import initialize_driver, quit_driver
+
+    driver = initialize_driver(capture=False)
+    try:
+        driver.get("data:text/html," + quote(SVG_PAGE))
+        digest = page_digest(driver)
+    finally:
+        quit_driver(driver)
+    assert "'Milo 1.5kg'" in digest and "'$15.20'" in digest
+    assert "99.99" not in digest
@@ -0,0 +1,61 @@
+import json
+from types import SimpleNamespace
+
+from PIL import Image
+
+from observations import FrameDeduper
+from run_log import RunLog, prune, release_step
+
+
+def screenshot():
+    return Image.new("RGB", (800, 600), "white")
+
+
+def steps(count):
+    return [SimpleNamespace(step_number=number, observations_images=[screenshot()], agent_memory=[{"role": "user"}]) for number in range(count)]
+
+
+def test_release_keeps_the_last_two_screenshots():
+    agent = SimpleNamespace(logs=[SimpleNamespace()] + steps(5))  # The task step has no step number
+    release_step(agent.logs[-1], agent)
+    kept = [step.step_number for step in agent.logs[1:] if step.observations_images]
+    assert kept == [3, 4]
+    assert agent.logs[-1].agent_memory is None
+
+
+def test_release_keeps_the_frame_the_deduper_points_to():
+    deduper = FrameDeduper()
+    deduper.observe(screenshot(), 1)
+    agent = SimpleNamespace(logs=steps(6), frame_deduper=deduper)
+    release_step(agent.logs[-1], agent)
+    kept = [step.step_number for step in agent.logs if step.observations_images]
+    assert kept == [1, 4, 5]
+
+
+def test_steps_are_streamed_with_their_screenshots(tmp_path):
+    run_log = RunLog("lazada", "Milo 1.5kg!", root=str(tmp_path))
+    step = SimpleNamespace(
+        step_number=3, duration=1.234, llm_output="Thought: ...", tool_calls=[SimpleNamespace(arguments="go_back()")],
+        observations="Current url: https://www.lazada.sg/", error=None, action_output=None, observations_images=[screenshot()],
+    )
+    run_log.write_step(step)
+    # On disk as soon as it was written, before the log is closed
+    with open(f"{run_log.path}/steps.jsonl") as f:
+        started, written = [json.loads(line) for line in f]
+    assert started["product"] == "Milo 1.5kg!" and "-lazada-milo-1-5kg-" in run_log.path
+    assert written["step"] == 3 and written["code"] == "go_back()" and written["duration"] == 1.23
+    with Image.open(written["screenshots"][0]) as saved:
+        assert saved.size == (800, 600)
+
+    run_log.close({"status": "ok", "steps": 4})
+    run_log.write({"event": "late"})  # Ignored once closed
+    with open(f"{run_log.path}/steps.jsonl") as f:
+        finished = json.loads(f.readlines()[-1])
+    assert finished["event"] == "finished" and finished["status"] == "ok"
+
+
+def test_prune_keeps_the_newest_runs(tmp_path):
+    for name in ("20260101-000000-a", "20260102-000000-b", "20260103-000000-c"):
+        (tmp_path / name).mkdir()
+    prune(str(tmp_path), 2)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["20260102-000000-b", "20260103-000000-c"]
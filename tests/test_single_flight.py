@@ -0,0 +1,137 @@
+import threading
+
+import pytest
+
+from comparison import SingleFlight
+from tools import CancelToken
+
+
+def test_key_ignores_case_spacing_and_site_order():
+    assert SingleFlight.key("  Milo  1.5KG ", ["lazada", "fairprice"]) == SingleFlight.key("milo 1.5kg", ["fairprice", "lazada"])
+    assert SingleFlight.key("Milo", None) == SingleFlight.key("milo", ["fairprice", "lazada"])  # Every site
+    assert SingleFlight.key("Milo", ["lazada"]) != SingleFlight.key("Milo", ["fairprice"])
+
+
+class Leader:
+    # Runs a comparison in a thread that reports one event, then blocks until released
+    def __init__(self, flights, key, cancel_token=None):
+        self.flights, self.key, self.cancel_token = flights, key, cancel_token
+        self.started, self.release = threading.Event(), threading.Event()
+        self.calls = 0
+        self.events = []
+        self.result = None
+        self.thread = threading.Thread(target=self.run)
+
+    def run(self):
+        self.result = self.flights.run(self.key, self.compare, self.cancel_token, self.events.append)
+
+    def compare(self, progress):
+        self.calls += 1
+        progress({"event": "browser ready"})
+        self.started.set()
+        self.release.wait(5)
+        return None if self.cancel_token is not None and self.cancel_token.cancelled else "result"
+
+
+def wait_for_followers(flights, count):
+    for _ in range(500):
+        if flights.stats["coalesced"] >= count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("followers never attached")
+
+
+def test_followers_share_the_leaders_run_and_progress():
+    flights = SingleFlight()
+    key = SingleFlight.key("Milo")
+    leader = Leader(flights, key)
+    leader.thread.start()
+    leader.started.wait(5)
+
+    results, events = {}, {0: [], 1: []}
+
+    def follow(index):
+        results[index] = flights.run(key, lambda progress: pytest.fail("followers must not run"), None, events[index].append)
+
+    followers = [threading.Thread(target=follow, args=(index,)) for index in range(2)]
+    for follower in followers:
+        follower.start()
+    wait_for_followers(flights, 2)
+    assert flights.in_flight == 1
+    leader.release.set()
+    for thread in [leader.thread, *followers]:
+        thread.join(5)
+
+    assert leader.calls == 1
+    assert leader.result == results[0] == results[1] == "result"
+    # Events from before they attached are replayed first
+    assert [event["event"] for event in events[0]] == ["browser ready", "attached"]
+    assert flights.stats == {"runs": 1, "coalesced": 2}
+    assert flights.in_flight == 0
+
+
+def test_follower_restarts_when_the_leader_is_cancelled():
+    flights = SingleFlight()
+    key = SingleFlight.key("Milo")
+    token = CancelToken()
+    leader = Leader(flights, key, cancel_token=token)
+    leader.thread.start()
+    leader.started.wait(5)
+
+    results = {}
+    follower = threading.Thread(target=lambda: results.__setitem__("follower", flights.run(key, lambda progress: "fresh")))
+    follower.start()
+    wait_for_followers(flights, 1)
+    token.cancel()
+    leader.release.set()
+    leader.thread.join(5)
+    follower.join(5)
+
+    assert leader.result is None
+    assert results["follower"] == "fresh"
+    assert flights.stats["runs"] == 2
+
+
+def test_cancelled_follower_stops_waiting():
+    flights = SingleFlight()
+    key = SingleFlight.key("Milo")
+    leader = Leader(flights, key)
+    leader.thread.start()
+    leader.started.wait(5)
+
+    token = CancelToken()
+    token.cancel()
+    assert flights.run(key, lambda progress: "unused", token) is None
+    leader.release.set()
+    leader.thread.join(5)
+    assert leader.result == "result"
+
+
+def test_leader_error_reaches_followers():
+    flights = SingleFlight()
+    key = SingleFlight.key("Milo")
+    started, release = threading.Event(), threading.Event()
+
+    def failing(progress):
+        started.set()
+        release.wait(5)
+        raise RuntimeError("browser crashed")
+
+    errors = []
+
+    def call(fn):
+        try:
+            flights.run(key, fn)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call, args=(failing,))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call, args=(lambda progress: "unused",))
+    follower.start()
+    wait_for_followers(flights, 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert errors == ["browser crashed", "browser crashed"]
@@ -0,0 +1,70 @@
+import pytest
+
+import speculation
+from sites import SITE_ADAPTERS
+from speculation import Speculator
+
+FAIRPRICE, LAZADA = SITE_ADAPTERS["fairprice"], SITE_ADAPTERS["lazada"]
+PRODUCT_PAGE = "https://www.fairprice.com.sg/product/milo-1-5kg-123"
+
+
+class FakeDriver:
+    # Tabs as handle -> url, the focused one is current_window_handle
+    def __init__(self, url):
+        self.tabs = {"tab-0": url}
+        self.current_window_handle = "tab-0"
+        self.switch_to = self
+
+    @property
+    def current_url(self):
+        return self.tabs[self.current_window_handle]
+
+    @property
+    def window_handles(self):
+        return list(self.tabs)
+
+    def window(self, handle):
+        self.current_window_handle = handle
+
+    def new_window(self, kind):
+        handle = f"tab-{len(self.tabs)}"
+        self.tabs[handle] = "about:blank"
+        self.current_window_handle = handle
+
+    def execute_script(self, script, *args):
+        self.tabs[self.current_window_handle] = args[0]
+
+    def close(self):
+        del self.tabs[self.current_window_handle]
+
+
+@pytest.fixture(autouse=True)
+def no_governor(monkeypatch):
+    monkeypatch.setattr(speculation, "RATE_GOVERNOR", False)
+
+
+def test_next_site_search_page_survives_the_first_step_of_that_site():
+    driver = FakeDriver(PRODUCT_PAGE)
+    speculator = Speculator("Milo")
+    speculator.begin_site(FAIRPRICE, LAZADA)
+    speculator.step(driver)  # On the product page, the next site's search page starts loading
+    assert speculator.stats["prefetched"] == 1
+
+    # Lazada's first step ("from helium import *") doesn't navigate
+    speculator.begin_site(LAZADA)
+    speculator.step(driver)
+    assert speculator.stats["cancelled"] == 0
+
+    assert speculator.take(driver, LAZADA.search_url("Milo"))
+    assert driver.current_url == LAZADA.search_url("Milo") and len(driver.tabs) == 1
+    assert speculator.stats["hits"] == 1
+
+
+def test_guesses_for_the_previous_site_are_cancelled():
+    driver = FakeDriver(PRODUCT_PAGE)
+    driver.tabs["tab-1"] = "https://www.fairprice.com.sg/product/milo-2kg-456"
+    speculator = Speculator("Milo")
+    speculator.tabs = {"https://www.fairprice.com.sg/product/milo-2kg-456": "tab-1"}
+    speculator.begin_site(LAZADA)
+    speculator.step(driver)
+    assert speculator.stats["cancelled"] == 1 and list(driver.tabs) == ["tab-0"]
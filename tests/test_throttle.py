@@ -0,0 +1,147 @@
+import pytest
+
+import throttle
+from throttle import NavigationGovernor, domain_of
+
+
+class Clock:
+    # Stands in for time.monotonic and time.sleep, sleeping moves it forward
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttle.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(throttle.time, "sleep", clock.sleep)
+    monkeypatch.setattr(throttle.random, "uniform", lambda low, high: low)  # No jitter
+    return clock
+
+
+def governor(**kwargs):
+    settings = {"rate": 1.0, "min_rate": 0.1, "max_rate": 4.0, "burst": 2, "target_seconds": 1.5, "max_wait": 30}
+    return NavigationGovernor(**{**settings, **kwargs})
+
+
+def test_domain_of():
+    assert domain_of("https://www.lazada.sg/catalog?q=milo") == "lazada.sg"
+    assert domain_of("https://fairprice.com.sg/") == "fairprice.com.sg"
+    assert domain_of("about:blank") is None
+    assert domain_of(None) is None
+
+
+def test_burst_then_paced(clock):
+    pacer = governor()
+    assert pacer.acquire("https://lazada.sg/a") == 0
+    assert pacer.acquire("https://lazada.sg/b") == 0
+    # Burst spent: the third waits one token at 1 navigation/s, the fourth queues behind it
+    assert pacer.acquire("https://lazada.sg/c") == pytest.approx(1.0)
+    assert pacer.acquire("https://lazada.sg/d") == pytest.approx(1.0)
+    # Other domains have their own bucket
+    assert pacer.acquire("https://fairprice.com.sg/") == 0
+    assert pacer.acquire("about:blank") == 0
+    assert pacer.report()["lazada.sg"]["navigations"] == 4
+
+
+def test_wait_is_capped(clock):
+    pacer = governor(burst=1, max_wait=2)
+    pacer.acquire("https://lazada.sg/")
+    for _ in range(10):
+        pacer.acquire("https://lazada.sg/", wait=False)  # Charged, not waited for
+    assert clock.slept == []
+    assert pacer.acquire("https://lazada.sg/") == 2
+
+
+def test_try_acquire_never_waits(clock):
+    pacer = governor(burst=1)
+    assert pacer.try_acquire("https://lazada.sg/") is True
+    assert pacer.try_acquire("https://lazada.sg/") is False
+    clock.now += 1
+    assert pacer.try_acquire("https://lazada.sg/") is True
+    assert clock.slept == []
+
+
+def test_rate_adapts_to_responses(clock):
+    pacer = governor()
+    url = "https://lazada.sg/"
+    pacer.observe(url, 0.2, error=False)
+    assert pacer.buckets["lazada.sg"].rate == pytest.approx(1.1)  # Additive increase
+    pacer.observe(url, 0.2, error=True)
+    assert pacer.buckets["lazada.sg"].rate == pytest.approx(0.55)  # Halved on an error page
+    assert pacer.buckets["lazada.sg"].tokens <= 0
+    for _ in range(5):
+        pacer.observe(url, 10.0, error=False)  # Slow answers keep cutting it
+    assert pacer.buckets["lazada.sg"].rate < 0.55 * 0.8
+    for _ in range(20):
+        pacer.observe(url, 10.0, error=True)
+    assert pacer.buckets["lazada.sg"].rate == 0.1  # Never below min_rate
+    for _ in range(200):
+        pacer.observe(url, 0.01, error=False)
+    assert pacer.buckets["lazada.sg"].rate == 4.0  # Nor above max_rate
+
+
+class FakeDriver:
+    # Answers the governor's probe with the page the last command left it on
+    def __init__(self, pages):
+        self.pages = pages  # url -> (title, status)
+        self.url = "about:blank"
+        self.document = 0
+        self.commands = []
+
+    def execute(self, driver_command, params=None):
+        self.commands.append(driver_command)
+        if driver_command == "get":
+            self.url = params["url"]
+            self.document += 1
+        elif driver_command == "actions" and params.get("navigates"):
+            self.url = params["navigates"]
+            self.document += 1
+        return {}
+
+    def execute_script(self, script, *args):
+        title, status = self.pages.get(self.url, ("", 200))
+        return [self.url, title, self.document, status, 0.3]
+
+
+def test_attached_driver_paces_and_observes_navigations(clock):
+    pacer = governor(burst=1)
+    driver = FakeDriver({"https://lazada.sg/blocked": ("Access Denied", 403)})
+    pacer.attach(driver)
+    pacer.attach(driver)  # Attaching twice doesn't wrap twice
+
+    driver.execute("get", {"url": "https://lazada.sg/"})
+    driver.execute("get", {"url": "https://lazada.sg/catalog"})
+    # The first page answered fast, so the rate already went up from 1 to 1.1 navigations/s
+    assert clock.slept == [pytest.approx(1 / 1.1)]
+    assert driver.commands == ["get", "get"]
+
+    # A helium click that loaded a page is charged afterwards, one that didn't is not
+    driver.execute("actions", {"navigates": "https://lazada.sg/products/1"})
+    driver.execute("actions", {})
+    assert pacer.report()["lazada.sg"]["navigations"] == 3
+
+    # An error page slows the domain down
+    rate = pacer.buckets["lazada.sg"].rate
+    driver.execute("get", {"url": "https://lazada.sg/blocked"})
+    assert pacer.buckets["lazada.sg"].rate == pytest.approx(rate * 0.5)
+    assert pacer.report()["lazada.sg"]["errors"] == 1
+
+
+def test_after_click_charges_javascript_clicks(clock):
+    pacer = governor()
+    driver = FakeDriver({})
+    pacer.attach(driver)
+    driver.execute("get", {"url": "https://lazada.sg/"})
+    driver.url, driver.document = "https://lazada.sg/products/2", driver.document + 1  # What a JavaScript click did
+    pacer.after_click(driver)
+    pacer.after_click(driver)  # Same document, not a second navigation
+    assert pacer.report()["lazada.sg"]["navigations"] == 2
@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+import tools
+from tools import CancelToken, Cancelled, ToolTimeout
+
+
+class FakeDriver:
+    current_url = "https://www.lazada.sg/catalog/?q=milo"
+
+    def find_elements(self, by, value):
+        return [object()]
+
+
+@pytest.fixture
+def driver(monkeypatch):
+    monkeypatch.setattr(tools, "sleep", lambda seconds: None)
+    driver = FakeDriver()
+    monkeypatch.setattr(tools.session(), "driver", driver)
+    return driver
+
+
+@pytest.mark.parametrize("tool", [
+    lambda: tools.input_search("Milo"),
+    lambda: tools.click_product_image("Milo"),
+    lambda: tools.get_product_details(),
+    lambda: tools.handle_recaptcha(),
+])
+def test_tools_stop_on_cancellation_and_deadlines(driver, monkeypatch, tool):
+    # Both must end the step, not come back as a "Failed ..." observation the agent retries
+    token = CancelToken()
+    token.cancel()
+    monkeypatch.setattr(tools.session(), "cancel_token", token)
+    with pytest.raises(Cancelled):
+        tool()
+
+    monkeypatch.setattr(tools.session(), "cancel_token", None)
+    monkeypatch.setattr(tools.session(), "site_deadline", time.monotonic() - 1)
+    with pytest.raises(ToolTimeout):
+        tool()
@@ -0,0 +1,180 @@
+import json
+
+import pytest
+
+import comparison
+import tools
+from trajectories import PRODUCT_PLACEHOLDER, TrajectoryCache, instantiate, is_failure, parameterize, url_shape
+
+SEARCH = "go_to_search('lazada', 'Milo 1.5kg')"
+OPEN = "click_product_image(1)"
+DETAILS = "print(get_product_details())"
+
+
+def test_parameterize_and_instantiate_round_trip():
+    template = parameterize(f"{SEARCH}\nsearch_item_ctrl_f(\"MILO 1.5KG\")\nprint('Milo')", "Milo 1.5kg")
+    assert template == f"go_to_search('lazada', {PRODUCT_PLACEHOLDER})\nsearch_item_ctrl_f({PRODUCT_PLACEHOLDER})\nprint('Milo')"
+    # Quotes and backslashes in the new product can't break out of the literal
+    code = instantiate(template, "Kid's \"Milo\" \\ 2kg")
+    assert code.splitlines()[0] == "go_to_search('lazada', 'Kid\\'s \"Milo\" \\\\ 2kg')"
+    compile(code, "<replay>", "exec")
+
+
+def test_url_shape():
+    assert url_shape("https://www.lazada.sg/catalog/?q=milo") == "lazada.sg/catalog"
+    assert url_shape("https://www.lazada.sg/products/milo-i123.html") == "lazada.sg/products"
+    assert url_shape("https://fairprice.com.sg/") == "fairprice.com.sg/"
+    assert url_shape("about:blank") == ""
+    assert url_shape(None) == ""
+
+
+def test_is_failure():
+    assert is_failure("Failed to click the product")
+    assert is_failure("Unknown site 'amazon'")
+    assert not is_failure("Clicked element 3")
+    assert not is_failure(None)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TrajectoryCache(str(tmp_path / "trajectories.json"), max_per_site=2)
+
+
+def steps(*codes):
+    urls = {SEARCH: "https://www.lazada.sg/catalog/?q=milo", OPEN: "https://www.lazada.sg/products/milo-i1.html"}
+    return [(code, urls.get(code, "https://www.lazada.sg/products/milo-i1.html")) for code in codes]
+
+
+def test_record_and_lookup_persist(cache):
+    assert cache.record("lazada", "Milo 1.5kg", steps(SEARCH, OPEN, DETAILS))
+    recipe = TrajectoryCache(cache.path).lookup("lazada")  # Read back from disk
+    assert [step["code"] for step in recipe["steps"]] == [f"go_to_search('lazada', {PRODUCT_PLACEHOLDER})", OPEN, DETAILS]
+    assert [step["shape"] for step in recipe["steps"]] == ["lazada.sg/catalog", "lazada.sg/products", "lazada.sg/products"]
+    assert recipe["successes"] == 1
+
+    # The same code recorded again counts as another success instead of a second recipe
+    cache.record("lazada", "Tissue", steps(SEARCH.replace("Milo 1.5kg", "Tissue"), OPEN, DETAILS))
+    assert len(cache.recipes["lazada"]) == 1 and cache.lookup("lazada")["successes"] == 2
+    assert cache.lookup("fairprice") is None
+
+
+def test_unreplayable_runs_are_not_recorded(cache):
+    assert not cache.record("lazada", "Milo 1.5kg", steps(SEARCH, "click_mark(4)", DETAILS))
+    assert not cache.record("lazada", "Milo 1.5kg", steps(OPEN, DETAILS))  # Never mentions the product
+    assert not cache.record("lazada", "Milo 1.5kg", [])
+    assert cache.lookup("lazada") is None
+
+
+def test_failing_recipes_sink_and_get_dropped(cache):
+    cache.record("lazada", "Milo", steps(SEARCH.replace("Milo 1.5kg", "Milo"), OPEN, DETAILS))
+    unreliable = cache.lookup("lazada")
+    cache.outcome("lazada", unreliable, False)
+    assert cache.lookup("lazada") is None  # 1 success - 2 x 1 failure
+
+    cache.record("lazada", "Milo", steps(SEARCH.replace("Milo 1.5kg", "Milo"), DETAILS))
+    cache.record("lazada", "Milo", steps(SEARCH.replace("Milo 1.5kg", "Milo"), "scroll_down()", DETAILS))
+    assert len(cache.recipes["lazada"]) == 2  # max_per_site, the failing one went
+    assert unreliable not in cache.recipes["lazada"]
+    with open(cache.path) as f:
+        assert json.load(f)["lazada"] == cache.recipes["lazada"]
+
+
+class FakeDriver:
+    def __init__(self):
+        self.current_url = "about:blank"
+
+
+class FakeAgent:
+    # Runs replayed code against a script of (url after the step, output)
+    def __init__(self, driver, outcomes):
+        self.driver = driver
+        self.outcomes = outcomes
+        self.state = {}
+        self.ran = []
+
+    def python_executor(self, code, state):
+        self.ran.append(code)
+        url, output = self.outcomes[len(self.ran) - 1]
+        if isinstance(output, Exception):
+            raise output
+        self.driver.current_url = url
+        return output, "", False
+
+
+@pytest.fixture
+def driver(monkeypatch):
+    monkeypatch.setattr(comparison.time, "sleep", lambda seconds: None)
+    driver = FakeDriver()
+    monkeypatch.setattr(tools.session(), "driver", driver)
+    return driver
+
+
+def recipe():
+    return {"steps": [
+        {"code": f"go_to_search('lazada', {PRODUCT_PLACEHOLDER})", "shape": "lazada.sg/catalog"},
+        {"code": "scroll_down()", "shape": "lazada.sg/catalog"},
+        {"code": OPEN, "shape": "lazada.sg/products"},
+        {"code": DETAILS, "shape": "lazada.sg/products"},
+    ]}
+
+
+DETAILS_OUTPUT = json.dumps({"product": "Milo 2kg", "currentPrice": "$30.00"})
+
+
+def test_replay_reaches_the_details(driver):
+    agent = FakeAgent(driver, [
+        ("https://www.lazada.sg/catalog/?q=milo+2kg", None),
+        ("https://www.lazada.sg/catalog/?q=milo+2kg#scrolled", None),
+        ("https://www.lazada.sg/products/milo-2kg-i9.html", None),
+        ("https://www.lazada.sg/products/milo-2kg-i9.html", DETAILS_OUTPUT),
+    ])
+    details, done = comparison.replay_trajectory(agent, recipe(), "Milo 2kg")
+    assert details["currentPrice"] == "$30.00"
+    assert agent.ran[0] == "go_to_search('lazada', 'Milo 2kg')"
+    assert len(done) == 4
+
+
+def test_replay_stops_on_another_kind_of_page(driver):
+    agent = FakeAgent(driver, [
+        ("https://www.lazada.sg/catalog/?q=milo+2kg", None),
+        ("https://www.lazada.sg/catalog/?q=milo+2kg", None),
+        ("https://www.lazada.sg/shop/milo-official", None),  # Clicked a store banner instead
+    ])
+    details, done = comparison.replay_trajectory(agent, recipe(), "Milo 2kg")
+    assert details is None
+    assert [code for code, _ in done] == ["go_to_search('lazada', 'Milo 2kg')", "scroll_down()"]
+    assert "Continue from there" in comparison.replayed_note(done, driver.current_url)
+
+
+def test_replay_stops_on_failures(driver):
+    agent = FakeAgent(driver, [("https://www.lazada.sg/catalog/?q=x", "Failed to load the search page")])
+    assert comparison.replay_trajectory(agent, recipe(), "x") == (None, [])
+
+    agent = FakeAgent(driver, [("https://www.lazada.sg/catalog/?q=x", RuntimeError("stale element"))])
+    assert comparison.replay_trajectory(agent, recipe(), "x") == (None, [])
+
+
+def test_product_specific_literals_are_not_recorded(cache):
+    # The product page of the recorded run, or part of its name, would be found again for any product
+    assert not cache.record("lazada", "iPhone 15", steps(SEARCH.replace("Milo 1.5kg", "iPhone 15"), "go_to('https://www.lazada.sg/products/apple-iphone-15-i123.html')", DETAILS))
+    assert not cache.record("lazada", "iPhone 15", steps(SEARCH.replace("Milo 1.5kg", "iPhone 15"), "search_item_ctrl_f('iPhone')", DETAILS))
+    assert not cache.record("lazada", "iPhone 15", steps(SEARCH.replace("Milo 1.5kg", "iPhone 15"), "click_product_image(", DETAILS))
+    assert cache.lookup("lazada") is None
+    # The site's home page is the same for every product
+    assert cache.record("lazada", "iPhone 15", steps("go_to('https://www.lazada.sg/')", "input_search('iPhone 15')", OPEN, DETAILS))
+
+
+def test_replay_of_another_product_falls_back_to_the_agent(driver, cache):
+    cache.record("lazada", "iPhone 15", steps(SEARCH.replace("Milo 1.5kg", "iPhone 15"), OPEN, DETAILS))
+    # The recipe lands on a product page, but the page is still the phone's
+    agent = FakeAgent(driver, [
+        ("https://www.lazada.sg/catalog/?q=milo+1.5kg", None),
+        ("https://www.lazada.sg/products/apple-iphone-15-i123.html", None),
+        ("https://www.lazada.sg/products/apple-iphone-15-i123.html", json.dumps({"product": "Apple iPhone 15 128GB", "currentPrice": "$1,099.00"})),
+    ])
+    recipe = cache.lookup("lazada")
+    details, done = comparison.replay_trajectory(agent, recipe, "Milo 1.5kg")
+    assert agent.ran[0] == "go_to_search('lazada', 'Milo 1.5kg')"
+    assert details is None and done == []
+    cache.outcome("lazada", recipe, details is not None)
+    assert cache.lookup("lazada") is None
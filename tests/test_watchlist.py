@@ -0,0 +1,134 @@
+import json
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import watchlist
+from history import PriceHistory
+from watchlist import ChangeSink, WatchItem, WatchlistScheduler, load_watchlist
+
+HOUR = 3600
+
+
+class FakeExecutor:
+    # Records submissions, their futures are completed by the test
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.submitted.append((args, future))
+        return future
+
+
+def record(history, product, price, observed_at, site="fairprice", promotion=None):
+    history.record(product, {site: {"product": product, "currentPrice": price, "promotion": promotion}}, observed_at=observed_at)
+
+
+@pytest.fixture
+def history(tmp_path):
+    return PriceHistory(str(tmp_path / "prices.db"))
+
+
+@pytest.fixture
+def sink(tmp_path):
+    return ChangeSink(str(tmp_path / "changes.jsonl"), webhook_url=None)
+
+
+def scheduler(items, history, sink, **kwargs):
+    scheduler = WatchlistScheduler(items, history=history, sink=sink, dispatch_gap=0, **kwargs)
+    scheduler._executor = FakeExecutor()
+    return scheduler
+
+
+def test_load_watchlist(tmp_path):
+    path = tmp_path / "watchlist.json"
+    path.write_text(json.dumps(["Milo 1.5kg", {"product": "Tissue", "interval_minutes": 30, "sites": ["lazada"]}]))
+    first, second = load_watchlist(str(path))
+    assert first.sites == ["fairprice", "lazada"]
+    assert second.interval == 30 * 60 and second.sites == ["lazada"]
+
+    path.write_text(json.dumps([{"product": "Milo", "sites": ["nowhere"]}]))
+    with pytest.raises(ValueError):
+        load_watchlist(str(path))
+
+
+def test_priority_prefers_stale_then_volatile(history, sink):
+    now = time.time()
+    # Checked two intervals ago, price steady
+    for hours in (30, 20, 10):
+        record(history, "steady", "$10.00", now - hours * HOUR)
+    # Checked two intervals ago, price moving at every observation
+    for hours, price in ((30, "$10.00"), (20, "$12.00"), (10, "$9.00")):
+        record(history, "volatile", price, now - hours * HOUR)
+    items = [WatchItem("steady", 5 * HOUR, ["fairprice"]), WatchItem("volatile", 5 * HOUR, ["fairprice"]), WatchItem("new", HOUR, ["fairprice"])]
+    runner = scheduler(items, history, sink)
+    steady, volatile, new = (runner.priority(item, now) for item in items)
+
+    assert steady == pytest.approx(2.0, rel=0.01)
+    assert volatile == pytest.approx(2.0 * (1 + 2 / 3), rel=0.01)
+    assert new == float("inf")  # Never checked goes first
+
+
+def test_tick_dispatches_by_priority_within_limits(history, sink):
+    now = time.time()
+    record(history, "fresh", "$10.00", now - HOUR)
+    record(history, "stale", "$10.00", now - 10 * HOUR)
+    items = [
+        WatchItem("fresh", 2 * HOUR, ["fairprice"]),
+        WatchItem("stale", 2 * HOUR, ["fairprice"]),
+        WatchItem("other site", 2 * HOUR, ["lazada"]),
+    ]
+    runner = scheduler(items, history, sink, workers=2, site_concurrency=1)
+    for item in items:
+        item.next_due = now - 1
+
+    runner.tick()
+    dispatched = [args[0] for args, _ in runner._executor.submitted]
+    # "other site" was never checked so it ranks first, then "stale" takes the only fairprice slot
+    assert dispatched == ["other site", "stale"]
+    assert runner.site_load == {"fairprice": 1, "lazada": 1}
+
+    runner.tick()  # Both workers busy
+    assert len(runner._executor.submitted) == 2
+
+
+def test_finish_emits_changes_and_counts_skips(history, sink, tmp_path):
+    now = time.time()
+    record(history, "Milo", "$10.00", now - 10 * HOUR)
+    item = WatchItem("Milo", HOUR, ["fairprice"])
+    runner = scheduler([item], history, sink)
+    item.next_due = now - 1
+
+    runner.tick()
+    (_, future), = runner._executor.submitted
+    future.set_result({
+        "result": json.dumps({"fairprice": {"product": "Milo 1.5kg", "currentPrice": "$8.50", "promotion": "$1.50"}}),
+        "fingerprints": {"fairprice": "abc"},
+        "checked_sites": ["fairprice"],
+    })
+    runner.tick()
+    events = [json.loads(line) for line in (tmp_path / "changes.jsonl").read_text().splitlines()]
+    assert len(events) == 1
+    assert events[0]["previous"] == {"currentPrice": 10.0, "promotion": None}
+    assert events[0]["current"] == {"currentPrice": 8.5, "promotion": 1.5}
+    assert item.fingerprints == {"fairprice": "abc"} and item.next_due > now
+    assert runner.site_load["fairprice"] == 0
+
+    # Fingerprint unchanged: nothing checked, counted as a skip
+    item.next_due = time.time() - 1
+    runner.tick()
+    runner._executor.submitted[-1][1].set_result({"result": None, "fingerprints": {"fairprice": "abc"}, "checked_sites": []})
+    runner.tick()
+    assert item.skips == 1 and runner.stats["skipped"] == 1
+
+
+def test_forces_a_full_run_after_max_skips(history, sink, monkeypatch):
+    monkeypatch.setattr(watchlist, "WATCH_MAX_SKIPS", 2)
+    item = WatchItem("Milo", HOUR, ["fairprice"], skips=2)
+    runner = scheduler([item], history, sink)
+    item.next_due = time.time() - 1
+    runner.tick()
+    (args, _), = runner._executor.submitted
+    assert args[3] is True
@@ -0,0 +1,75 @@
+# In-page text index used by search_item_ctrl_f. The index of visible text nodes is built once per
+# page load with a TreeWalker and kept on window, a MutationObserver marks it stale when the DOM changes,
+# and matches are cached per query until then. The query is passed as a script argument, so quotes
+# and other special characters are matched literally.
+TEXT_SEARCH_SCRIPT = """
+const [query, nth, caseSensitive, maxSnippets] = arguments;
+let index = window.__agentTextIndex;
+if (!index) {
+    index = window.__agentTextIndex = {dirty: true, nodes: [], texts: [], folded: [], queries: {}, builds: 0};
+    new MutationObserver(() => { index.dirty = true; }).observe(document.documentElement, {childList: true, subtree: true, characterData: true});
+}
+if (index.dirty) {
+    // localName is lowercase for HTML and SVG elements alike, unlike tagName
+    const skipped = new Set(['script', 'style', 'noscript', 'template']);
+    const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT, {
+        acceptNode(node) {
+            const parent = node.parentElement;
+            if (!parent || skipped.has(parent.localName) || !node.textContent.trim()) return NodeFilter.FILTER_REJECT;
+            // Text of inline SVG icons and charts sits in <text> or <title> below the <svg>
+            if (parent.closest('svg')) return NodeFilter.FILTER_REJECT;
+            return parent.getClientRects().length ? NodeFilter.FILTER_ACCEPT : NodeFilter.FILTER_REJECT;
+        }
+    });
+    index.nodes = []; index.texts = []; index.folded = []; index.queries = {};
+    let node;
+    while ((node = walker.nextNode())) {
+        const text = node.textContent.replace(/\\s+/g, ' ');
+        index.nodes.push(node);
+        index.texts.push(text);
+        index.folded.push(text.toLowerCase());
+    }
+    index.dirty = false;
+    index.builds += 1;
+}
+const needle = caseSensitive ? query : query.toLowerCase();
+const key = (caseSensitive ? 'c:' : 'i:') + needle;
+let matches = index.queries[key];
+if (!matches) {
+    matches = [];
+    const haystacks = caseSensitive ? index.texts : index.folded;
+    for (let i = 0; i < haystacks.length; i++) {
+        for (let at = haystacks[i].indexOf(needle); at !== -1; at = haystacks[i].indexOf(needle, at + needle.length)) {
+            matches.push([i, at]);
+        }
+    }
+    index.queries[key] = matches;
+}
+const snippet = ([i, at]) => {
+    const text = index.texts[i];
+    const start = Math.max(0, at - 40), end = Math.min(text.length, at + needle.length + 40);
+    return (start > 0 ? '…' : '') + text.slice(start, end).trim() + (end < text.length ? '…' : '');
+};
+let focused = null;
+if (nth >= 1 && nth <= matches.length) {
+    const element = index.nodes[matches[nth - 1][0]].parentElement;
+    if (element && element.isConnected) element.scrollIntoView({block: 'center'});
+    focused = snippet(matches[nth - 1]);
+}
+return {count: matches.length, focused: focused, snippets: matches.slice(0, maxSnippets).map(snippet), builds: index.builds};
+"""
+
+
+def find_text(driver, text: str, nth_result: int = 1, case_sensitive: bool = False, max_snippets: int = 5) -> dict:
+    """
+    Finds text on the current page through the in-page index and scrolls to the nth occurrence.
+    Args:
+        driver: Selenium driver
+        text: Text to look for, matched literally
+        nth_result: Occurrence to scroll to (1-based)
+        case_sensitive: Match case exactly (default: ignore case)
+        max_snippets: Number of match snippets to return
+    Returns:
+        dict: {"count", "focused" (snippet of the nth match or None), "snippets", "builds"}
+    """
+    return driver.execute_script(TEXT_SEARCH_SCRIPT, text, nth_result, case_sensitive, max_snippets)
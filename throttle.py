@@ -0,0 +1,226 @@
+import os
+import random
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+# Pace page navigations per site (get, back, clicks that load a new page) across every browser of the process
+RATE_GOVERNOR = os.getenv("RATE_GOVERNOR", "true").lower() == "true"
+# Navigations per second and per domain: starting rate, bounds, and how many may go out back to back
+NAV_RATE_PER_SECOND = float(os.getenv("NAV_RATE_PER_SECOND", "0.5"))
+NAV_MIN_RATE = float(os.getenv("NAV_MIN_RATE", "0.05"))
+NAV_MAX_RATE = float(os.getenv("NAV_MAX_RATE", "2"))
+NAV_BURST = float(os.getenv("NAV_BURST", "3"))
+# Server response time (time to first byte of the page) above which a domain is slowed down
+NAV_TARGET_SECONDS = float(os.getenv("NAV_TARGET_SECONDS", "1.5"))
+# Longest a navigation waits for its turn
+NAV_MAX_WAIT_SECONDS = float(os.getenv("NAV_MAX_WAIT_SECONDS", "20"))
+
+NAVIGATION_COMMANDS = {"get", "goBack", "goForward", "refresh"}
+# Element clicks, and the action chains helium's click() (and typing Enter) goes through
+CLICK_COMMANDS = {"clickElement", "actions"}
+
+# Status codes and page titles of rate limiting, bot walls and overloaded servers
+ERROR_STATUSES = {403, 429}
+ERROR_TITLE = re.compile(
+    r"access denied|too many requests|just a moment|attention required|captcha|service unavailable|bad gateway|gateway time-?out",
+    re.IGNORECASE,
+)
+
+# Where the browser is after a command, and how the server answered the last page load
+PROBE_SCRIPT = """
+const nav = performance.getEntriesByType('navigation')[0];
+return [location.href, document.title, performance.timeOrigin,
+        nav ? (nav.responseStatus || 0) : 0,
+        nav && nav.responseStart ? (nav.responseStart - nav.requestStart) / 1000 : null];
+"""
+
+
+def domain_of(url: str | None) -> str | None:
+    host = urlparse(url).hostname if url and "://" in url else None
+    return host[4:] if host and host.startswith("www.") else host
+
+
+class DomainBucket:
+    # Token bucket of one domain, its rate adjusted from the responses seen
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.latency = None  # Moving average of the response time, seconds
+        self.stats = {"navigations": 0, "waited_seconds": 0.0, "errors": 0, "slowdowns": 0}
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class NavigationGovernor:
+    """
+    Per-domain token buckets every navigation goes through, shared by all sessions of the process.
+    Navigations reserve a token and wait their turn (with jitter, so parallel sessions don't fire
+    together), clicks that turned out to load a new page are charged afterwards. The rate backs off
+    multiplicatively on error pages or slow responses and creeps back up while the site answers fast.
+    """
+
+    def __init__(
+        self,
+        rate: float = NAV_RATE_PER_SECOND,
+        min_rate: float = NAV_MIN_RATE,
+        max_rate: float = NAV_MAX_RATE,
+        burst: float = NAV_BURST,
+        target_seconds: float = NAV_TARGET_SECONDS,
+        max_wait: float = NAV_MAX_WAIT_SECONDS,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.target_seconds = target_seconds
+        self.max_wait = max_wait
+        self.buckets: dict[str, DomainBucket] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, domain: str) -> DomainBucket:
+        if domain not in self.buckets:
+            self.buckets[domain] = DomainBucket(self.rate, self.burst)
+        return self.buckets[domain]
+
+    def acquire(self, url: str, wait: bool = True) -> float:
+        """
+        Takes a navigation token for the url's domain, waiting until one is available.
+        Args:
+            url: Page about to be loaded (urls without a host, like about:blank, are not paced)
+            wait: False to only charge the token, for navigations that already happened
+        Returns:
+            float: Seconds waited
+        """
+        domain = domain_of(url)
+        if domain is None:
+            return 0.0
+        with self._lock:
+            bucket = self._bucket(domain)
+            bucket.refill(time.monotonic())
+            bucket.tokens -= 1  # Reserved now, so callers queue up in order instead of racing
+            bucket.stats["navigations"] += 1
+            delay = -bucket.tokens / bucket.rate if bucket.tokens < 0 and wait else 0.0
+        if delay <= 0:
+            return 0.0
+        delay = min(delay * random.uniform(1.0, 1.2), self.max_wait)
+        time.sleep(delay)
+        with self._lock:
+            bucket.stats["waited_seconds"] += delay
+        return delay
+
+    def try_acquire(self, url: str) -> bool:
+        # Takes a token only if one is free right now, for optional navigations like prefetches
+        domain = domain_of(url)
+        if domain is None:
+            return True
+        with self._lock:
+            bucket = self._bucket(domain)
+            bucket.refill(time.monotonic())
+            if bucket.tokens < 1:
+                return False
+            bucket.tokens -= 1
+            bucket.stats["navigations"] += 1
+            return True
+
+    def observe(self, url: str, seconds: float | None, error: bool) -> None:
+        """
+        Adapts the domain's rate to how its server answered a navigation.
+        Args:
+            url: Page that was loaded
+            seconds: Server response time, None when unknown
+            error: The page was an error, rate limit or bot wall page
+        """
+        domain = domain_of(url)
+        if domain is None:
+            return
+        with self._lock:
+            bucket = self._bucket(domain)
+            if seconds is not None:
+                bucket.latency = seconds if bucket.latency is None else 0.7 * bucket.latency + 0.3 * seconds
+            if error:
+                bucket.rate = max(self.min_rate, bucket.rate * 0.5)
+                bucket.tokens = min(bucket.tokens, 0.0)  # Nothing goes out for a full interval
+                bucket.stats["errors"] += 1
+                print(f"{domain} answered with an error page, slowing down to {bucket.rate:.2f} navigation(s)/s")
+            elif bucket.latency is not None and bucket.latency > self.target_seconds:
+                bucket.rate = max(self.min_rate, bucket.rate * 0.8)
+                bucket.stats["slowdowns"] += 1
+            else:
+                bucket.rate = min(self.max_rate, bucket.rate + self.rate * 0.1)
+
+    def attach(self, driver) -> None:
+        """
+        Routes the driver's navigations through the governor by wrapping its execute, which navigations
+        by the tools, SiteTabs and the agent's own helium code all go through (JavaScript clicks report
+        through after_click). Attached once per browser.
+        """
+        if driver is None or getattr(driver.execute, "governed", False):
+            return
+        execute = driver.execute
+        # Last url seen, and the documents already seen (one per tab), so switching tabs isn't a navigation.
+        # Kept on the driver for after_click
+        state = driver.navigation_state = {"url": None, "origins": []}
+
+        def governed_execute(driver_command, params=None):
+            if driver_command not in NAVIGATION_COMMANDS and driver_command not in CLICK_COMMANDS:
+                return execute(driver_command, params)
+            url = state["url"]
+            if driver_command == "get":
+                # Playwright commands carry a coroutine instead of their parameters
+                url = params.get("url") if isinstance(params, dict) else getattr(driver, "navigating_to", None)
+            if driver_command in NAVIGATION_COMMANDS:
+                self.acquire(url)
+            started = time.monotonic()
+            try:
+                result = execute(driver_command, params)
+            except Exception:
+                if driver_command in NAVIGATION_COMMANDS:
+                    # Page load timeout or a dropped connection: the site is struggling
+                    self.observe(url, time.monotonic() - started, True)
+                raise
+            self._after(driver, driver_command, state)
+            return result
+
+        governed_execute.governed = True
+        driver.execute = governed_execute
+
+    def after_click(self, driver) -> None:
+        # Charges and observes a JavaScript click that loaded a new page, which looks like any other script to execute
+        state = getattr(driver, "navigation_state", None)
+        if state is not None:
+            self._after(driver, "clickElement", state)
+
+    def _after(self, driver, driver_command: str, state: dict) -> None:
+        # Reads where the browser landed, and charges and observes it if a new page was loaded
+        try:
+            url, title, origin, status, seconds = driver.execute_script(PROBE_SCRIPT)
+        except Exception:
+            return  # Alert open, page mid-navigation... the next navigation probes again
+        state["url"] = url
+        if origin in state["origins"]:
+            return
+        state["origins"] = state["origins"][-15:] + [origin]
+        if driver_command in CLICK_COMMANDS:
+            self.acquire(url, wait=False)
+        self.observe(url, seconds, status in ERROR_STATUSES or status >= 500 or bool(ERROR_TITLE.search(title or "")))
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                domain: {
+                    "rate": round(bucket.rate, 3),
+                    "latency_seconds": round(bucket.latency, 2) if bucket.latency is not None else None,
+                    **{key: round(value, 1) if isinstance(value, float) else value for key, value in bucket.stats.items()},
+                }
+                for domain, bucket in self.buckets.items()
+            }
+
+
+# Shared by every browser of the process
+navigation_governor = NavigationGovernor()
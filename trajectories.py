@@ -0,0 +1,153 @@
+import ast
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+# Replay the code of earlier successful runs on a site before asking the model
+TRAJECTORY_CACHE = os.getenv("TRAJECTORY_CACHE", "false").lower() == "true"
+TRAJECTORY_PATH = os.getenv("TRAJECTORY_PATH", "trajectories.json")
+# Recipes kept per site, the least reliable ones are dropped first
+TRAJECTORY_MAX_PER_SITE = int(os.getenv("TRAJECTORY_MAX_PER_SITE", "3"))
+
+# Stands for the quoted product name in a stored code step
+PRODUCT_PLACEHOLDER = "{{product_name}}"
+
+# Steps that only make sense for one page (numbered boxes and digest ids change every time)
+UNREPLAYABLE_TOOLS = re.compile(r"\b(click_mark|click_item)\s*\(")
+
+# Tool outputs that mean the step did not do what it did when it was recorded
+FAILURE_PREFIXES = ("Failed", "Could not", "No element", "Error", "Unknown site")
+
+
+def product_literals(code: str, product_name: str) -> list[str] | None:
+    """
+    String literals of a step that only make sense for the product it was recorded for: urls below a
+    site's home page and anything holding one of the product's keywords, other than the whole product
+    name, which parameterize replaces. None when the code doesn't parse.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    keywords = [keyword for keyword in product_name.lower().split() if len(keyword) >= 3]
+    found = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Constant) or not isinstance(node.value, str):
+            continue
+        text = node.value.lower()
+        if text == product_name.lower():
+            continue
+        if "://" in text and urlparse(text).path.strip("/"):
+            found.append(node.value)
+        elif any(keyword in text for keyword in keywords):
+            found.append(node.value)
+    return found
+
+
+def parameterize(code: str, product_name: str) -> str:
+    # Replaces string literals holding the product name (any case) by the placeholder
+    pattern = re.compile(r"""(['"])""" + re.escape(product_name) + r"\1", re.IGNORECASE)
+    return pattern.sub(PRODUCT_PLACEHOLDER, code)
+
+
+def instantiate(template: str, product_name: str) -> str:
+    return template.replace(PRODUCT_PLACEHOLDER, repr(product_name))
+
+
+def url_shape(url: str | None) -> str:
+    """
+    What kind of page a url is, independent of the product: host and first path segment,
+    e.g. "lazada.sg/catalog" for a results page and "lazada.sg/products" for a product page.
+    """
+    if not url or "://" not in url:
+        return ""
+    parsed = urlparse(url)
+    host = parsed.hostname or ""
+    host = host[4:] if host.startswith("www.") else host
+    segment = parsed.path.strip("/").split("/")[0]
+    return f"{host}/{segment}"
+
+
+def is_failure(output) -> bool:
+    return isinstance(output, str) and output.startswith(FAILURE_PREFIXES)
+
+
+class TrajectoryCache:
+    """
+    Successful agent runs per site, stored as the code of each step with the product name
+    parameterized and the kind of page each step ended on. A recipe that keeps diverging
+    on replay sinks below the others and is eventually dropped.
+    """
+
+    def __init__(self, path: str = TRAJECTORY_PATH, max_per_site: int = TRAJECTORY_MAX_PER_SITE):
+        self.path = path
+        self.max_per_site = max_per_site
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.recipes: dict[str, list[dict]] = json.load(f)
+        except FileNotFoundError:
+            self.recipes = {}
+        except (OSError, ValueError) as e:
+            print(f"Could not read trajectories from {path}: {str(e)}")
+            self.recipes = {}
+
+    @staticmethod
+    def score(recipe: dict) -> float:
+        return recipe["successes"] - 2 * recipe["failures"]
+
+    def lookup(self, site: str) -> dict | None:
+        # Most reliable recipe of the site, or None
+        with self._lock:
+            recipes = [recipe for recipe in self.recipes.get(site, []) if self.score(recipe) > 0]
+            return max(recipes, key=self.score, default=None)
+
+    def record(self, site: str, product_name: str, steps: list[tuple[str, str]]) -> bool:
+        """
+        Stores the steps of a successful run.
+        Args:
+            site: Site name
+            product_name: The product the run searched for
+            steps: (code, url after the step) of every step that ran without error, in order
+        Returns:
+            bool: False when the run can't be replayed for another product
+        """
+        if not steps or any(UNREPLAYABLE_TOOLS.search(code) for code, _ in steps):
+            return False
+        if any(product_literals(code, product_name) != [] for code, _ in steps):
+            return False  # Would open or look for the recorded product again whatever the product asked for
+        recorded = [{"code": parameterize(code, product_name), "shape": url_shape(url)} for code, url in steps]
+        if not any(PRODUCT_PLACEHOLDER in step["code"] for step in recorded):
+            return False  # Never mentions the product, so it would find this product again
+        with self._lock:
+            recipes = self.recipes.setdefault(site, [])
+            for recipe in recipes:
+                if [step["code"] for step in recipe["steps"]] == [step["code"] for step in recorded]:
+                    recipe["successes"] += 1
+                    recipe["steps"] = recorded  # Latest page kinds
+                    break
+            else:
+                recipes.append({"steps": recorded, "successes": 1, "failures": 0, "created_at": time.time()})
+            recipes.sort(key=self.score, reverse=True)
+            del recipes[self.max_per_site:]
+            self._save()
+        return True
+
+    def outcome(self, site: str, recipe: dict, ok: bool) -> None:
+        with self._lock:
+            recipe["successes" if ok else "failures"] += 1
+            recipe["last_used"] = time.time()
+            self._save()
+
+    def _save(self) -> None:
+        # Write to a temporary file first, so a crash never leaves half a file
+        temporary = self.path + ".tmp"
+        try:
+            with open(temporary, "w") as f:
+                json.dump(self.recipes, f, indent=2)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            print(f"Could not save trajectories to {self.path}: {str(e)}")
@@ -0,0 +1,304 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import requests
+from dotenv import load_dotenv
+
+from history import PriceHistory, normalize_product, parse_price
+from sites import SITE_ADAPTERS, SiteAdapter
+
+load_dotenv()
+
+# Products to keep re-pricing, see README for the format
+WATCHLIST_PATH = os.getenv("WATCHLIST_PATH", "watchlist.json")
+# Price change events are appended here as JSON lines
+WATCH_EVENTS_PATH = os.getenv("WATCH_EVENTS_PATH", "price_changes.jsonl")
+# Optional url every change event is POSTed to
+WATCH_WEBHOOK_URL = os.getenv("WATCH_WEBHOOK_URL")
+# Comparisons running at once, each in its own worker process and browser
+WATCH_WORKERS = int(os.getenv("WATCH_WORKERS", "2"))
+# Comparisons allowed to hit the same site at once
+WATCH_SITE_CONCURRENCY = int(os.getenv("WATCH_SITE_CONCURRENCY", "1"))
+WATCH_DEFAULT_INTERVAL_MINUTES = float(os.getenv("WATCH_DEFAULT_INTERVAL_MINUTES", "360"))
+# Minimum gap between two dispatched refreshes, so work is spread out instead of spiking
+WATCH_DISPATCH_GAP_SECONDS = float(os.getenv("WATCH_DISPATCH_GAP_SECONDS", "30"))
+# Force a full agent run after this many cheap "unchanged" checks in a row
+WATCH_MAX_SKIPS = int(os.getenv("WATCH_MAX_SKIPS", "4"))
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Displayed prices ("$1,299.00") and prices embedded in page JSON ("price":"1299.00")
+PRICE_PATTERN = re.compile(r'(?:\$|"price"\s*:\s*"?)\s?(\d[\d,]*(?:\.\d{1,2})?)')
+
+
+@dataclass
+class WatchItem:
+    product: str
+    interval: float  # Seconds between refreshes
+    sites: list[str]
+    next_due: float = 0.0
+    last_checked: float = 0.0
+    fingerprints: dict[str, str] = field(default_factory=dict)
+    skips: int = 0
+
+
+def load_watchlist(path: str = WATCHLIST_PATH) -> list[WatchItem]:
+    """
+    Reads the watchlist file: a JSON list of product names or objects such as
+    {"product": "Milo 1.5kg", "interval_minutes": 120, "sites": ["fairprice"]}.
+    Args:
+        path: Watchlist file
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    items = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"product": entry}
+        sites = entry.get("sites") or list(SITE_ADAPTERS)
+        unknown = [name for name in sites if name not in SITE_ADAPTERS]
+        if unknown:
+            raise ValueError(f"Unknown site(s) {unknown} for '{entry['product']}'")
+        items.append(WatchItem(
+            product=entry["product"],
+            interval=float(entry.get("interval_minutes", WATCH_DEFAULT_INTERVAL_MINUTES)) * 60,
+            sites=sites,
+        ))
+    return items
+
+
+def price_fingerprint(adapter: SiteAdapter, product_name: str) -> str | None:
+    """
+    Cheap change check: hashes the prices found in the raw search results page, fetched without a browser.
+    Args:
+        adapter: Site to check
+        product_name: The product to search for
+    Returns:
+        str | None: Fingerprint, or None when the page gave nothing usable (blocked, rendered client side...)
+    """
+    try:
+        response = requests.get(adapter.search_url(product_name), headers={"User-Agent": USER_AGENT}, timeout=10)
+    except requests.RequestException:
+        return None
+    if response.status_code != 200:
+        return None
+    prices = PRICE_PATTERN.findall(response.text)[:50]
+    if not prices:
+        return None
+    return hashlib.sha1(" ".join(prices).encode()).hexdigest()
+
+
+def _init_worker() -> None:
+    # Every worker drives its own browser, so they can't share a DevTools port
+    os.environ["CHROME_DEBUG_PORT"] = "0"
+    load_dotenv()
+
+
+def refresh_product(product_name: str, sites: list[str], fingerprints: dict[str, str], force: bool) -> dict:
+    """
+    Worker job: re-prices a product on the sites whose quick fingerprint changed.
+    Args:
+        product_name: The product to refresh
+        sites: Sites to check
+        fingerprints: Fingerprints from the previous check, per site
+        force: Run the agent even if nothing seems to have changed
+    Returns:
+        dict: {"result": combined JSON or None, "fingerprints": {...}, "checked_sites": [...]}
+    """
+    new_fingerprints = {name: price_fingerprint(SITE_ADAPTERS[name], product_name) for name in sites}
+    to_check = [
+        name for name in sites
+        if force or new_fingerprints[name] is None or new_fingerprints[name] != fingerprints.get(name)
+    ]
+    result = None
+    if to_check:
+        # Imported here so the scheduler process never loads selenium or the model
+        import comparison
+        result = comparison.run_multi_site_search(product_name, sites=to_check)
+    return {"result": result, "fingerprints": new_fingerprints, "checked_sites": to_check}
+
+
+class ChangeSink:
+    """
+    Writes price change events to a JSONL file and, when configured, to a webhook.
+    """
+
+    def __init__(self, path: str = WATCH_EVENTS_PATH, webhook_url: str = WATCH_WEBHOOK_URL):
+        self.path = path
+        self.webhook_url = webhook_url
+        self._lock = threading.Lock()
+
+    def emit(self, event: dict) -> None:
+        line = json.dumps(event)
+        with self._lock:
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write(line + "\n")
+        if self.webhook_url:
+            try:
+                requests.post(self.webhook_url, data=line, headers={"Content-Type": "application/json"}, timeout=10)
+            except requests.RequestException as e:
+                print(f"Could not deliver change event to webhook: {str(e)}")
+
+
+class WatchlistScheduler:
+    """
+    Re-prices a watchlist in the background. Due items are refreshed most stale and most volatile first,
+    with bounded concurrency overall and per site, and a change event is emitted whenever the current
+    price or the promotion of a product changes.
+    """
+
+    def __init__(
+        self,
+        items: list[WatchItem],
+        history: PriceHistory = None,
+        sink: ChangeSink = None,
+        workers: int = WATCH_WORKERS,
+        site_concurrency: int = WATCH_SITE_CONCURRENCY,
+        dispatch_gap: float = WATCH_DISPATCH_GAP_SECONDS,
+    ):
+        self.items = items
+        self.history = history or PriceHistory()
+        self.sink = sink or ChangeSink()
+        self.workers = workers
+        self.site_concurrency = site_concurrency
+        self.dispatch_gap = dispatch_gap
+        self.in_flight = {}  # future -> (item, prices before the refresh)
+        self.site_load = {name: 0 for name in SITE_ADAPTERS}
+        self.last_dispatch = 0.0
+        self.stats = {"refreshed": 0, "skipped": 0, "changes": 0, "failed": 0}
+        self._executor = None
+
+        # Carry on from the stored history and spread the first refreshes over each item's interval
+        now = time.time()
+        for item in self.items:
+            stored = self.history.latest(item.product)
+            item.last_checked = max((row["observed_at"] for row in stored.values()), default=0.0)
+            if item.last_checked:
+                item.next_due = item.last_checked + item.interval * random.uniform(0.9, 1.1)
+            else:
+                item.next_due = now + random.uniform(0, min(item.interval, self.dispatch_gap * len(self.items)))
+
+    def priority(self, item: WatchItem, now: float) -> float:
+        # Staleness in intervals, boosted for products whose price moved often lately
+        staleness = (now - item.last_checked) / item.interval if item.last_checked else float("inf")
+        month_ago = now - 30 * 24 * 3600
+        observations = sum(stats["observations"] for stats in self.history.price_range(item.product, month_ago).values())
+        changes = len(self.history.change_points(item.product, since=month_ago))
+        volatility = changes / observations if observations else 0.0
+        return staleness * (1 + volatility)
+
+    def _has_capacity(self, item: WatchItem) -> bool:
+        return all(self.site_load[name] < self.site_concurrency for name in item.sites)
+
+    def tick(self) -> None:
+        """
+        Collects finished refreshes and dispatches due items while there is capacity.
+        """
+        for future in [future for future in self.in_flight if future.done()]:
+            self._finish(future)
+
+        now = time.time()
+        busy = {id(item) for item, _ in self.in_flight.values()}
+        due = [item for item in self.items if item.next_due <= now and id(item) not in busy]
+        for item in sorted(due, key=lambda item: self.priority(item, now), reverse=True):
+            if len(self.in_flight) >= self.workers or now - self.last_dispatch < self.dispatch_gap:
+                break
+            if not self._has_capacity(item):
+                continue
+            self._dispatch(item)
+            now = self.last_dispatch = time.time()
+
+    def _dispatch(self, item: WatchItem) -> None:
+        force = item.skips >= WATCH_MAX_SKIPS
+        before = self.history.latest(item.product)
+        future = self._executor.submit(refresh_product, item.product, item.sites, dict(item.fingerprints), force)
+        self.in_flight[future] = (item, before)
+        for name in item.sites:
+            self.site_load[name] += 1
+        print(f"Refreshing '{item.product}' on {', '.join(item.sites)}")
+
+    def _finish(self, future) -> None:
+        item, before = self.in_flight.pop(future)
+        for name in item.sites:
+            self.site_load[name] -= 1
+        now = time.time()
+        item.next_due = now + item.interval * random.uniform(0.9, 1.1)
+        try:
+            outcome = future.result()
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"Refresh of '{item.product}' failed: {str(e)}")
+            return
+
+        item.last_checked = now
+        item.fingerprints.update({name: value for name, value in outcome["fingerprints"].items() if value})
+        if not outcome["checked_sites"]:
+            item.skips += 1
+            self.stats["skipped"] += 1
+            return
+        item.skips = 0
+        self.stats["refreshed"] += 1
+        if outcome["result"]:
+            self._emit_changes(item, before, json.loads(outcome["result"]), outcome["checked_sites"])
+
+    def _emit_changes(self, item: WatchItem, before: dict, after: dict, sites: list[str]) -> None:
+        for name in sites:
+            previous = before.get(name)
+            current = after.get(name) or {}
+            if previous is None or not current:
+                continue
+            old = {"currentPrice": previous["current_price"], "promotion": previous["promotion"]}
+            new = {
+                "currentPrice": parse_price(current.get("currentPrice")),
+                "promotion": parse_price(current.get("promotion")),
+            }
+            if new["currentPrice"] is None or new == old:
+                continue
+            self.stats["changes"] += 1
+            self.sink.emit({
+                "type": "price_change",
+                "product": item.product,
+                "product_key": normalize_product(item.product),
+                "site": name,
+                "product_name": current.get("product"),
+                "observed_at": time.time(),
+                "previous": old,
+                "current": new,
+            })
+
+    def run_forever(self, stop_event: threading.Event = None, poll_seconds: float = 5.0) -> None:
+        """
+        Runs the scheduler until stop_event is set.
+        Args:
+            stop_event: Event that stops the loop (default: run until interrupted)
+            poll_seconds: How often due items are looked at
+        """
+        stop_event = stop_event or threading.Event()
+        context = multiprocessing.get_context("spawn")  # Fresh interpreter per worker, with its own helium driver
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker) as executor:
+            self._executor = executor
+            try:
+                while not stop_event.is_set():
+                    self.tick()
+                    stop_event.wait(poll_seconds)
+            finally:
+                for future in list(self.in_flight):
+                    future.cancel()
+                print(f"Watchlist stopped: {self.stats}")
+
+
+if __name__ == "__main__":
+    scheduler = WatchlistScheduler(load_watchlist())
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass